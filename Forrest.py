@@ -57,7 +57,7 @@ def install_package_with_retry(package, max_retries=3, timeout=30):
             break
     return False
 
-# Paquetes esenciales (sin ta y arch inicialmente)
+# Paquetes esenciales (sin arch inicialmente)
 essential_packages = [
     'gdown',
     'xgboost',
@@ -70,8 +70,8 @@ essential_packages = [
 ]
 
 # Paquetes problemáticos (intentar con diferentes estrategias)
+# ta ya no se instala: los indicadores tienen backend NumPy propio (config.INDICATOR_BACKEND)
 problematic_packages = {
-    'ta': ['ta==0.11.0', 'ta==0.10.2', 'ta'],  # Intentar diferentes versiones
     'arch': ['arch', 'arch==5.3.1']
 }
 
@@ -125,10 +125,6 @@ if failed_packages:
     print('   1. Verifica que "Internet" esté habilitado en Configuración')
     print('   2. Espera 10-15 minutos y vuelve a ejecutar esta celda')
     print('   3. Intenta en horario diferente (menos tráfico en Kaggle)')
-    if 'ta' in failed_packages:
-        print('\n💡 ALTERNATIVA PARA TA:')
-        print('   Si "ta" no se instala, el notebook puede funcionar sin algunos')
-        print('   indicadores técnicos avanzados. Los básicos están disponibles.')
     if 'arch' in failed_packages:
         print('\n💡 ALTERNATIVA PARA ARCH:')
         print('   "arch" es para modelos GARCH de volatilidad. Si no se instala,')
@@ -142,7 +138,7 @@ print('='*70)
 print('\n🔍 Verificando importaciones...')
 import importlib
 verification = {}
-for pkg in ['xgboost', 'lightgbm', 'plotly', 'optuna', 'statsmodels', 'ta']:
+for pkg in ['xgboost', 'lightgbm', 'plotly', 'optuna', 'statsmodels']:
     try:
         importlib.import_module(pkg)
         verification[pkg] = True
@@ -213,16 +209,15 @@ try:
 except:
     PLOTLY_AVAILABLE = False
 
-# Indicadores técnicos (opcional - usa implementación manual si no disponible)
+# Indicadores técnicos (opcional - el backend NumPy no necesita ninguna biblioteca)
 TA_AVAILABLE = False
 try:
     import ta
     TA_AVAILABLE = True
-    print("✅ ta disponible - usando biblioteca ta")
+    print("✅ ta disponible (backend opcional y referencia de paridad)")
 except ImportError:
     TA_AVAILABLE = False
-    print("⚠️  ta no disponible - usando implementación manual de indicadores")
-    print("   RSI, MACD, Bollinger Bands, etc. se calcularán manualmente")
+    print("ℹ️  ta no instalado - los indicadores usan el backend NumPy")
 
 TALIB_AVAILABLE = False
 try:
@@ -232,6 +227,13 @@ try:
 except:
     pass
 
+# Compilación JIT de los indicadores recursivos (opcional - sin numba se ejecutan en Python)
+try:
+    import numba
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
 # Series temporales
 try:
     import statsmodels.api as sm
@@ -243,6 +245,8 @@ try:
     STATSMODELS_AVAILABLE = True
 except:
     STATSMODELS_AVAILABLE = False
+# Tests ADF/KPSS de analyze_stationarity (sin statsmodels: heurística de mitades)
+STATIONARITY_AVAILABLE = STATSMODELS_AVAILABLE
 
 try:
     from arch import arch_model
@@ -250,9 +254,17 @@ try:
 except:
     ARCH_AVAILABLE = False
 
+# Formato columnar binario (caché de datos M1)
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
 # Scipy
 from scipy import stats as scipy_stats
-from scipy.signal import savgol_filter, find_peaks
+from scipy.signal import savgol_filter, find_peaks, lfilter
 import psutil
 
 # Configuración plotting
@@ -267,7 +279,7 @@ print(f'📊 Timeframes disponibles: Variable según configuración')
 import sys
 import importlib
 
-packages = ['ta', 'xgboost', 'lightgbm', 'plotly', 'optuna', 'statsmodels']
+packages = ['xgboost', 'lightgbm', 'plotly', 'optuna', 'statsmodels']
 
 print("Verificando paquetes instalados:\n")
 for pkg in packages:
@@ -530,6 +542,14 @@ class Config:
     # Timeframes a analizar
     TIMEFRAMES = ['15min','30min','1H','4H','1D']
 
+    # Contexto de timeframes superiores en add_features: columnas de la última barra cerrada
+    # de cada uno ('1W' se agrega desde las barras diarias, semanas de domingo a domingo)
+    CONTEXT_FEATURES = {
+        '4H': ['close', 'tick_volume'],
+        '1D': ['close', 'high', 'low'],
+        '1W': ['close'],
+    }
+
     # Métricas a calcular
     REGRESSION_METRICS = ['mae', 'mse', 'rmse', 'r2', 'mape', 'evs']
     CLASSIFICATION_METRICS = ['accuracy', 'precision', 'recall', 'f1', 'roc_auc']
@@ -537,6 +557,60 @@ class Config:
     # Hiperparámetros para optimización
     HYPERPARAM_ITERATIONS = 50
 
+    # Caché binaria de datos M1 (evita re-parsear el CSV en cada ejecución)
+    USE_DATA_CACHE = True
+    DATA_CACHE_DIR = os.path.join(DATA_PATH, 'cache')
+
+    # Lectura en streaming del histórico M1
+    STREAM_CHUNK_BYTES = 64 * 1024 * 1024   # ~1M filas M1 por bloque
+    LOAD_MOST_RECENT = True                 # nrows toma las filas más recientes, no las más antiguas
+
+    # Backend de resample_timeframe: 'numpy' (kernel reduceat) o 'pandas' (resample().agg)
+    RESAMPLE_BACKEND = 'numpy'
+
+    # Almacén persistente de features (se reutilizan si las barras no cambian)
+    USE_FEATURE_STORE = True
+    FEATURE_STORE_DIR = os.path.join(DATA_PATH, 'features')
+
+    # Almacén de columnas M1 mapeado en memoria (compartido entre procesos): fuente M1
+    # de stream_timeframes en lugar de volver a parsear el CSV en cada ejecución
+    USE_COLUMN_STORE = True
+    COLUMN_STORE_DIR = os.path.join(DATA_PATH, 'columns')
+
+    # Reentrenar calculando solo las features seleccionadas en la ejecución anterior
+    # (guardadas fuera de OUTPUT_PATH, que cambia en cada ejecución)
+    REUSE_SELECTED_FEATURES = False
+    SELECTED_FEATURES_DIR = os.path.join(DATA_PATH, 'selected_features')
+
+    # Tipo de las features en cada etapa (add_features, regímenes, prepare_ml_data, scale_data):
+    # 'float32' reduce a la mitad la matriz de features; 'float64' conserva el comportamiento anterior
+    FEATURE_DTYPE = 'float32'
+
+    # Procesos para las features de cada timeframe en create_multiple_timeframes (1 = en serie)
+    FEATURE_WORKERS = min(4, os.cpu_count() or 1)
+
+    # Backend de indicadores técnicos: 'auto' (TA-Lib, numba o NumPy, el primero instalado),
+    # 'talib', 'numba' (kernels JIT), 'numpy' (vectorizado, mismos valores que ta) o 'ta'
+    INDICATOR_BACKEND = 'auto'
+
+    # Tests de estacionariedad (ADF/KPSS): como mucho STATIONARITY_MAX_SAMPLES puntos por serie
+    # (None = toda la serie), los más recientes ('recent') o uno de cada k ('decimate'),
+    # en STATIONARITY_WORKERS procesos cuando hay varias series pendientes
+    STATIONARITY_MAX_SAMPLES = 20_000
+    STATIONARITY_SAMPLE_MODE = 'recent'
+    STATIONARITY_WORKERS = min(4, os.cpu_count() or 1)
+
+    # Regímenes (GMM): ajuste sobre ~REGIME_MAX_SAMPLES filas estratificadas, predicción por
+    # bloques de REGIME_BATCH_ROWS filas y modelo persistido por archivo de datos y timeframe
+    # para arrancar en caliente
+    REGIME_MAX_SAMPLES = 50_000
+    REGIME_BATCH_ROWS = 200_000
+    REGIME_WARM_START = True
+    REGIME_MODEL_DIR = os.path.join(DATA_PATH, 'regimes')
+
+    # Benchmarks de rendimiento (desactivados en ejecuciones normales)
+    RUN_BENCHMARKS = False
+
 config = Config()
 
 
@@ -943,246 +1017,4670 @@ def get_timeframe_adjusted_models(timeframe, model_config):
         'ridge_reg': Ridge(alpha=1.0, random_state=config.RANDOM_STATE),
     }
 
-    base_models_clf = {
-        'xgb_clf': xgb.XGBClassifier(
-            n_estimators=model_config['n_estimators'],
-            max_depth=model_config['max_depth'],
-            reg_alpha=xgb_reg_alpha,
-            reg_lambda=xgb_reg_lambda,
-            random_state=config.RANDOM_STATE,
-            n_jobs=-1,
-            use_label_encoder=False,
-            eval_metric='logloss'
-        ),
-        'lgb_clf': lgb.LGBMClassifier(
-            n_estimators=model_config['n_estimators'],
-            max_depth=model_config['max_depth'],
-            reg_alpha=lgb_reg_alpha,
-            reg_lambda=lgb_reg_lambda,
-            random_state=config.RANDOM_STATE,
-            n_jobs=-1,
-            verbose=-1
-        ),
-        'rf_clf': RandomForestClassifier(
-            n_estimators=model_config['n_estimators'],
-            max_depth=model_config['max_depth'],
-            min_samples_split=model_config['min_samples_split'],
-            min_samples_leaf=model_config['min_samples_leaf'],
-            max_features=model_config['max_features'],
-            random_state=config.RANDOM_STATE,
-            n_jobs=-1
-        ),
-        'logistic_clf': LogisticRegression(
-            max_iter=1000,
-            random_state=config.RANDOM_STATE,
-            n_jobs=-1
-        ),
-    }
+    base_models_clf = {
+        'xgb_clf': xgb.XGBClassifier(
+            n_estimators=model_config['n_estimators'],
+            max_depth=model_config['max_depth'],
+            reg_alpha=xgb_reg_alpha,
+            reg_lambda=xgb_reg_lambda,
+            random_state=config.RANDOM_STATE,
+            n_jobs=-1,
+            use_label_encoder=False,
+            eval_metric='logloss'
+        ),
+        'lgb_clf': lgb.LGBMClassifier(
+            n_estimators=model_config['n_estimators'],
+            max_depth=model_config['max_depth'],
+            reg_alpha=lgb_reg_alpha,
+            reg_lambda=lgb_reg_lambda,
+            random_state=config.RANDOM_STATE,
+            n_jobs=-1,
+            verbose=-1
+        ),
+        'rf_clf': RandomForestClassifier(
+            n_estimators=model_config['n_estimators'],
+            max_depth=model_config['max_depth'],
+            min_samples_split=model_config['min_samples_split'],
+            min_samples_leaf=model_config['min_samples_leaf'],
+            max_features=model_config['max_features'],
+            random_state=config.RANDOM_STATE,
+            n_jobs=-1
+        ),
+        'logistic_clf': LogisticRegression(
+            max_iter=1000,
+            random_state=config.RANDOM_STATE,
+            n_jobs=-1
+        ),
+    }
+
+    # ════════════════════════════════════════════════════════════════════════
+    # AGREGAR MODELOS SEGÚN TIMEFRAME
+    # ════════════════════════════════════════════════════════════════════════
+
+    if timeframe in ['1min', '5min']:
+        # ────────────────────────────────────────────────────────────────────
+        # TIMEFRAMES CORTOS: Modelos base + ligeros
+        # Total: 5 regresión + 4 clasificación = 9 modelos
+        # ────────────────────────────────────────────────────────────────────
+        adjusted_models_reg = base_models_reg.copy()
+        adjusted_models_clf = base_models_clf.copy()
+        print(f"   📊 {timeframe}: Usando 9 modelos (5 reg + 4 clf)")
+
+    elif timeframe in ['15min', '30min', '1H']:
+        # ────────────────────────────────────────────────────────────────────
+        # TIMEFRAMES MEDIOS: Base + modelos adicionales + redes neuronales
+        # Total: 8 regresión + 7 clasificación = 15 modelos
+        # ────────────────────────────────────────────────────────────────────
+        adjusted_models_reg = base_models_reg.copy()
+        adjusted_models_reg.update({
+            'lasso_reg': Lasso(alpha=0.1, random_state=config.RANDOM_STATE, max_iter=2000),
+            'svr': SVR(kernel='rbf', C=1.0, gamma='scale'),
+            'gbr': GradientBoostingRegressor(
+                n_estimators=min(100, model_config['n_estimators']),
+                max_depth=min(5, model_config['max_depth']),
+                random_state=config.RANDOM_STATE
+            ),
+        })
+
+        adjusted_models_clf = base_models_clf.copy()
+        adjusted_models_clf.update({
+            'svm_clf': SVC(
+                kernel='rbf',
+                C=1.0,
+                gamma='scale',
+                probability=True,
+                random_state=config.RANDOM_STATE
+            ),
+            'gbc': GradientBoostingClassifier(
+                n_estimators=min(100, model_config['n_estimators']),
+                max_depth=min(5, model_config['max_depth']),
+                random_state=config.RANDOM_STATE
+            ),
+            'mlp_clf': MLPClassifier(
+                hidden_layer_sizes=(128, 64),
+                max_iter=500,
+                random_state=config.RANDOM_STATE,
+                early_stopping=True
+            ),
+        })
+        print(f"   📊 {timeframe}: Usando 14 modelos (8 reg + 6 clf)")
+
+    else:  # '4H', '1D', '3D', '7D'
+        # ────────────────────────────────────────────────────────────────────
+        # TIMEFRAMES LARGOS: Todos los modelos
+        # Total: 10 regresión + 9 clasificación = 19 modelos
+        # ────────────────────────────────────────────────────────────────────
+        adjusted_models_reg = base_models_reg.copy()
+        adjusted_models_reg.update({
+            'lasso_reg': Lasso(alpha=0.1, random_state=config.RANDOM_STATE, max_iter=2000),
+            'elasticnet_reg': ElasticNet(
+                alpha=0.1,
+                l1_ratio=0.5,
+                random_state=config.RANDOM_STATE,
+                max_iter=2000
+            ),
+            'svr': SVR(kernel='rbf', C=1.0, gamma='scale'),
+            'gbr': GradientBoostingRegressor(
+                n_estimators=min(150, model_config['n_estimators']),
+                max_depth=min(6, model_config['max_depth']),
+                random_state=config.RANDOM_STATE
+            ),
+            'ada_reg': AdaBoostRegressor(
+                n_estimators=50,
+                random_state=config.RANDOM_STATE
+            ),
+            'mlp_reg': MLPRegressor(
+                hidden_layer_sizes=(256, 128, 64),
+                max_iter=500,
+                random_state=config.RANDOM_STATE,
+                early_stopping=True,
+                validation_fraction=0.1
+            ),
+        })
+
+        adjusted_models_clf = base_models_clf.copy()
+        adjusted_models_clf.update({
+            'svm_clf': SVC(
+                kernel='rbf',
+                C=1.0,
+                gamma='scale',
+                probability=True,
+                random_state=config.RANDOM_STATE
+            ),
+            'gbc': GradientBoostingClassifier(
+                n_estimators=min(150, model_config['n_estimators']),
+                max_depth=min(6, model_config['max_depth']),
+                random_state=config.RANDOM_STATE
+            ),
+            'ada_clf': AdaBoostClassifier(
+                n_estimators=50,
+                random_state=config.RANDOM_STATE
+            ),
+            'mlp_clf': MLPClassifier(
+                hidden_layer_sizes=(256, 128, 64),
+                max_iter=500,
+                random_state=config.RANDOM_STATE,
+                early_stopping=True,
+                validation_fraction=0.1
+            ),
+        })
+        print(f"   📊 {timeframe}: Usando 19 modelos (10 reg + 9 clf)")
+
+    return adjusted_models_reg, adjusted_models_clf
+
+
+
+
+
+
+# Utilidades
+def clear_memory():
+    """Limpiar memoria"""
+    gc.collect()
+    if TF_AVAILABLE and hasattr(tf, 'keras'):
+        tf.keras.backend.clear_session()
+
+def get_memory_usage():
+    """Obtener uso de memoria"""
+    try:
+        process = psutil.Process(os.getpid())
+        return f"RAM: {process.memory_info().rss / 1024 / 1024:.0f} MB"
+    except:
+        return "RAM: N/A"
+
+def timer_decorator(func):
+    """Decorador para medir tiempo de ejecución"""
+    def wrapper(*args, **kwargs):
+        start_time = time.time()
+        result = func(*args, **kwargs)
+        end_time = time.time()
+        print(f"{func.__name__} ejecutado en {end_time - start_time:.2f} segundos")
+        return result
+    return wrapper
+
+
+# ============================================================================
+print("class AdaptiveDataManager")
+
+# @title
+# [3B] CACHÉ BINARIA COLUMNAR PARA DATOS M1
+import hashlib
+
+# Mapeo de nombres de columnas del export de MT5
+MT5_COLUMN_MAPPING = {
+    '<DATE>': 'date',
+    '<TIME>': 'time',
+    '<OPEN>': 'open',
+    '<HIGH>': 'high',
+    '<LOW>': 'low',
+    '<CLOSE>': 'close',
+    '<TICKVOL>': 'tick_volume',
+    '<VOL>': 'real_volume',
+    '<SPREAD>': 'spread'
+}
+
+MT5_CSV_DTYPES = {
+    '<OPEN>': 'float32',
+    '<HIGH>': 'float32',
+    '<LOW>': 'float32',
+    '<CLOSE>': 'float32',
+    '<TICKVOL>': 'int32',
+    '<SPREAD>': 'int16',
+    '<VOL>': 'int32'
+}
+
+# Columnas del frame M1 ya tipado (orden y dtype tal como los devuelve load_data)
+MT5_FRAME_DTYPES = {
+    'time': 'int64',          # timestamps en ns (datetime64[ns] al cargar)
+    'open': 'float32',
+    'high': 'float32',
+    'low': 'float32',
+    'close': 'float32',
+    'tick_volume': 'int32',
+    'real_volume': 'int32',
+    'spread': 'int16',
+}
+
+
+def source_key(filepath: str) -> str:
+    """Clave de archivo fuente para cachés: nombre + hash de la ruta absoluta
+
+    Dos exports con el mismo nombre en carpetas distintas no comparten entrada.
+    """
+    stem = os.path.splitext(os.path.basename(filepath))[0]
+    digest = hashlib.blake2b(os.path.abspath(filepath).encode(), digest_size=4).hexdigest()
+    return f'{stem}_{digest}'
+
+
+class MT5BinaryCache:
+    """Caché binaria del CSV M1 de MT5 ya parseado y tipado.
+
+    La primera carga parsea el archivo completo y guarda el frame en formato
+    columnar (Feather/Arrow si pyarrow está disponible, .npz si no). Las
+    siguientes cargas del mismo archivo leen directamente el binario.
+
+    La validez se comprueba por tamaño + mtime y, si el mtime cambió (p. ej. el
+    archivo se volvió a descargar), por hash de contenido. Las entradas se indexan
+    por source_key (nombre + ruta absoluta) y los metadatos guardan la ruta, que
+    lookup comprueba.
+    """
+
+    CACHE_VERSION = 1
+    HASH_BLOCK_SIZE = 8 * 1024 * 1024
+
+    def __init__(self, cache_dir: Optional[str] = None):
+        self.cache_dir = cache_dir or config.DATA_CACHE_DIR
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _meta_path(self, filepath: str) -> str:
+        return os.path.join(self.cache_dir, f'{source_key(filepath)}.cache.json')
+
+    def _data_path(self, filepath: str, content_hash: str) -> str:
+        ext = 'feather' if PYARROW_AVAILABLE else 'npz'
+        return os.path.join(self.cache_dir, f'{source_key(filepath)}_{content_hash[:16]}.{ext}')
+
+    @classmethod
+    def content_hash(cls, filepath: str) -> str:
+        """Hash BLAKE2b del contenido completo del archivo"""
+        h = hashlib.blake2b(digest_size=20)
+        with open(filepath, 'rb') as f:
+            for block in iter(lambda: f.read(cls.HASH_BLOCK_SIZE), b''):
+                h.update(block)
+        return h.hexdigest()
+
+    def _read_meta(self, filepath: str) -> Optional[dict]:
+        meta_path = self._meta_path(filepath)
+        if not os.path.exists(meta_path):
+            return None
+        try:
+            with open(meta_path, 'r') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if meta.get('version') != self.CACHE_VERSION:
+            return None
+        return meta
+
+    def _write_meta(self, filepath: str, meta: dict):
+        meta_path = self._meta_path(filepath)
+        tmp_path = meta_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f, indent=2)
+        os.replace(tmp_path, meta_path)
+
+    def lookup(self, filepath: str) -> Optional[dict]:
+        """Devuelve los metadatos de la caché si sigue siendo válida para filepath"""
+        meta = self._read_meta(filepath)
+        if meta is None or not os.path.exists(meta.get('cache_file', '')):
+            return None
+        if meta.get('source') != os.path.abspath(filepath):
+            return None
+
+        stat = os.stat(filepath)
+        if stat.st_size != meta['size']:
+            return None
+        if stat.st_mtime_ns == meta['mtime_ns']:
+            return meta
+
+        # Mismo tamaño pero mtime distinto: decidir por contenido
+        if self.content_hash(filepath) != meta['content_hash']:
+            return None
+        meta['mtime_ns'] = stat.st_mtime_ns
+        self._write_meta(filepath, meta)
+        return meta
+
+    def load(self, filepath: str, nrows: Optional[int] = None,
+             from_end: bool = False) -> Optional[pd.DataFrame]:
+        """Carga el frame desde la caché (None si no hay caché válida)
+
+        nrows recorta las primeras filas, o las últimas si from_end=True.
+        """
+        meta = self.lookup(filepath)
+        if meta is None:
+            return None
+
+        cache_file = meta['cache_file']
+        try:
+            if cache_file.endswith('.feather'):
+                table = feather.read_table(cache_file, memory_map=True)
+                if nrows is not None:
+                    offset = max(table.num_rows - nrows, 0) if from_end else 0
+                    table = table.slice(offset, nrows)
+                columns = {name: table.column(name).to_numpy() for name in table.column_names}
+            else:
+                rows = slice(None)
+                if nrows is not None:
+                    rows = slice(-nrows, None) if from_end else slice(0, nrows)
+                with np.load(cache_file) as data:
+                    columns = {name: data[name][rows] for name in data.files}
+        except Exception as e:
+            print(f"⚠️ Caché ilegible ({e}), se re-parseará el CSV")
+            return None
+
+        return self._frame_from_columns(columns)
+
+    def load_range(self, filepath: str, start=None, end=None) -> Optional[pd.DataFrame]:
+        """Filas con time en [start, end) leídas de la caché por búsqueda binaria"""
+        meta = self.lookup(filepath)
+        if meta is None:
+            return None
+
+        cache_file = meta['cache_file']
+        try:
+            if cache_file.endswith('.feather'):
+                table = feather.read_table(cache_file, memory_map=True)
+                times = table.column('time').to_numpy()
+            else:
+                data = np.load(cache_file)
+                times = data['time']
+            lo, hi = _time_bounds(times, start, end)
+            if cache_file.endswith('.feather'):
+                table = table.slice(lo, hi - lo)
+                columns = {name: table.column(name).to_numpy() for name in table.column_names}
+            else:
+                with data:
+                    columns = {name: data[name][lo:hi] for name in data.files}
+        except Exception as e:
+            print(f"⚠️ Caché ilegible ({e}), se usará el índice temporal")
+            return None
+
+        return self._frame_from_columns(columns)
+
+    def save(self, filepath: str, df: pd.DataFrame):
+        """Guarda el frame tipado y actualiza los metadatos de la caché"""
+        stat = os.stat(filepath)
+        content_hash = self.content_hash(filepath)
+        cache_file = self._data_path(filepath, content_hash)
+        columns = self._columns_from_frame(df)
+
+        tmp_file = cache_file + '.tmp'
+        if PYARROW_AVAILABLE:
+            table = pa.table(columns)
+            feather.write_feather(table, tmp_file, compression='uncompressed')
+        else:
+            with open(tmp_file, 'wb') as f:
+                np.savez(f, **columns)
+        os.replace(tmp_file, cache_file)
+
+        # Eliminar binarios antiguos del mismo archivo fuente (nunca los de otro)
+        previous = self._read_meta(filepath)
+        if (previous and previous.get('source') == os.path.abspath(filepath) and
+                previous.get('cache_file') != cache_file and os.path.exists(previous['cache_file'])):
+            os.remove(previous['cache_file'])
+
+        self._write_meta(filepath, {
+            'version': self.CACHE_VERSION,
+            'source': os.path.abspath(filepath),
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'content_hash': content_hash,
+            'cache_file': cache_file,
+            'rows': len(df),
+        })
+        size_mb = os.path.getsize(cache_file) / (1024 * 1024)
+        print(f"💾 Caché binaria guardada: {os.path.basename(cache_file)} ({size_mb:.1f} MB)")
+
+    @staticmethod
+    def _columns_from_frame(df: pd.DataFrame) -> Dict[str, np.ndarray]:
+        columns = {}
+        for name, dtype in MT5_FRAME_DTYPES.items():
+            if name == 'time':
+                columns[name] = df['time'].values.astype('datetime64[ns]').view('int64')
+            else:
+                columns[name] = df[name].to_numpy().astype(dtype, copy=False)
+        return columns
+
+    @staticmethod
+    def _frame_from_columns(columns: Dict[str, np.ndarray]) -> pd.DataFrame:
+        data = {}
+        for name, dtype in MT5_FRAME_DTYPES.items():
+            values = np.asarray(columns[name])
+            if name == 'time':
+                data[name] = values.astype('int64', copy=False).view('datetime64[ns]')
+            else:
+                data[name] = values.astype(dtype, copy=False)
+        return pd.DataFrame(data)
+
+
+
+def _time_bounds(times_ns: np.ndarray, start=None, end=None) -> Tuple[int, int]:
+    """Posiciones [lo, hi) de las filas con time en [start, end) (times_ns int64 ordenado)"""
+    times_ns = np.asarray(times_ns).view('int64')
+    lo = 0 if start is None else int(np.searchsorted(times_ns, pd.Timestamp(start).value, side='left'))
+    hi = len(times_ns) if end is None else int(np.searchsorted(times_ns, pd.Timestamp(end).value, side='left'))
+    return lo, max(lo, hi)
+
+
+def source_matches(filepath: str, size: int, mtime_ns: int, content_hash: str) -> Optional[int]:
+    """mtime actual de filepath si sigue teniendo el contenido descrito por (size, mtime, hash)
+
+    None si el contenido cambió. Si el mtime devuelto difiere de mtime_ns, el archivo
+    se ha hasheado de nuevo: el llamador debe guardarlo (como MT5BinaryCache.lookup)
+    para no repetir el hash en cada comprobación.
+    """
+    stat = os.stat(filepath)
+    if stat.st_size != size:
+        return None
+    if stat.st_mtime_ns == mtime_ns:
+        return mtime_ns
+    return stat.st_mtime_ns if MT5BinaryCache.content_hash(filepath) == content_hash else None
+
+print('✅ MT5BinaryCache cargado')
+
+# @title
+# [3C] PARSEO VECTORIZADO DE FECHAS MT5 (<DATE> YYYY.MM.DD / <TIME> HH:MM:SS)
+MT5_DATE_WIDTH = 10   # 'YYYY.MM.DD'
+MT5_TIME_WIDTH = 8    # 'HH:MM:SS'
+_TAB, _LF, _CR = 9, 10, 13
+
+
+def _as_byte_matrix(field, width: int) -> np.ndarray:
+    """Convierte un campo de ancho fijo (S{width} o uint8 2-D) a matriz uint8 (n, width)"""
+    field = np.asarray(field)
+    if field.dtype == np.uint8 and field.ndim == 2:
+        return field
+    field = np.ascontiguousarray(field, dtype=f'S{width}')
+    return field.view(np.uint8).reshape(-1, width)
+
+
+def _digits_to_int(matrix: np.ndarray, start: int, stop: int) -> np.ndarray:
+    """Número entero formado por los dígitos ASCII matrix[:, start:stop]"""
+    value = matrix[:, start].astype(np.int32) - ord('0')
+    for k in range(start + 1, stop):
+        value = value * 10 + (matrix[:, k].astype(np.int32) - ord('0'))
+    return value
+
+
+def _check_digits(matrix: np.ndarray, digit_columns) -> None:
+    """Valida que las posiciones indicadas sean dígitos ASCII (resta uint8 con wrap-around)"""
+    if np.any((matrix[:, digit_columns] - np.uint8(ord('0'))) > 9):
+        raise ValueError("Carácter no numérico en un campo de fecha/hora")
+
+
+def parse_mt5_datetime(date_field, time_field) -> np.ndarray:
+    """Parsea campos <DATE>/<TIME> de ancho fijo a datetime64[ns] sin crear strings
+
+    date_field: bytes 'YYYY.MM.DD' como matriz uint8 (n, 10) o array 'S10'
+    time_field: bytes 'HH:MM:SS' como matriz uint8 (n, 8) o array 'S8'
+    """
+    d = _as_byte_matrix(date_field, MT5_DATE_WIDTH)
+    t = _as_byte_matrix(time_field, MT5_TIME_WIDTH)
+    if len(d) != len(t):
+        raise ValueError(f"Longitudes distintas: {len(d)} fechas vs {len(t)} horas")
+
+    _check_digits(d, [0, 1, 2, 3, 5, 6, 8, 9])
+    _check_digits(t, [0, 1, 3, 4, 6, 7])
+
+    year = _digits_to_int(d, 0, 4)
+    month = _digits_to_int(d, 5, 7)
+    day = _digits_to_int(d, 8, 10)
+    seconds_of_day = (_digits_to_int(t, 0, 2) * 3600 +
+                      _digits_to_int(t, 3, 5) * 60 +
+                      _digits_to_int(t, 6, 8))
+
+    # Días desde epoch (algoritmo days_from_civil, calendario gregoriano)
+    year = year - (month <= 2)
+    era = year // 400
+    year_of_era = year - era * 400
+    day_of_year = (153 * np.where(month > 2, month - 3, month + 9) + 2) // 5 + day - 1
+    day_of_era = year_of_era * 365 + year_of_era // 4 - year_of_era // 100 + day_of_year
+    days = era.astype(np.int64) * 146097 + day_of_era - 719468
+
+    nanoseconds = days * 86400
+    nanoseconds += seconds_of_day
+    nanoseconds *= 1_000_000_000
+    return nanoseconds.view('datetime64[ns]')
+
+
+def _mt5_line_starts(buf: np.ndarray, nrows: Optional[int] = None,
+                     block_size: int = 64 * 1024 * 1024, skip_header: bool = True) -> np.ndarray:
+    """Offsets de inicio de cada fila de datos (se salta la cabecera si skip_header)"""
+    starts = [] if skip_header else [np.zeros(1, dtype=np.int64)]
+    found = 0
+    for block_start in range(0, len(buf), block_size):
+        block = buf[block_start:block_start + block_size]
+        newlines = np.flatnonzero(block == _LF) + (block_start + 1)
+        starts.append(newlines)
+        found += len(newlines)
+        if nrows is not None and found >= nrows:
+            break
+
+    starts = np.concatenate(starts) if starts else np.empty(0, dtype=np.int64)
+    starts = starts[starts < len(buf)]
+    if nrows is not None:
+        starts = starts[:nrows]
+    # Ignorar líneas vacías (p. ej. saltos de línea finales)
+    if len(starts):
+        first_byte = buf[starts]
+        starts = starts[(first_byte != _LF) & (first_byte != _CR)]
+    return starts
+
+
+def _mt5_datetime_at(buf: np.ndarray, starts: np.ndarray) -> Optional[np.ndarray]:
+    """Parsea <DATE>/<TIME> de las filas que empiezan en starts (None si el layout no encaja)"""
+    if len(starts) == 0:
+        return np.empty(0, dtype='datetime64[ns]')
+
+    time_offset = MT5_DATE_WIDTH + 1
+    row_end = time_offset + MT5_TIME_WIDTH
+    if starts[-1] + row_end >= len(buf):
+        return None
+    if not (np.all(buf[starts + MT5_DATE_WIDTH] == _TAB) and np.all(buf[starts + row_end] == _TAB)):
+        return None
+
+    # Matrices de bytes (n, 10) y (n, 8) construidas columna a columna
+    date_field = np.empty((len(starts), MT5_DATE_WIDTH), dtype=np.uint8)
+    for k in range(MT5_DATE_WIDTH):
+        date_field[:, k] = buf[starts + k]
+    time_field = np.empty((len(starts), MT5_TIME_WIDTH), dtype=np.uint8)
+    for k in range(MT5_TIME_WIDTH):
+        time_field[:, k] = buf[starts + time_offset + k]
+
+    try:
+        return parse_mt5_datetime(date_field, time_field)
+    except ValueError as e:
+        print(f"⚠️ Parser vectorizado de fechas no aplicable: {e}")
+        return None
+
+
+def read_mt5_datetime(filepath: str, nrows: Optional[int] = None) -> Optional[np.ndarray]:
+    """Lee las columnas <DATE>/<TIME> del CSV como campos de bytes y las parsea
+
+    Devuelve None si el archivo no tiene el layout esperado
+    ('YYYY.MM.DD<TAB>HH:MM:SS<TAB>...'), para que el llamador use la ruta clásica.
+    """
+    buf = np.memmap(filepath, dtype=np.uint8, mode='r')
+    starts = _mt5_line_starts(buf, nrows=nrows)
+    return _mt5_datetime_at(buf, starts)
+
+
+def benchmark_mt5_datetime_parsing(sizes=(1_000_000, 5_000_000)) -> pd.DataFrame:
+    """Compara el parser de bytes con la ruta clásica (concat de strings + to_datetime)"""
+    print("⏱️ Benchmark de parseo de fechas MT5")
+    rows = []
+    for n in sizes:
+        # Campos sintéticos M1 con el formato del export
+        expected = np.datetime64('2015-01-01T00:00:00', 'ns') + np.arange(n) * np.timedelta64(60, 's')
+        iso = np.datetime_as_string(expected, unit='s').astype('S19').view(np.uint8).reshape(n, 19)
+        date_field = iso[:, :MT5_DATE_WIDTH].copy()
+        date_field[:, [4, 7]] = ord('.')
+        time_field = np.ascontiguousarray(iso[:, 11:19])
+
+        # Ruta clásica: strings de objeto como los devuelve read_csv
+        date_str = pd.Series(date_field.view(f'S{MT5_DATE_WIDTH}').ravel().astype(str), dtype=object)
+        time_str = pd.Series(time_field.view(f'S{MT5_TIME_WIDTH}').ravel().astype(str), dtype=object)
+
+        start = time.perf_counter()
+        classic = pd.to_datetime(date_str + ' ' + time_str, format='%Y.%m.%d %H:%M:%S').values
+        classic_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        vectorized = parse_mt5_datetime(date_field, time_field)
+        vectorized_time = time.perf_counter() - start
+
+        identical = np.array_equal(classic, vectorized) and np.array_equal(vectorized, expected)
+        rows.append({
+            'rows': n,
+            'classic_s': classic_time,
+            'vectorized_s': vectorized_time,
+            'speedup': classic_time / max(vectorized_time, 1e-9),
+            'identical': identical,
+        })
+        print(f"   {n:>10,} filas | clásico: {classic_time:.2f}s | bytes: {vectorized_time:.3f}s | "
+              f"x{rows[-1]['speedup']:.1f} | idénticos: {identical}")
+        del date_str, time_str, classic
+        gc.collect()
+
+    return pd.DataFrame(rows)
+
+if config.RUN_BENCHMARKS:
+    benchmark_mt5_datetime_parsing()
+
+print('✅ Parser vectorizado de fechas MT5 cargado')
+
+# @title
+# [3D] LECTURA EN STREAMING DEL HISTÓRICO M1 + RESAMPLEO INCREMENTAL
+import io
+
+
+def _mt5_header(filepath: str) -> Tuple[List[str], int]:
+    """Columnas de la cabecera y su tamaño en bytes"""
+    with open(filepath, 'rb') as f:
+        header = f.readline()
+    columns = header.decode('utf-8-sig').strip().split('\t')
+    return columns, len(header)
+
+
+def _mt5_tail_offset(filepath: str, n_rows: int, header_size: int,
+                     block_size: int = 8 * 1024 * 1024) -> int:
+    """Offset en bytes donde empiezan las últimas n_rows filas del archivo"""
+    size = os.path.getsize(filepath)
+    with open(filepath, 'rb') as f:
+        # Ignorar saltos de línea finales
+        end = size
+        while end > header_size:
+            f.seek(end - 1)
+            if f.read(1) not in (b'\n', b'\r'):
+                break
+            end -= 1
+
+        remaining = n_rows
+        pos = end
+        while pos > header_size:
+            read_start = max(header_size, pos - block_size)
+            f.seek(read_start)
+            block = np.frombuffer(f.read(pos - read_start), dtype=np.uint8)
+            newlines = np.flatnonzero(block == _LF)
+            if len(newlines) >= remaining:
+                return read_start + int(newlines[len(newlines) - remaining]) + 1
+            remaining -= len(newlines)
+            pos = read_start
+    return header_size
+
+
+def _iter_mt5_byte_blocks(filepath: str, offset: int, chunk_bytes: int):
+    """Bloques de bytes del archivo alineados a fin de línea"""
+    with open(filepath, 'rb') as f:
+        f.seek(offset)
+        remainder = b''
+        while True:
+            data = f.read(chunk_bytes)
+            if not data:
+                if remainder.strip():
+                    yield remainder + b'\n'
+                break
+            data = remainder + data
+            cut = data.rfind(b'\n') + 1
+            if cut == 0:
+                remainder = data
+                continue
+            yield data[:cut]
+            remainder = data[cut:]
+
+
+def _parse_mt5_block(block: bytes, columns: List[str], start=None, end=None) -> Optional[pd.DataFrame]:
+    """Parsea un bloque de filas (sin cabecera) a un frame tipado como load_data
+
+    Las fechas se parsean primero: los bloques fuera de [start, end) se descartan
+    sin pasar por el parseo numérico.
+    """
+    buf = np.frombuffer(block, dtype=np.uint8)
+    time_values = _mt5_datetime_at(buf, _mt5_line_starts(buf, skip_header=False))
+    if time_values is None:
+        dates = pd.read_csv(io.BytesIO(block), sep='\t', header=None, names=columns,
+                            usecols=['<DATE>', '<TIME>'], dtype=str)
+        time_values = pd.to_datetime(dates['<DATE>'] + ' ' + dates['<TIME>'],
+                                     format='%Y.%m.%d %H:%M:%S').values
+    if len(time_values) == 0:
+        return None
+
+    mask = None
+    if start is not None:
+        if time_values[-1] < start:
+            return None
+        mask = time_values >= start
+    if end is not None:
+        if time_values[0] >= end:
+            return None
+        mask = (time_values < end) if mask is None else (mask & (time_values < end))
+
+    numeric = pd.read_csv(io.BytesIO(block), sep='\t', header=None, names=columns,
+                          usecols=[c for c in columns if c not in ('<DATE>', '<TIME>')],
+                          dtype=MT5_CSV_DTYPES)
+    numeric.rename(columns=MT5_COLUMN_MAPPING, inplace=True)
+    numeric.insert(0, 'time', time_values)
+    if mask is not None:
+        numeric = numeric[mask].reset_index(drop=True)
+    return numeric
+
+
+def iter_mt5_chunks(filepath: str, chunk_bytes: Optional[int] = None,
+                    start=None, end=None, tail_rows: Optional[int] = None):
+    """Itera el CSV M1 de MT5 en bloques tipados (memoria acotada por chunk_bytes)
+
+    start/end: ventana [start, end) de fechas (el archivo debe estar en orden temporal)
+    tail_rows: leer solo las últimas tail_rows filas
+    """
+    chunk_bytes = chunk_bytes or config.STREAM_CHUNK_BYTES
+    columns, header_size = _mt5_header(filepath)
+    offset = header_size if tail_rows is None else _mt5_tail_offset(filepath, tail_rows, header_size)
+    start = np.datetime64(pd.Timestamp(start), 'ns') if start is not None else None
+    end = np.datetime64(pd.Timestamp(end), 'ns') if end is not None else None
+
+    for block in _iter_mt5_byte_blocks(filepath, offset, chunk_bytes):
+        chunk = _parse_mt5_block(block, columns, start=start, end=end)
+        if chunk is None:
+            if end is not None and _mt5_block_first_time(block) >= end:
+                break
+            continue
+        if len(chunk):
+            yield chunk
+
+
+def _mt5_block_first_time(block: bytes) -> np.datetime64:
+    """Timestamp de la primera fila de un bloque"""
+    buf = np.frombuffer(block, dtype=np.uint8)
+    first = _mt5_datetime_at(buf, np.zeros(1, dtype=np.int64))
+    if first is None:
+        first_line = block[:block.index(b'\n')].decode().split('\t')
+        return np.datetime64(pd.Timestamp(f'{first_line[0]} {first_line[1]}'.replace('.', '-')), 'ns')
+    return first[0]
+
+
+def read_mt5_tail(filepath: str, n_rows: int) -> pd.DataFrame:
+    """Lee las últimas n_rows filas del CSV sin recorrer el resto del archivo"""
+    chunks = list(iter_mt5_chunks(filepath, tail_rows=n_rows))
+    if not chunks:
+        return MT5BinaryCache._frame_from_columns(
+            {name: np.empty(0, dtype=dtype) for name, dtype in MT5_FRAME_DTYPES.items()})
+    return pd.concat(chunks, ignore_index=True)
+
+
+def timeframe_to_ns(timeframe: str) -> int:
+    """Duración de un timeframe de pandas ('15min', '1H', '1D'...) en nanosegundos"""
+    return pd.Timedelta(pd.tseries.frequencies.to_offset(timeframe)).value
+
+
+# Columnas de las barras parciales: sumas y conteos para poder recombinarlas
+PARTIAL_BAR_AGG = {
+    'open': 'first', 'high': 'max', 'low': 'min', 'close': 'last',
+    'tick_volume': 'sum', 'spread_sum': 'sum', 'spread_count': 'sum', 'real_volume': 'sum',
+}
+BAR_COLUMNS = ['open', 'high', 'low', 'close', 'tick_volume', 'spread', 'real_volume']
+
+
+def reduceat_partial(times_ns: np.ndarray, columns: Dict[str, np.ndarray],
+                     freq_ns: int, origin_ns: int = 0) -> pd.DataFrame:
+    """Kernel OHLC: barras parciales de filas M1 en una pasada con ufunc.reduceat
+
+    Los límites de bucket se calculan una vez a partir de los timestamps int64;
+    first/last son índices directos y max/min/sum una reducción por columna.
+    Supone columnas sin NaN (pandas los ignoraría en first/last/max/min).
+    """
+    if len(times_ns) > 1 and not (times_ns[1:] >= times_ns[:-1]).all():
+        # resample ordena por tiempo antes de agrupar
+        order = np.argsort(times_ns, kind='stable')
+        times_ns = times_ns[order]
+        columns = {name: values[order] for name, values in columns.items()}
+    keys = times_ns - (times_ns - origin_ns) % freq_ns
+
+    n = len(keys)
+    starts = np.flatnonzero(np.concatenate([[n > 0], keys[1:] != keys[:-1]]))
+    if n == 0:
+        empty = {name: np.empty(0, dtype=dtype) for name, dtype in [
+            ('open', np.float64), ('high', np.float64), ('low', np.float64), ('close', np.float64),
+            ('tick_volume', np.int64), ('spread_sum', np.float64), ('spread_count', np.int64),
+            ('real_volume', np.int64)]}
+        return pd.DataFrame(empty, index=np.empty(0, dtype=np.int64))
+    ends = np.append(starts[1:], n) - 1
+
+    def _sum(values):
+        dtype = np.int64 if np.issubdtype(values.dtype, np.integer) else np.float64
+        return np.add.reduceat(values, starts, dtype=dtype)
+
+    return pd.DataFrame({
+        'open': columns['open'][starts],
+        'high': np.maximum.reduceat(columns['high'], starts),
+        'low': np.minimum.reduceat(columns['low'], starts),
+        'close': columns['close'][ends],
+        'tick_volume': _sum(columns['tick_volume']),
+        'spread_sum': np.add.reduceat(columns['spread'], starts, dtype=np.float64),
+        'spread_count': ends - starts + 1,
+        'real_volume': _sum(columns['real_volume']),
+    }, index=keys[starts])
+
+
+def _has_nan(columns: Dict[str, np.ndarray]) -> bool:
+    return any(np.issubdtype(v.dtype, np.floating) and np.isnan(v).any() for v in columns.values())
+
+
+def m1_to_partial(df: pd.DataFrame, freq_ns: int) -> pd.DataFrame:
+    """Agrega filas M1 (columna 'time') a barras parciales indexadas por el inicio del bucket (ns)"""
+    time_ns = df['time'].values.view('int64')
+    columns = {name: df[name].values for name in ['open', 'high', 'low', 'close',
+                                                  'tick_volume', 'spread', 'real_volume']}
+    if not _has_nan(columns):
+        return reduceat_partial(time_ns, columns, freq_ns)
+
+    # Con NaN: groupby reproduce cómo los ignora resample
+    keys = time_ns - time_ns % freq_ns
+    agg = df.groupby(keys, sort=False).agg(
+        open=('open', 'first'), high=('high', 'max'), low=('low', 'min'),
+        close=('close', 'last'), tick_volume=('tick_volume', 'sum'),
+        spread_sum=('spread', 'sum'), spread_count=('spread', 'count'),
+        real_volume=('real_volume', 'sum'),
+    )
+    agg['spread_sum'] = agg['spread_sum'].astype('float64')
+    return agg
+
+
+def coarsen_partial(partial: pd.DataFrame, freq_ns: int) -> pd.DataFrame:
+    """Agrega barras parciales a un timeframe múltiplo del suyo
+
+    El spread se arrastra como (suma, conteo), así la media del nivel grueso
+    queda ponderada por minutos igual que si se calculara desde M1.
+    """
+    keys = partial.index.values - partial.index.values % freq_ns
+    return partial.groupby(keys, sort=False).agg(PARTIAL_BAR_AGG)
+
+
+def finalize_partial(partial: pd.DataFrame, volume_dtypes: Dict[str, np.dtype],
+                     timeframe: Optional[str] = None) -> pd.DataFrame:
+    """Barras parciales → formato de resample_timeframe (DatetimeIndex 'time', spread medio)"""
+    keys = partial.index.values.astype('int64')
+    index = pd.DatetimeIndex(keys.view('datetime64[ns]'), name='time')
+    if timeframe is not None and len(keys) and \
+            keys[-1] - keys[0] == (len(keys) - 1) * timeframe_to_ns(timeframe):
+        # Sin huecos: resample conserva la frecuencia en el índice
+        index = pd.DatetimeIndex(index, freq=timeframe)
+    out = pd.DataFrame({
+        'open': partial['open'].values,
+        'high': partial['high'].values,
+        'low': partial['low'].values,
+        'close': partial['close'].values,
+        'tick_volume': partial['tick_volume'].values.astype(volume_dtypes['tick_volume']),
+        'spread': partial['spread_sum'].values / partial['spread_count'].values,
+        'real_volume': partial['real_volume'].values.astype(volume_dtypes['real_volume']),
+    }, index=index)
+    return out.dropna()
+
+
+def resample_ohlc_numpy(df: pd.DataFrame, timeframe: str) -> Optional[pd.DataFrame]:
+    """resample_timeframe con el kernel reduceat (None si el caso no está soportado)
+
+    Reproduce resample(timeframe).agg(...).dropna(): buckets anclados a la
+    medianoche del primer día (origin='start_day'). Solo frecuencias fijas
+    (min/H/D) y datos sin NaN; en otro caso se usa el camino de pandas.
+    """
+    offset = pd.tseries.frequencies.to_offset(timeframe)
+    if not isinstance(offset, pd.offsets.Tick):
+        return None
+    times = df['time'].values if 'time' in df.columns else df.index.values
+    columns = {name: df[name].values for name in ['open', 'high', 'low', 'close',
+                                                  'tick_volume', 'spread', 'real_volume']}
+    if _has_nan(columns) or len(times) == 0:
+        return None
+
+    times_ns = times.astype('datetime64[ns]').view('int64')
+    day_ns = 86400 * 10**9
+    first_ns = times_ns.min()
+    partial = reduceat_partial(times_ns, columns, offset.nanos, origin_ns=first_ns - first_ns % day_ns)
+    volume_dtypes = {name: df[name].dtype for name in ['tick_volume', 'real_volume']}
+    return finalize_partial(partial, volume_dtypes, timeframe)
+
+
+def timeframe_parents(timeframes: List[str]) -> Dict[str, Optional[str]]:
+    """Nivel del que se construye cada timeframe (None = directamente desde M1)
+
+    El padre es el timeframe más grueso de la lista que divide exactamente al
+    hijo: ['15min', '30min', '1H', '4H', '1D'] → 15min←M1, 30min←15min,
+    1H←30min, 4H←1H, 1D←4H.
+    """
+    freqs = {tf: timeframe_to_ns(tf) for tf in timeframes}
+    parents = {}
+    for tf in sorted(timeframes, key=freqs.get):
+        candidates = [p for p in parents if freqs[p] < freqs[tf] and freqs[tf] % freqs[p] == 0]
+        parents[tf] = max(candidates, key=freqs.get) if candidates else None
+    return parents
+
+
+class IncrementalResampler:
+    """Resamplea M1 → timeframes superiores consumiendo bloques en orden temporal
+
+    Cada bloque se agrega por bucket; el último bucket de cada timeframe queda
+    pendiente porque puede continuar en el bloque siguiente. El resultado es
+    el mismo que resample_timeframe sobre el histórico completo, pero la memoria
+    máxima depende del tamaño de bloque y no del archivo.
+
+    También sirve para datos que crecen (el pipeline diario añade minutos nuevos):
+    update() devuelve solo las barras que se cierran con las filas nuevas y el
+    estado (barras abiertas) se puede guardar con save() y retomar con load().
+    """
+
+    STATE_VERSION = 1
+
+    OUTPUT_COLUMNS = BAR_COLUMNS
+
+    def __init__(self, timeframes: List[str]):
+        self.timeframes = list(timeframes)
+        self.freq_ns = {tf: timeframe_to_ns(tf) for tf in self.timeframes}
+        for tf, freq in self.freq_ns.items():
+            if (86400 * 10**9) % freq != 0:
+                raise ValueError(f"Timeframe {tf} no divide el día; no soportado en streaming")
+        self.parents = timeframe_parents(self.timeframes)
+        self._closed = {tf: [] for tf in self.timeframes}
+        self._pending = {tf: None for tf in self.timeframes}
+        self._last_time = None
+        self._volume_dtypes = {}
+        self.rows_seen = 0
+
+    @staticmethod
+    def _merge_rows(first: pd.DataFrame, second: pd.DataFrame) -> pd.DataFrame:
+        """Combina dos agregados parciales del mismo bucket"""
+        merged = first.copy()
+        merged['high'] = np.maximum(first['high'].values, second['high'].values)
+        merged['low'] = np.minimum(first['low'].values, second['low'].values)
+        merged['close'] = second['close'].values
+        for col in ['tick_volume', 'spread_sum', 'spread_count', 'real_volume']:
+            merged[col] = first[col].values + second[col].values
+        return merged
+
+    def update(self, chunk: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+        """Consume un bloque M1 (ordenado y posterior a los ya vistos)
+
+        Devuelve, por timeframe, las barras que quedan cerradas tras este bloque.
+        """
+        if len(chunk) == 0:
+            return {}
+        times = chunk['time'].values
+        if not (times[1:] >= times[:-1]).all():
+            chunk = chunk.sort_values('time', kind='stable')
+            times = chunk['time'].values
+        if self._last_time is not None and times[0] < self._last_time:
+            raise ValueError("Los bloques deben llegar en orden temporal")
+        self._last_time = times[-1]
+        self.rows_seen += len(chunk)
+        # resample().sum() conserva el dtype entero de entrada
+        self._volume_dtypes = {col: chunk[col].dtype for col in ['tick_volume', 'real_volume']}
+
+        # Cada nivel del bloque se agrega desde el nivel más fino ya calculado
+        chunk_parts = {}
+        for tf, parent in self.parents.items():
+            if parent is None:
+                chunk_parts[tf] = m1_to_partial(chunk, self.freq_ns[tf])
+            else:
+                chunk_parts[tf] = coarsen_partial(chunk_parts[parent], self.freq_ns[tf])
+
+        closed = {}
+        for tf in self.timeframes:
+            part = chunk_parts[tf]
+            pending = self._pending[tf]
+            if pending is not None:
+                if part.index[0] == pending.index[0]:
+                    part = pd.concat([self._merge_rows(pending, part.iloc[:1]), part.iloc[1:]])
+                else:
+                    part = pd.concat([pending, part])
+            self._pending[tf] = part.iloc[-1:]
+            closed[tf] = part.iloc[:-1]
+            self._closed[tf].append(closed[tf])
+        return {tf: finalize_partial(part, self._volume_dtypes) for tf, part in closed.items()}
+
+    def open_bars(self) -> Dict[str, pd.DataFrame]:
+        """Barra aún abierta (parcial) de cada timeframe"""
+        return {tf: finalize_partial(pending, self._volume_dtypes)
+                for tf, pending in self._pending.items() if pending is not None}
+
+    def save(self, path: str, keep_history: bool = False):
+        """Guarda el estado para continuar con las filas M1 que se añadan después
+
+        Por defecto solo se guardan las barras abiertas: las cerradas ya se emitieron.
+        """
+        state = {
+            'version': self.STATE_VERSION,
+            'timeframes': self.timeframes,
+            'pending': self._pending,
+            'closed': self._closed if keep_history else {tf: [] for tf in self.timeframes},
+            'last_time': self._last_time,
+            'volume_dtypes': self._volume_dtypes,
+            'rows_seen': self.rows_seen,
+        }
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(state, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> Optional['IncrementalResampler']:
+        """Retoma un estado guardado con save() (None si no existe o es de otra versión)"""
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'rb') as f:
+                state = pickle.load(f)
+        except Exception as e:
+            print(f"⚠️ Estado de resampleo ilegible ({e})")
+            return None
+        if state.get('version') != cls.STATE_VERSION:
+            return None
+        resampler = cls(state['timeframes'])
+        resampler._pending = state['pending']
+        resampler._closed = state['closed']
+        resampler._last_time = state['last_time']
+        resampler._volume_dtypes = state['volume_dtypes']
+        resampler.rows_seen = state['rows_seen']
+        return resampler
+
+    def result(self) -> Dict[str, pd.DataFrame]:
+        """Barras de cada timeframe con el formato de resample_timeframe"""
+        bars = {}
+        for tf in self.timeframes:
+            parts = self._closed[tf] + ([self._pending[tf]] if self._pending[tf] is not None else [])
+            if not parts:
+                bars[tf] = pd.DataFrame(columns=self.OUTPUT_COLUMNS,
+                                        index=pd.DatetimeIndex([], name='time'))
+                continue
+            bars[tf] = finalize_partial(pd.concat(parts), self._volume_dtypes, tf)
+        return bars
+
+
+class TimeframePyramid:
+    """Barras de todos los timeframes de una ejecución, cada nivel desde el anterior
+
+    M1 → 15min → 30min → 1H → 4H → 1D: solo el primer nivel recorre el M1; los
+    siguientes agregan las barras (parciales) del nivel más fino que los divide.
+    Cada nivel se calcula una vez, al pedirlo, y lo comparten todos los consumidores
+    (create_multiple_timeframes, el contexto 4H de add_features...). Los timeframes
+    que no dividen el día ('3D', '7D') se resamplean desde M1 con pandas.
+    """
+
+    def __init__(self, df: pd.DataFrame, timeframes: Optional[List[str]] = None):
+        self.df = df
+        self.timeframes = list(timeframes or config.TIMEFRAMES)
+        self._volume_dtypes = {col: df[col].dtype for col in ['tick_volume', 'real_volume']}
+        self._partials = {}
+        self._bars = {}
+
+    def __contains__(self, timeframe: str) -> bool:
+        return timeframe in self.timeframes
+
+    def __getitem__(self, timeframe: str) -> pd.DataFrame:
+        return self.bars(timeframe)
+
+    @staticmethod
+    def _nests_in_day(timeframe: str) -> bool:
+        return (86400 * 10**9) % timeframe_to_ns(timeframe) == 0
+
+    def _partial(self, timeframe: str) -> pd.DataFrame:
+        if timeframe not in self._partials:
+            levels = [tf for tf in self.timeframes if self._nests_in_day(tf)]
+            if timeframe not in levels:
+                levels.append(timeframe)
+            parent = timeframe_parents(levels)[timeframe]
+            freq_ns = timeframe_to_ns(timeframe)
+            if parent is None:
+                self._partials[timeframe] = m1_to_partial(self.df, freq_ns)
+            else:
+                self._partials[timeframe] = coarsen_partial(self._partial(parent), freq_ns)
+        return self._partials[timeframe]
+
+    def bars(self, timeframe: str) -> pd.DataFrame:
+        """Barras de timeframe con el formato de resample_timeframe (calculadas una vez)"""
+        if timeframe not in self._bars:
+            if timeframe not in self.timeframes:
+                self.timeframes.append(timeframe)
+            if self._nests_in_day(timeframe):
+                self._bars[timeframe] = finalize_partial(self._partial(timeframe), self._volume_dtypes,
+                                                         timeframe)
+            else:
+                self._bars[timeframe] = self.df.set_index('time').resample(timeframe).agg({
+                    'open': 'first', 'high': 'max', 'low': 'min',
+                    'close': 'last', 'tick_volume': 'sum',
+                    'spread': 'mean', 'real_volume': 'sum'
+                }).dropna()
+        return self._bars[timeframe]
+
+def benchmark_resample_backends(n_rows: int = 2_000_000, timeframes: Optional[List[str]] = None) -> pd.DataFrame:
+    """Compara resample().agg() de pandas con el kernel reduceat sobre M1 sintético"""
+    timeframes = timeframes or config.TIMEFRAMES
+    print(f"⏱️ Benchmark de resampleo OHLC ({n_rows:,} filas M1)")
+    rng = np.random.default_rng(0)
+    close = (1.1 + np.cumsum(rng.normal(0, 1e-4, n_rows))).astype(np.float32)
+    df = pd.DataFrame({
+        'time': np.datetime64('2015-01-01T00:00:00', 'ns') + np.arange(n_rows) * np.timedelta64(60, 's'),
+        'open': close, 'high': close + np.float32(2e-4), 'low': close - np.float32(2e-4), 'close': close,
+        'tick_volume': rng.integers(1, 500, n_rows).astype(np.int32),
+        'spread': rng.integers(0, 30, n_rows).astype(np.int16),
+        'real_volume': np.zeros(n_rows, dtype=np.int32),
+    })
+    rows = []
+    for tf in timeframes:
+        start = time.perf_counter()
+        pandas_bars = df.set_index('time').resample(tf).agg({
+            'open': 'first', 'high': 'max', 'low': 'min',
+            'close': 'last', 'tick_volume': 'sum',
+            'spread': 'mean', 'real_volume': 'sum'
+        }).dropna()
+        pandas_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        numpy_bars = resample_ohlc_numpy(df, tf)
+        numpy_time = time.perf_counter() - start
+
+        identical = pandas_bars.equals(numpy_bars) and pandas_bars.index.equals(numpy_bars.index)
+        rows.append({'timeframe': tf, 'pandas_s': pandas_time, 'numpy_s': numpy_time,
+                     'speedup': pandas_time / max(numpy_time, 1e-9), 'identical': identical})
+        print(f"   {tf:>6} | pandas: {pandas_time:.3f}s | reduceat: {numpy_time:.3f}s | "
+              f"x{rows[-1]['speedup']:.1f} | idénticos: {identical}")
+    return pd.DataFrame(rows)
+
+if config.RUN_BENCHMARKS:
+    benchmark_resample_backends()
+
+print('✅ Lectura en streaming, IncrementalResampler y TimeframePyramid cargados')
+
+# @title
+# [3E] ALMACÉN DE COLUMNAS M1 MAPEADO EN MEMORIA (compartido entre procesos)
+class MT5ColumnStore:
+    """Histórico M1 persistido como un array binario por columna + cabecera JSON
+
+    Cada columna (time, open, high, low, close, tick_volume, real_volume, spread)
+    se guarda como un archivo .bin con el dtype de MT5_FRAME_DTYPES y se abre con
+    np.memmap: todos los procesos que lo abren comparten las mismas páginas del
+    page cache en lugar de tener cada uno su copia de pandas.
+    """
+
+    STORE_VERSION = 1
+    META_FILE = 'meta.json'
+
+    def __init__(self, store_dir: str):
+        self.store_dir = store_dir
+        self.meta = None
+        self._arrays = {}
+
+    @classmethod
+    def default_dir(cls, filepath: str) -> str:
+        return os.path.join(config.COLUMN_STORE_DIR, source_key(filepath))
+
+    @property
+    def rows(self) -> int:
+        return self.meta['rows'] if self.meta else 0
+
+    def _column_path(self, name: str) -> str:
+        return os.path.join(self.store_dir, f'{name}.bin')
+
+    def _read_meta(self) -> Optional[dict]:
+        meta_path = os.path.join(self.store_dir, self.META_FILE)
+        if not os.path.exists(meta_path):
+            return None
+        try:
+            with open(meta_path, 'r') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return meta if meta.get('version') == self.STORE_VERSION else None
+
+    def _write_meta(self, meta: dict, store_dir: Optional[str] = None):
+        meta_path = os.path.join(store_dir or self.store_dir, self.META_FILE)
+        with open(meta_path + '.tmp', 'w') as f:
+            json.dump(meta, f, indent=2)
+        os.replace(meta_path + '.tmp', meta_path)
+
+    def is_fresh(self, filepath: str) -> bool:
+        """True si el almacén corresponde al contenido actual de filepath
+
+        Si solo cambió el mtime (mismo contenido), se guarda el nuevo para que las
+        siguientes comprobaciones no vuelvan a hashear el CSV.
+        """
+        meta = self._read_meta()
+        if meta is None or 'source_size' not in meta:
+            return False
+        mtime_ns = source_matches(filepath, meta['source_size'], meta['source_mtime_ns'], meta['source_hash'])
+        if mtime_ns is None:
+            return False
+        if mtime_ns != meta['source_mtime_ns']:
+            meta['source_mtime_ns'] = mtime_ns
+            self._write_meta(meta)
+        return True
+
+    def open(self) -> 'MT5ColumnStore':
+        """Abre todas las columnas en modo solo lectura (sin copiar datos)"""
+        self.meta = self._read_meta()
+        if self.meta is None:
+            raise FileNotFoundError(f"No hay almacén de columnas válido en {self.store_dir}")
+        self._arrays = {}
+        for name, dtype in self.meta['columns'].items():
+            if self.meta['rows'] == 0:
+                self._arrays[name] = np.empty(0, dtype=dtype)
+            else:
+                self._arrays[name] = np.memmap(self._column_path(name), dtype=dtype, mode='r',
+                                               shape=(self.meta['rows'],))
+        return self
+
+    def column(self, name: str) -> np.ndarray:
+        """Array mapeado de una columna ('time' se expone como datetime64[ns])"""
+        values = self._arrays[name]
+        return values.view('datetime64[ns]') if name == 'time' else values
+
+    def arrays(self, names: Optional[List[str]] = None, start: int = 0,
+               stop: Optional[int] = None) -> Dict[str, np.ndarray]:
+        """Vistas (sin copia) de las columnas pedidas en el rango de filas [start, stop)"""
+        names = names or list(self._arrays)
+        return {name: self.column(name)[start:stop] for name in names}
+
+    def iter_chunks(self, start=None, end=None, tail_rows: Optional[int] = None,
+                    chunk_rows: Optional[int] = None):
+        """Frames tipados de las filas con time en [start, end), por bloques (como iter_mt5_chunks)
+
+        tail_rows: solo las últimas tail_rows filas del histórico. Cada bloque copia
+        únicamente sus filas del mapeo, así que la memoria queda acotada por chunk_rows.
+        """
+        lo, hi = _time_bounds(self._arrays['time'], start, end)
+        if tail_rows is not None:
+            lo = max(lo, self.rows - tail_rows)
+        row_bytes = sum(np.dtype(dtype).itemsize for dtype in self.meta['columns'].values())
+        chunk_rows = chunk_rows or max(config.STREAM_CHUNK_BYTES // row_bytes, 1)
+        for begin in range(lo, hi, chunk_rows):
+            yield self.to_frame(begin, min(begin + chunk_rows, hi))
+
+    def to_frame(self, start: int = 0, stop: Optional[int] = None) -> pd.DataFrame:
+        """Materializa un rango de filas como DataFrame con el formato de load_data
+
+        pandas consolida las columnas en bloques, así que esto sí copia los datos
+        del rango; los workers que solo agregan deben usar arrays() directamente.
+        """
+        return pd.DataFrame(self.arrays(start=start, stop=stop))
+
+    def _write(self, chunks, source: Optional[str] = None):
+        """Escribe las columnas a partir de un iterable de frames tipados
+
+        Todo (columnas y meta.json) se escribe en un directorio temporal que después
+        sustituye al almacén: un proceso que lo abra ve el almacén anterior completo,
+        ninguno o el nuevo completo, nunca columnas nuevas con la cabecera antigua.
+        La huella de source se toma antes de leerlo: si cambia durante la escritura,
+        la siguiente comprobación lo detecta.
+        """
+        import shutil
+        source_meta = {}
+        if source is not None:
+            stat = os.stat(source)
+            source_meta = {
+                'source': os.path.abspath(source),
+                'source_size': stat.st_size,
+                'source_mtime_ns': stat.st_mtime_ns,
+                'source_hash': MT5BinaryCache.content_hash(source),
+            }
+        tmp_dir = self.store_dir.rstrip(os.sep) + '.tmp'
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        handles = {name: open(os.path.join(tmp_dir, f'{name}.bin'), 'wb') for name in MT5_FRAME_DTYPES}
+        rows = 0
+        time_start = time_end = None
+        try:
+            for chunk in chunks:
+                if len(chunk) == 0:
+                    continue
+                columns = MT5BinaryCache._columns_from_frame(chunk)
+                for name, values in columns.items():
+                    handles[name].write(np.ascontiguousarray(values).tobytes())
+                if time_start is None:
+                    time_start = int(columns['time'][0])
+                time_end = int(columns['time'][-1])
+                rows += len(chunk)
+        finally:
+            for handle in handles.values():
+                handle.close()
+
+        self._write_meta({
+            'version': self.STORE_VERSION,
+            'rows': rows,
+            'columns': dict(MT5_FRAME_DTYPES),
+            'time_start': str(np.datetime64(time_start, 'ns')) if time_start is not None else None,
+            'time_end': str(np.datetime64(time_end, 'ns')) if time_end is not None else None,
+            **source_meta,
+        }, tmp_dir)
+
+        # Cambio de directorio: dos renombrados (los memmap abiertos del anterior siguen válidos)
+        old_dir = self.store_dir.rstrip(os.sep) + '.old'
+        shutil.rmtree(old_dir, ignore_errors=True)
+        if os.path.exists(self.store_dir):
+            os.replace(self.store_dir, old_dir)
+        os.replace(tmp_dir, self.store_dir)
+        shutil.rmtree(old_dir, ignore_errors=True)
+        print(f"🗄️ Almacén de columnas escrito: {rows:,} filas en {self.store_dir}")
+        return self.open()
+
+    def build_from_frame(self, df: pd.DataFrame, source: Optional[str] = None) -> 'MT5ColumnStore':
+        return self._write([df], source=source)
+
+    def build_from_csv(self, filepath: str) -> 'MT5ColumnStore':
+        """Construye el almacén en streaming (sin cargar el CSV completo en memoria)"""
+        return self._write(iter_mt5_chunks(filepath), source=filepath)
+
+    @classmethod
+    def open_or_build(cls, filepath: str, store_dir: Optional[str] = None) -> 'MT5ColumnStore':
+        """Abre el almacén de filepath, reconstruyéndolo si el CSV cambió"""
+        store = cls(store_dir or cls.default_dir(filepath))
+        if store.is_fresh(filepath):
+            return store.open()
+        # Reutilizar la caché binaria si existe; si no, leer el CSV en bloques
+        cached = MT5BinaryCache().load(filepath) if config.USE_DATA_CACHE else None
+        if cached is not None:
+            return store.build_from_frame(cached, source=filepath)
+        return store.build_from_csv(filepath)
+
+print('✅ MT5ColumnStore cargado')
+
+# @title
+# [3F] ÍNDICE TEMPORAL DISPERSO (timestamp → offset) PARA CONSULTAS POR RANGO
+class MT5TimeIndex:
+    """Índice disperso de un CSV M1: el timestamp y el offset en bytes de 1 de cada STRIDE filas
+
+    Se construye una vez por archivo fuente y se guarda junto a él
+    (<archivo>.tidx.npz). Una consulta [start, end) lee solo los bytes entre las
+    dos entradas que la rodean: el coste es proporcional a la ventana (más como
+    mucho 2*STRIDE filas), no al tamaño del archivo.
+    """
+
+    INDEX_VERSION = 1
+    STRIDE = 4096
+
+    def __init__(self, filepath: str):
+        self.filepath = filepath
+        self.index_path = filepath + '.tidx.npz'
+        self.times = None      # int64 ns de cada entrada
+        self.offsets = None    # offset en bytes del inicio de la fila de cada entrada
+        self.end_offset = None
+        self.rows = 0
+        self.columns = None
+
+    def _current_mtime(self, data) -> Optional[int]:
+        """mtime actual del archivo si el índice sigue siendo válido para él (None si no)"""
+        if int(data['version']) != self.INDEX_VERSION or int(data['stride']) != self.STRIDE:
+            return None
+        return source_matches(self.filepath, int(data['source_size']),
+                              int(data['source_mtime_ns']), str(data['source_hash']))
+
+    def _save(self, source_size: int, source_mtime_ns: int, source_hash: str):
+        tmp_path = self.index_path + '.tmp.npz'
+        np.savez(tmp_path, version=self.INDEX_VERSION, stride=self.STRIDE,
+                 times=self.times, offsets=self.offsets, end_offset=self.end_offset, rows=self.rows,
+                 source_size=source_size, source_mtime_ns=source_mtime_ns, source_hash=source_hash)
+        os.replace(tmp_path, self.index_path)
+
+    def load(self) -> bool:
+        """Carga el índice persistido si sigue siendo válido para el archivo
+
+        Si solo cambió el mtime del archivo (mismo contenido), se guarda el nuevo para
+        no volver a hashearlo en la siguiente carga.
+        """
+        if not os.path.exists(self.index_path):
+            return False
+        try:
+            with np.load(self.index_path, allow_pickle=False) as data:
+                mtime_ns = self._current_mtime(data)
+                if mtime_ns is None:
+                    return False
+                self.times = data['times']
+                self.offsets = data['offsets']
+                self.end_offset = int(data['end_offset'])
+                self.rows = int(data['rows'])
+                source = int(data['source_size']), int(data['source_mtime_ns']), str(data['source_hash'])
+        except Exception:
+            return False
+        if mtime_ns != source[1]:
+            self._save(source[0], mtime_ns, source[2])
+        self.columns, _ = _mt5_header(self.filepath)
+        return True
+
+    def build(self) -> 'MT5TimeIndex':
+        """Recorre el archivo una vez y guarda 1 de cada STRIDE offsets con su timestamp"""
+        start_time = time.time()
+        # Huella antes de recorrerlo: si cambia durante la construcción, la siguiente carga lo detecta
+        stat = os.stat(self.filepath)
+        content_hash = MT5BinaryCache.content_hash(self.filepath)
+        buf = np.memmap(self.filepath, dtype=np.uint8, mode='r')
+        self.columns, header_size = _mt5_header(self.filepath)
+
+        # Offsets de inicio de fila, bloque a bloque para acotar la memoria
+        sampled = []
+        rows = 0
+        pending_start = np.array([header_size], dtype=np.int64)
+        block_size = 64 * 1024 * 1024
+        for block_start in range(header_size, len(buf), block_size):
+            block = buf[block_start:block_start + block_size]
+            next_starts = np.flatnonzero(block == _LF).astype(np.int64) + (block_start + 1)
+            starts = np.concatenate([pending_start, next_starts])
+            starts = starts[starts < len(buf)]
+            starts = starts[(buf[starts] != _LF) & (buf[starts] != _CR)]
+            pending_start = np.empty(0, dtype=np.int64)
+
+            row_numbers = rows + np.arange(len(starts))
+            sampled.append(starts[row_numbers % self.STRIDE == 0])
+            rows += len(starts)
+
+        offsets = np.concatenate(sampled) if sampled else np.empty(0, dtype=np.int64)
+        times = _mt5_datetime_at(buf, offsets)
+        if times is None:
+            # Layout no estándar: parsear solo las líneas muestreadas
+            times = np.empty(len(offsets), dtype='datetime64[ns]')
+            for i, offset in enumerate(offsets):
+                line = bytes(buf[offset:offset + 64]).split(b'\n')[0].decode().split('\t')
+                times[i] = pd.Timestamp(line[0].replace('.', '-') + ' ' + line[1]).to_datetime64()
+
+        self.times = times.view('int64')
+        self.offsets = offsets
+        self.end_offset = len(buf)
+        self.rows = rows
+        del buf
+
+        self._save(stat.st_size, stat.st_mtime_ns, content_hash)
+        print(f"🗂️ Índice temporal construido: {rows:,} filas, {len(offsets):,} entradas "
+              f"({time.time() - start_time:.2f}s)")
+        return self
+
+    def query(self, start=None, end=None) -> Tuple[int, int]:
+        """Rango de bytes [lo, hi) que contiene todas las filas con time en [start, end)"""
+        lo_entry = 0
+        if start is not None:
+            lo_entry = max(int(np.searchsorted(self.times, pd.Timestamp(start).value, side='left')) - 1, 0)
+        hi = self.end_offset
+        if end is not None:
+            hi_entry = int(np.searchsorted(self.times, pd.Timestamp(end).value, side='left'))
+            if hi_entry < len(self.offsets):
+                hi = int(self.offsets[hi_entry])
+        lo = int(self.offsets[lo_entry]) if len(self.offsets) else self.end_offset
+        return lo, max(lo, hi)
+
+    def read_range(self, start=None, end=None) -> pd.DataFrame:
+        """Lee solo las filas con time en [start, end)"""
+        lo, hi = self.query(start, end)
+        with open(self.filepath, 'rb') as f:
+            f.seek(lo)
+            block = f.read(hi - lo)
+        start = np.datetime64(pd.Timestamp(start), 'ns') if start is not None else None
+        end = np.datetime64(pd.Timestamp(end), 'ns') if end is not None else None
+        chunk = _parse_mt5_block(block, self.columns, start=start, end=end) if block.strip() else None
+        if chunk is None:
+            return MT5BinaryCache._frame_from_columns(
+                {name: np.empty(0, dtype=dtype) for name, dtype in MT5_FRAME_DTYPES.items()})
+        return chunk
+
+    @classmethod
+    def open_or_build(cls, filepath: str) -> 'MT5TimeIndex':
+        index = cls(filepath)
+        if not index.load():
+            index.build()
+        return index
+
+print('✅ MT5TimeIndex cargado')
+
+# @title
+# [3G] REGISTRO DECLARATIVO DE FEATURES (dependencias + evaluación perezosa)
+class FeatureSpec:
+    """Columnas que se calculan juntas, sus entradas y las filas de calentamiento"""
+
+    def __init__(self, outputs: List[str], inputs: List[str], warmup: int, compute, group: str,
+                 recursive: bool = False):
+        self.outputs = list(outputs)
+        self.inputs = list(inputs)
+        self.warmup = warmup      # filas iniciales sin valor, además de las de sus entradas
+        self.compute = compute    # compute(df, ctx) -> valor, tupla de valores o dict {columna: valor}
+        self.group = group        # 'base' (add_features) o 'advanced' (advanced_feature_engineering)
+        self.recursive = recursive  # memoria infinita (EMA, Wilder, OBV...): depende de todo el histórico
+
+    def __repr__(self):
+        return f"FeatureSpec({self.outputs}, inputs={self.inputs}, warmup={self.warmup})"
+
+
+def _as_column(value, index: pd.Index, name: str) -> pd.Series:
+    """Resultado de una feature como Series alineada con index (igual que df[name] = value)"""
+    if isinstance(value, pd.Series):
+        if not value.index.equals(index):
+            value = value.reindex(index)
+        return value.rename(name)
+    if np.ndim(value) == 0:
+        return pd.Series(value, index=index, name=name)
+    return pd.Series(np.asarray(value), index=index, name=name)
+
+
+class _FeatureFrame:
+    """Vista de lectura de un DataFrame más las columnas calculadas aún no insertadas
+
+    Las funciones de las features leen frame['col'], frame.index, len(frame)...
+    como si fuera el DataFrame; el resto de atributos se delegan en el original.
+    """
+
+    def __init__(self, df: pd.DataFrame, columns: Dict[str, pd.Series]):
+        self._df = df
+        self._columns = columns
+        self.cache = {}  # cálculos compartidos entre features (p. ej. RollingWindowStats)
+
+    def __getitem__(self, key):
+        if isinstance(key, str) and key in self._columns:
+            return self._columns[key]
+        if isinstance(key, list) and any(k in self._columns for k in key):
+            return pd.DataFrame({k: self[k] for k in key}, index=self._df.index)
+        return self._df[key]
+
+    def __contains__(self, name) -> bool:
+        return name in self._columns or name in self._df.columns
+
+    def __len__(self) -> int:
+        return len(self._df)
+
+    def get(self, name, default=None):
+        return self[name] if name in self else default
+
+    @property
+    def columns(self) -> pd.Index:
+        return self._df.columns.append(pd.Index([c for c in self._columns if c not in self._df.columns]))
+
+    def __getattr__(self, attr):
+        return getattr(self._df, attr)
+
+    def materialize(self, target_dtype=None) -> pd.DataFrame:
+        """DataFrame final: columnas existentes recalculadas en su sitio, nuevas al final
+
+        target_dtype(series) -> dtype o None: conversión de cada columna nueva. Se
+        hace columna a columna liberando la original, así que el pico de memoria
+        no llega a tener la matriz completa en los dos tipos a la vez.
+        """
+        df, columns = self._df, self._columns
+        if not columns:
+            return df
+        replaced = {name: value for name, value in columns.items() if name in df.columns}
+        if replaced:
+            df = df.assign(**replaced)
+        added = {}
+        for name in [name for name in columns if name not in replaced]:
+            value = columns.pop(name)
+            dtype = target_dtype(value) if target_dtype is not None else None
+            added[name] = value.astype(dtype) if dtype is not None else value
+        if not added:
+            return df
+        return pd.concat([df, pd.DataFrame(added, index=df.index)], axis=1, copy=False)
+
+
+class FeatureRegistry:
+    """Registro de features con su grafo de dependencias
+
+    Cada feature declara sus columnas de entrada, su calentamiento y la función
+    que la calcula. Las entradas deben ser columnas base o features registradas
+    antes, así que el orden de registro ya es un orden topológico y, calculando
+    todo, las columnas salen en el mismo orden de siempre.
+
+    resolve(['bb_position']) devuelve solo las specs necesarias (bb_position y
+    las bandas de Bollinger): un reentrenamiento con un conjunto de features
+    conocido evita calcular el resto de indicadores.
+    """
+
+    BASE_COLUMNS = ['open', 'high', 'low', 'close', 'tick_volume', 'spread', 'real_volume']
+
+    def __init__(self):
+        self.specs: List[FeatureSpec] = []
+        self._producers: Dict[str, FeatureSpec] = {}
+        self.last_timings: Dict[str, float] = {}  # segundos por spec (primera salida) del último compute
+
+    def register(self, outputs, inputs=('close',), warmup: int = 0, group: str = 'base',
+                 recursive: bool = False):
+        """Decorador: registra compute(df, ctx) como productor de outputs"""
+        outputs = [outputs] if isinstance(outputs, str) else list(outputs)
+
+        def decorator(compute):
+            for name in inputs:
+                if name not in self.BASE_COLUMNS and name not in self._producers:
+                    raise ValueError(f"Feature {outputs}: la entrada '{name}' no está registrada")
+            spec = FeatureSpec(outputs, inputs, warmup, compute, group, recursive)
+            self.specs.append(spec)
+            for name in outputs:
+                self._producers[name] = spec
+            return compute
+        return decorator
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._producers
+
+    @property
+    def feature_names(self) -> List[str]:
+        return [name for spec in self.specs for name in spec.outputs]
+
+    def resolve(self, requested: Optional[List[str]] = None, group: Optional[str] = None) -> List[FeatureSpec]:
+        """Specs necesarias para requested (todas si es None), en orden topológico
+
+        Los nombres que no produce el registro (columnas base, regímenes...) se ignoran.
+        """
+        if requested is None:
+            needed = set(map(id, self.specs))
+        else:
+            needed, stack = set(), [self._producers[n] for n in requested if n in self._producers]
+            while stack:
+                spec = stack.pop()
+                if id(spec) in needed:
+                    continue
+                needed.add(id(spec))
+                stack.extend(self._producers[n] for n in spec.inputs if n in self._producers)
+        return [spec for spec in self.specs
+                if id(spec) in needed and (group is None or spec.group == group)]
+
+    def warmup(self, requested: Optional[List[str]] = None) -> int:
+        """Filas iniciales sin valor del conjunto pedido (calentamiento acumulado por el DAG)"""
+        total = {}
+        for spec in self.resolve(requested):
+            upstream = [total[id(self._producers[n])] for n in spec.inputs if n in self._producers]
+            total[id(spec)] = spec.warmup + max(upstream, default=0)
+        return max(total.values(), default=0)
+
+    def split_for_append(self, requested: Optional[List[str]] = None,
+                         group: Optional[str] = None) -> Tuple[List[FeatureSpec], List[FeatureSpec], int]:
+        """Reparte las specs para calcular solo una cola nueva de filas
+
+        Devuelve (specs a recalcular sobre todo el histórico, specs de ventana finita,
+        filas de contexto que necesitan las de ventana). Las recursivas, lo que
+        depende de ellas y sus entradas van al primer grupo.
+        """
+        specs = self.resolve(requested, group)
+        full_ids = set()
+        for spec in specs:
+            if spec.recursive or any(id(self._producers[n]) in full_ids
+                                     for n in spec.inputs if n in self._producers):
+                full_ids.add(id(spec))
+        inputs_of_full = self.resolve([s.outputs[0] for s in specs if id(s) in full_ids], group)
+        full_ids |= set(map(id, inputs_of_full))
+
+        full = [spec for spec in specs if id(spec) in full_ids]
+        window = [spec for spec in specs if id(spec) not in full_ids]
+        total = {}
+        for spec in window:
+            upstream = [total.get(id(self._producers[n]), 0) for n in spec.inputs if n in self._producers]
+            total[id(spec)] = spec.warmup + max(upstream, default=0)
+        return full, window, max(total.values(), default=0)
+
+    def compute(self, df: pd.DataFrame, requested: Optional[List[str]] = None,
+                group: Optional[str] = None, ctx: Optional[dict] = None,
+                specs: Optional[List[FeatureSpec]] = None, dtype_policy: bool = False) -> pd.DataFrame:
+        """df con las features pedidas y sus dependencias (o las specs dadas) añadidas
+
+        Las columnas nuevas se acumulan en un dict y se unen a df de una vez al
+        final (un bloque por dtype), en lugar de insertarlas una a una en df.
+        dtype_policy: las columnas nuevas se guardan ya con el tipo de la política
+        (apply_dtype_policy); los cálculos intermedios siguen en su tipo original.
+        """
+        ctx = ctx if ctx is not None else {}
+        columns: Dict[str, pd.Series] = {}
+        frame = _FeatureFrame(df, columns)
+        self.last_timings = {}
+        for spec in (specs if specs is not None else self.resolve(requested, group)):
+            if any(name not in frame for name in spec.inputs):
+                continue  # faltan entradas: la feature no aplica a este frame
+            start = time.perf_counter()
+            values = spec.compute(frame, ctx)
+            self.last_timings[spec.outputs[0]] = time.perf_counter() - start
+            if values is None:
+                continue
+            if isinstance(values, dict):
+                items = values.items()
+            elif len(spec.outputs) > 1:
+                items = zip(spec.outputs, values)
+            else:
+                items = [(spec.outputs[0], values)]
+            for name, value in items:
+                columns[name] = _as_column(value, df.index, name)
+        return frame.materialize(policy_dtype if dtype_policy else None)
+
+    def prune(self, df: pd.DataFrame, requested: List[str]) -> pd.DataFrame:
+        """Quita las dependencias calculadas que no se pidieron (columnas externas se conservan)"""
+        keep = set(requested)
+        drop = [c for c in df.columns if c in self._producers and c not in keep]
+        return df.drop(columns=drop)
+
+
+FEATURE_REGISTRY = FeatureRegistry()
+_register = FEATURE_REGISTRY.register
+
+# Subir al cambiar cómo se calcula alguna feature (invalida el FeatureStore)
+FEATURE_VERSION = 7
+
+# Features enteras o booleanas: se guardan con el tipo más pequeño que las representa
+INTEGER_FEATURE_DTYPES = {
+    'is_bullish': 'uint8', 'is_doji': 'uint8', 'is_hammer': 'uint8', 'is_outlier': 'uint8',
+    'hour': 'uint8', 'day_of_week': 'uint8', 'day_of_month': 'uint8', 'month': 'uint8', 'quarter': 'uint8',
+    'market_regime': 'int8',
+}
+
+
+def apply_dtype_policy(df: pd.DataFrame, float_dtype: Optional[str] = None) -> pd.DataFrame:
+    """Convierte df a la política de tipos (config.FEATURE_DTYPE) en el borde de una etapa
+
+    Los indicadores se calculan igual que antes: rolling, ewm y ta trabajan en float64
+    internamente aunque la entrada sea float32, y solo el resultado se guarda en
+    float_dtype. Kernels sensibles a la precisión, que no deben recibir float32:
+      - momentos de ventana (std, skew, kurt) y ADF: RollingWindowStats, rolling_adf_statistic
+        y statsmodels pasan a float64
+      - GMM de detect_market_regimes: RegimeModel se ajusta y predice en float64
+      - OBV: suma acumulada de volúmenes, se mantiene entera (int64)
+      - StandardScaler/RobustScaler: acumulan en float64 y devuelven el tipo de entrada
+    Las columnas enteras conocidas pasan a INTEGER_FEATURE_DTYPES; el resto de enteros
+    (volúmenes, OBV) no se tocan.
+    """
+    dtypes = {name: policy_dtype(df[name], float_dtype) for name in df.columns}
+    dtypes = {name: dtype for name, dtype in dtypes.items() if dtype is not None}
+    if len(dtypes) <= 8:
+        # Pocas columnas (base, regímenes): astype solo copia esas y deja el resto como está
+        return df.astype(dtypes, copy=False) if dtypes else df
+    # DataFrame.astype(dict) deja un bloque por columna; reconstruir el frame agrupa
+    # las columnas en un bloque por dtype
+    return pd.DataFrame({name: df[name].astype(dtypes[name]) if name in dtypes else df[name]
+                         for name in df.columns}, index=df.index)
+
+
+def policy_dtype(column: pd.Series, float_dtype: Optional[str] = None) -> Optional[np.dtype]:
+    """dtype que la política asigna a column (None si ya lo tiene o no le aplica)"""
+    dtype = column.dtype
+    if column.name in INTEGER_FEATURE_DTYPES and (dtype.kind in 'iub' or
+                                                  (dtype.kind == 'f' and column.notna().all())):
+        target = np.dtype(INTEGER_FEATURE_DTYPES[column.name])
+    elif dtype.kind == 'f':
+        target = np.dtype(float_dtype or config.FEATURE_DTYPE)
+    else:
+        return None
+    return target if dtype != target else None
+
+
+def fill_numeric_gaps(df: pd.DataFrame) -> pd.DataFrame:
+    """Rellena NaN de las columnas numéricas (ffill y después 0) sin reinsertarlas una a una"""
+    numeric_columns = df.select_dtypes(include=[np.number]).columns
+    if len(numeric_columns) == len(df.columns):
+        filled = df.fillna(method='ffill')
+        filled.fillna(0, inplace=True)
+        return filled
+    filled = df[numeric_columns].fillna(method='ffill').fillna(0)
+    return pd.concat([filled, df.drop(columns=numeric_columns)], axis=1)[df.columns]
+
+
+class RollingWindowStats:
+    """Estadísticas de ventana móvil de una serie para varias ventanas a la vez
+
+    Sustituye a una llamada rolling(w).std()/skew()/kurt()/max()/min() por ventana
+    y estadístico: las sumas acumuladas de potencias y la tabla de máximos/mínimos
+    se construyen una vez por serie y cada ventana se resuelve con restas
+    vectorizadas sobre ellas. Misma semántica que pandas (min_periods = ventana,
+    std con ddof=1, skew/kurt con corrección de sesgo, ventanas constantes a
+    0 / 0 / -3).
+
+    Las sumas acumuladas se reinician cada `block` filas y se centran en la media
+    del bloque: una suma global de x**4 sobre cientos de miles de precios pierde
+    los dígitos que distinguen una ventana de la siguiente. Con precios, el
+    resultado es más preciso que el de pandas, que centra todo en round(media).
+    """
+
+    def __init__(self, values, max_window: int = 128):
+        x = np.asarray(values, dtype=np.float64)
+        self.n = len(x)
+        self.max_window = int(max_window)
+        self.block = max(1024, 8 * self.max_window)
+        self._x = x
+        nan = np.isnan(x)
+        self._has_nan = bool(nan.any())
+        self._nan = nan
+        self._nan_count = np.concatenate([[0], np.cumsum(nan)]) if self._has_nan else None
+        self._deviations = None   # (x - media de su bloque, cola del bloque - media del siguiente)
+        self._sums = {}           # {potencia: (acumulada en el bloque, hasta la fila anterior, sufijos de la cola)}
+        self._levels = {}         # {'max'/'min': [tabla de 1, 2, 4... filas]}
+        self._run_length = None   # valores iguales consecutivos que acaban en cada fila
+
+    def _valid(self, w: int) -> np.ndarray:
+        """Filas cuya ventana de w no tiene NaN"""
+        return self._nan_count[w:] - self._nan_count[:-w] == 0
+
+    def _build_deviations(self):
+        n, block, tail = self.n, self.block, self.max_window - 1
+        n_blocks = -(-n // block)
+        invalid = np.ones(n_blocks * block, dtype=bool)
+        invalid[:n] = self._nan
+        invalid = invalid.reshape(n_blocks, block)
+        padded = np.zeros(n_blocks * block)
+        padded[:n] = np.where(self._nan, 0.0, self._x) if self._has_nan else self._x
+        padded = padded.reshape(n_blocks, block)
+        centers = padded.sum(axis=1) / np.maximum(block - invalid.sum(axis=1), 1)
+        deviations = padded - centers[:, None]
+        deviations[invalid] = 0.0
+        next_centers = np.append(centers[1:], centers[-1:])
+        tail_deviations = padded[:, block - tail:] - next_centers[:, None]
+        tail_deviations[invalid[:, block - tail:]] = 0.0
+        self._deviations = (deviations, tail_deviations)
+
+    def _power_sums(self, power: int):
+        if power not in self._sums:
+            if self._deviations is None:
+                self._build_deviations()
+            deviations, tail_deviations = self._deviations
+            terms, tail_terms = deviations, tail_deviations
+            for _ in range(power - 1):
+                terms, tail_terms = terms * deviations, tail_terms * tail_deviations
+            block_sums = np.cumsum(terms, axis=1).ravel()[:self.n]
+            before = block_sums - terms.ravel()[:self.n]
+            # Suma desde cada fila de la cola hasta el final de su bloque, centrada en la
+            # media del bloque siguiente (la parte izquierda de las ventanas que lo cruzan)
+            suffixes = np.cumsum(tail_terms[:, ::-1], axis=1)[:, ::-1].ravel()
+            self._sums[power] = (block_sums, before, suffixes)
+        return self._sums[power]
+
+    def _window_sums(self, w: int, powers) -> List[np.ndarray]:
+        """Sumas de (x - c)**p de cada ventana completa, con c la media del bloque donde acaba"""
+        if w > self.max_window:
+            raise ValueError(f"Ventana {w} mayor que max_window ({self.max_window})")
+        block, tail, m = self.block, self.max_window - 1, self.n - w + 1
+        # Ventanas que empiezan en el bloque anterior: filas de fin en las w - 1 primeras
+        # posiciones de cada bloque
+        cross_ends = (np.arange(block, self.n, block)[:, None] + np.arange(w - 1)).ravel()
+        cross_ends = cross_ends[cross_ends < self.n]
+        starts = cross_ends - w + 1
+        suffix_index = (starts // block) * tail + starts % block - (block - tail)
+        result = []
+        for power in powers:
+            block_sums, before, suffixes = self._power_sums(power)
+            sums = block_sums[w - 1:] - before[:m]
+            sums[starts] = block_sums[cross_ends] + suffixes[suffix_index]
+            result.append(sums)
+        return result
+
+    def _extreme(self, w: int, mode: str) -> np.ndarray:
+        """Máximo/mínimo de cada ventana completa con una tabla de potencias de dos"""
+        reduce = np.maximum if mode == 'max' else np.minimum
+        levels = self._levels.setdefault(mode, [self._x])
+        while (1 << len(levels)) <= w:
+            span = 1 << (len(levels) - 1)
+            prev = levels[-1]
+            levels.append(reduce(prev[:-span], prev[span:]))
+        k = w.bit_length() - 1
+        table = levels[k]
+        m = self.n - w + 1
+        return reduce(table[:m], table[w - (1 << k):w - (1 << k) + m])
+
+    def _constant(self, w: int) -> np.ndarray:
+        """Ventanas con todos los valores iguales (pandas fuerza std 0, skew 0, kurt -3)"""
+        if self._run_length is None:
+            self._run_length = _equal_run_lengths(self._x)
+        return self._run_length[w - 1:] >= w
+
+    def _finish(self, w: int, values: Optional[np.ndarray]) -> np.ndarray:
+        out = np.full(self.n, np.nan)
+        if values is not None and w <= self.n:
+            if self._has_nan:
+                values[~self._valid(w)] = np.nan
+            out[w - 1:] = values
+        return out
+
+    def max(self, w: int) -> np.ndarray:
+        return self._finish(w, self._extreme(w, 'max') if w <= self.n else None)
+
+    def min(self, w: int) -> np.ndarray:
+        return self._finish(w, self._extreme(w, 'min') if w <= self.n else None)
+
+    def std(self, w: int, ddof: int = 1) -> np.ndarray:
+        if w <= ddof or w > self.n:
+            return self._finish(w, None)
+        s1, s2 = self._window_sums(w, (1, 2))
+        var = np.maximum((s2 - s1 * s1 / w) / (w - ddof), 0.0)
+        var[self._constant(w)] = 0.0
+        return self._finish(w, np.sqrt(var))
+
+    def skew(self, w: int) -> np.ndarray:
+        if w < 3 or w > self.n:
+            return self._finish(w, None)
+        s1, s2, s3 = self._window_sums(w, (1, 2, 3))
+        a = s1 / w
+        b = s2 / w - a * a
+        c = s3 / w - a * a * a - 3 * a * b
+        with np.errstate(divide='ignore', invalid='ignore'):
+            r = np.sqrt(b)
+            result = np.sqrt(w * (w - 1.0)) * c / ((w - 2) * r * r * r)
+        result[b <= 1e-14] = np.nan
+        result[self._constant(w)] = 0.0
+        return self._finish(w, result)
+
+    def kurt(self, w: int) -> np.ndarray:
+        if w < 4 or w > self.n:
+            return self._finish(w, None)
+        s1, s2, s3, s4 = self._window_sums(w, (1, 2, 3, 4))
+        a = s1 / w
+        r = a * a
+        b = s2 / w - r
+        r = r * a
+        c = s3 / w - r - 3 * a * b
+        r = r * a
+        d = s4 / w - r - 6 * b * a * a - 4 * c * a
+        with np.errstate(divide='ignore', invalid='ignore'):
+            k = (w * w - 1.0) * d / (b * b) - 3 * ((w - 1.0) ** 2)
+            result = k / ((w - 2.0) * (w - 3.0))
+        result[b <= 1e-14] = np.nan
+        result[self._constant(w)] = -3.0
+        return self._finish(w, result)
+
+
+def _window_stats(df, column: str) -> RollingWindowStats:
+    """RollingWindowStats de df[column], compartido por las features de un mismo compute"""
+    cache = df.cache if isinstance(df, _FeatureFrame) else {}
+    if column not in cache:
+        cache[column] = RollingWindowStats(df[column])
+    return cache[column]
+
+
+def _equal_run_lengths(x: np.ndarray) -> np.ndarray:
+    """Número de valores iguales consecutivos que acaban en cada fila"""
+    rows = np.arange(len(x))
+    changes = np.ones(len(x), dtype=bool)
+    changes[1:] = x[1:] != x[:-1]
+    return rows - np.maximum.accumulate(np.where(changes, rows, 0)) + 1
+
+
+def _sliding_sums(x: np.ndarray, width: int) -> np.ndarray:
+    """Suma de cada tramo de width filas (suma directa, sin acumuladas que pierdan dígitos)"""
+    return np.convolve(x, np.ones(width), mode='valid')
+
+
+def rolling_autocorr(values, window: int, lag: int) -> np.ndarray:
+    """Autocorrelación de cada ventana: series.rolling(window).apply(lambda x: x.autocorr(lag))
+
+    Pearson entre los window - lag primeros y los window - lag últimos valores de la
+    ventana, a partir de sumas deslizantes de x, x**2 y x[t] * x[t + lag] calculadas
+    una vez para toda la serie. Resultado recortado a [-1, 1] y NaN en ventanas con NaN.
+
+    Diferencia deliberada con Series.autocorr: si uno de los tramos es constante se
+    devuelve NaN, mientras que pandas devuelve ruido de redondeo cuando la media del
+    tramo no es exacta (2e-16 con 0.1 repetido). mean_reversion_half_life convierte
+    ambos casos en 0.
+    """
+    x = np.asarray(values, dtype=np.float64)
+    n, m = len(x), window - lag
+    out = np.full(n, np.nan)
+    if n < window or m < 2:
+        return out
+    nan = np.isnan(x)
+    # Centrar en la media global: las sumas de cuadrados no arrastran el nivel de la serie
+    x = np.where(nan, 0.0, x - (x[~nan].mean() if (~nan).any() else 0.0))
+    count = n - window + 1
+    sums = _sliding_sums(x, m)
+    squares = _sliding_sums(x * x, m)
+    products = _sliding_sums(x[:-lag] * x[lag:], m)[:count] if lag else squares[:count]
+    sum_a, sum_b = sums[:count], sums[lag:lag + count]
+    var_a = squares[:count] - sum_a * sum_a / m
+    var_b = squares[lag:lag + count] - sum_b * sum_b / m
+    with np.errstate(divide='ignore', invalid='ignore'):
+        corr = np.clip((products - sum_a * sum_b / m) / np.sqrt(var_a * var_b), -1.0, 1.0)
+    runs = _equal_run_lengths(np.asarray(values, dtype=np.float64))
+    constant = (runs[m - 1:m - 1 + count] >= m) | (runs[window - 1:] >= m)
+    corr[constant] = np.nan
+    if nan.any():
+        corr[_sliding_sums(nan.astype(np.float64), window) > 0] = np.nan
+    out[window - 1:] = corr
+    return out
+
+
+def mean_reversion_half_life(autocorr: np.ndarray) -> np.ndarray:
+    """Half-life -ln(2) / ln(|autocorrelación|); 0 donde no está definida (|ac| <= 1e-8 o NaN)"""
+    magnitude = np.abs(autocorr)
+    defined = magnitude > 1e-8
+    with np.errstate(divide='ignore', invalid='ignore'):
+        half_life = -np.log(2) / np.log(magnitude + 1e-8)
+    half_life = np.where(defined & np.isfinite(half_life), half_life, 0.0)
+    return half_life
+
+
+def rolling_trend_slope(values, window: int) -> np.ndarray:
+    """Pendiente de la recta de mínimos cuadrados de cada ventana (np.polyfit(range(w), x, 1)[0])
+
+    cov(t, x) / var(t) con t = 0..w-1: una correlación de la serie con el núcleo
+    fijo t - media(t), sin ajustar un polinomio por ventana.
+    """
+    x = np.asarray(values, dtype=np.float64)
+    out = np.full(len(x), np.nan)
+    if len(x) < window or window < 2:
+        return out
+    kernel = np.arange(window) - (window - 1) / 2
+    out[window - 1:] = np.correlate(x, kernel, mode='valid') / (kernel * kernel).sum()
+    return out
+
+
+def hurst_exponent(series, max_lag: int = 100) -> float:
+    """Exponente de Hurst de una serie (referencia escalar de rolling_hurst)"""
+    try:
+        # Posicional: con una Series, series[lag:] - series[:-lag] se alinearía por índice
+        series = np.asarray(series, dtype=np.float64)
+        lags = range(2, min(max_lag, len(series)//2))
+        tau = [np.sqrt(np.std(np.subtract(series[lag:], series[:-lag]))) for lag in lags]
+        if len(tau) > 0 and len(lags) > 0:
+            poly = np.polyfit(np.log(lags), np.log(tau), 1)
+            return poly[0] * 2.0
+    except:
+        pass
+    return 0.5  # Valor neutral si no se puede calcular
+
+
+def rolling_hurst(values, windows: List[int], max_lag: int = 100) -> Dict[int, np.ndarray]:
+    """Exponente de Hurst de cada ventana para varias ventanas a la vez
+
+    Mismo estimador que hurst_exponent: para cada lag de 2 a
+    min(max_lag, w // 2) - 1, tau = sqrt(std(x[lag:] - x[:-lag])) y H = 2 * pendiente
+    de log(tau) frente a log(lag). Las dispersiones de todas las ventanas salen de
+    sumas acumuladas de las diferencias de cada lag (compartidas por todas las
+    ventanas) y la pendiente es una combinación lineal fija de los log(var): la
+    regresión de todas las filas se acumula lag a lag sin ajustar nada por ventana.
+    Como la versión escalar: NaN si algún tau es 0 (polyfit con log(0)), 0.5 si no
+    hay lags suficientes y NaN en ventanas con NaN.
+    """
+    x = np.asarray(values, dtype=np.float64)
+    n = len(x)
+    windows = sorted(set(windows))
+    result = {w: np.full(n, np.nan) for w in windows}
+    active = [w for w in windows if w <= n]
+    if not active:
+        return result
+    nan = np.isnan(x)
+    if nan.any():
+        x = np.where(nan, 0.0, x)
+    lags = {w: np.arange(2, min(max_lag, w // 2)) for w in active}
+    # Pendiente de mínimos cuadrados = sum(weights * y) con weights fijos por ventana
+    weights = {}
+    for w, window_lags in lags.items():
+        if len(window_lags) > 1:
+            centered = np.log(window_lags) - np.log(window_lags).mean()
+            weights[w] = centered / (centered * centered).sum()
+    sums = {w: np.zeros(n - w + 1) for w in active}
+    degenerate = {w: np.zeros(n - w + 1, dtype=bool) for w in active}
+    for lag in range(2, max(len(l) + 2 for l in lags.values())):
+        diffs = x[lag:] - x[:-lag]
+        first = np.concatenate([[0.0], np.cumsum(diffs)])
+        second = np.concatenate([[0.0], np.cumsum(diffs * diffs)])
+        for w in active:
+            if w not in weights or lag - 2 >= len(lags[w]):
+                continue
+            m = w - lag
+            mean = (first[m:] - first[:-m]) / m
+            var = (second[m:] - second[:-m]) / m - mean * mean
+            zero = var <= 0
+            degenerate[w] |= zero
+            sums[w] += weights[w][lag - 2] * np.log(np.where(zero, 1.0, var))
+    for w in active:
+        # log(tau) = log(var) / 4 y H = 2 * pendiente
+        hurst = np.where(degenerate[w], np.nan, 0.5 * sums[w]) if w in weights else np.full(n - w + 1, 0.5)
+        if nan.any():
+            nan_count = np.concatenate([[0], np.cumsum(nan)])
+            hurst[nan_count[w:] - nan_count[:-w] > 0] = np.nan
+        result[w][w - 1:] = hurst
+    return result
+
+
+def rolling_adf_statistic(values, window: int, lags: int = 1) -> np.ndarray:
+    """Estadístico t de Dickey-Fuller aumentado de cada ventana (retardos fijos, con constante)
+
+    Igual que adfuller(ventana, maxlag=lags, autolag=None, regression='c')[0]: regresión
+    de dx_t sobre x_{t-1}, dx_{t-1}..dx_{t-lags} y una constante, con las
+    window - 1 - lags observaciones de la ventana. Los momentos de todas las ventanas
+    salen de sumas deslizantes de los productos de cada par de columnas (centrados en
+    la ventana, lo que absorbe la constante) y las ecuaciones normales se eliminan a la
+    vez para todas las ventanas: con x_{t-1} como último regresor y dx_t detrás, los
+    dos últimos pivotes son 1 / inv(X'X)[x, x] y la suma de residuos, y el estadístico
+    sale sin resolver cada sistema. NaN en ventanas con NaN, constantes, con
+    regresores colineales o con ajuste exacto (adfuller devuelve ahí valores de la
+    pseudoinversa o de residuos nulos).
+    """
+    x = np.asarray(values, dtype=np.float64)
+    n = len(x)
+    out = np.full(n, np.nan)
+    m, k = window - 1 - lags, lags + 1
+    if n < window or m <= k + 1:
+        return out
+    nan = np.isnan(x)
+    # Centrar en la media global: los productos de niveles no arrastran el precio
+    x = np.where(nan, 0.0, x - (x[~nan].mean() if (~nan).any() else 0.0))
+    dx = np.diff(x)
+    # Columnas para t = lags + 1 .. n - 1: [dx_{t-1}, ..., dx_{t-lags}, x_{t-1}, dx_t]
+    columns = [dx[lags - i:len(dx) - i] for i in range(1, lags + 1)] + [x[lags:-1], dx[lags:]]
+    sums = [_sliding_sums(c, m) for c in columns]
+    count = n - window + 1
+    moments = np.empty((count, k + 1, k + 1))
+    for a in range(k + 1):
+        for b in range(a, k + 1):
+            moments[:, a, b] = moments[:, b, a] = (
+                _sliding_sums(columns[a] * columns[b], m) - sums[a] * sums[b] / m)
+
+    # Eliminación gaussiana sin pivoteo (X'X es semidefinida positiva) en todas las ventanas
+    scale = np.einsum('ijj->ij', moments).copy()
+    singular = np.zeros(count, dtype=bool)
+    for j in range(k):
+        pivot = moments[:, j, j]
+        singular |= ~(pivot > 1e-10 * scale[:, j])
+        factor = moments[:, j + 1:, j] / np.where(singular, 1.0, pivot)[:, None]
+        moments[:, j + 1:, j + 1:] -= factor[:, :, None] * moments[:, None, j, j + 1:]
+    # Tras eliminar los lags: pivote de x_{t-1} y su covarianza parcial con dx_t
+    pivot, partial = moments[:, k - 1, k - 1], moments[:, k - 1, k]
+    residual = moments[:, k, k]
+    singular |= ~(residual > 1e-10 * scale[:, k])  # ajuste exacto: t sin sentido
+    with np.errstate(divide='ignore', invalid='ignore'):
+        stat = partial / np.sqrt(pivot * residual / (m - k - 1))
+    stat[singular | ~np.isfinite(stat)] = np.nan
+    if nan.any():
+        stat[_sliding_sums(nan.astype(np.float64), window) > 0] = np.nan
+    out[window - 1:] = stat
+    return out
+
+
+def verify_rolling_stats(bars: pd.DataFrame) -> pd.DataFrame:
+    """Paridad y tiempos de los kernels de ventana frente a las llamadas pandas que sustituyen
+
+    RollingWindowStats contra close.rolling(w).std/skew/kurt/max/min; rolling_autocorr,
+    mean_reversion_half_life, rolling_trend_slope y rolling_hurst contra los
+    rolling().apply que sustituyeron (autocorr, la lambda del half-life, np.polyfit y
+    hurst_exponent) y, con statsmodels, rolling_adf_statistic contra adfuller. Conviene que bars
+    incluya un tramo plano y algún NaN: las ventanas constantes (0 / 0 / -3) y las que
+    contienen NaN son donde las sumas acumuladas se separan de pandas. La diferencia
+    es relativa a la escala de la referencia, como en verify_indicator_backends.
+    """
+    close = bars['close'].astype(np.float64)
+    returns = close.pct_change().fillna(0)
+    deviation = close / close.rolling(20).mean() - 1
+
+    def autocorr(x, lag):
+        # NaN con un tramo constante, como rolling_autocorr (pandas devuelve ruido de redondeo)
+        if x.iloc[:-lag].nunique() < 2 or x.iloc[lag:].nunique() < 2:
+            return np.nan
+        return x.autocorr(lag=lag)
+
+    def half_life(x):
+        ac = autocorr(x, 1)
+        return -np.log(2) / np.log(abs(ac) + 1e-8) if abs(ac) > 1e-8 else np.inf
+
+    # La kurtosis de pandas pierde dígitos con precios reales (centra en round(media)):
+    # frente a un cálculo en dos pasadas su error llega a 1e-5..1e-4 y el nuestro a 1e-8
+    tolerances = {'std': 1e-6, 'skew': 1e-6, 'kurt': 1e-4, 'max': 0.0, 'min': 0.0}
+    cases = {}
+    for w in [20, 50, 100]:
+        for stat, tolerance in tolerances.items():
+            cases[f'{stat}_{w}'] = (lambda stat=stat, w=w: getattr(RollingWindowStats(close), stat)(w),
+                                    lambda stat=stat, w=w: getattr(close.rolling(w), stat)(), tolerance)
+    for lag in [1, 5, 10]:
+        cases[f'autocorr_lag_{lag}'] = (lambda lag=lag: rolling_autocorr(returns, 50, lag),
+                                        lambda lag=lag: returns.rolling(50).apply(lambda x: autocorr(x, lag)), 1e-9)
+    cases['mean_reversion_hl'] = (
+        lambda: mean_reversion_half_life(rolling_autocorr(deviation, 50, 1)),
+        lambda: deviation.rolling(50).apply(half_life).replace([np.inf, -np.inf], np.nan).fillna(0), 1e-9)
+    cases['trend_slope_20'] = (lambda: rolling_trend_slope(close, 20),
+                               lambda: close.rolling(20).apply(lambda x: np.polyfit(range(len(x)), x, 1)[0]), 1e-9)
+    for w in [50, 100, 200]:
+        cases[f'hurst_{w}'] = (lambda w=w: rolling_hurst(close, [w])[w],
+                               lambda w=w: close.rolling(w).apply(hurst_exponent, raw=True), 1e-8)
+    if STATSMODELS_AVAILABLE:
+        def adf(x):
+            # NaN con regresores colineales o ajuste exacto, como rolling_adf_statistic
+            # (adfuller devuelve ahí el estadístico de la pseudoinversa o de residuos nulos)
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                try:
+                    stat, _, _, store = adfuller(x, maxlag=1, autolag=None, regression='c', regresults=True)
+                except Exception:
+                    return np.nan
+            fit = store.resols
+            regressors = fit.model.exog[:, :-1] - fit.model.exog[:, :-1].mean(axis=0)
+            norms = np.linalg.norm(regressors, axis=0)
+            collinear = not (norms > 0).all() or not (
+                np.linalg.svd(regressors / norms, compute_uv=False).min() ** 2 > 1e-10)
+            return np.nan if collinear or not fit.ssr > 1e-10 * fit.centered_tss else stat
+
+        for w in [50, 200]:
+            cases[f'adf_stat_{w}'] = (lambda w=w: rolling_adf_statistic(close, w, 1),
+                                      lambda w=w: close.rolling(w).apply(adf, raw=True), 1e-6)
+
+    def timed(compute):
+        start = time.perf_counter()
+        values = compute()
+        return np.asarray(values, dtype=np.float64), time.perf_counter() - start
+
+    rows = []
+    for name, (compute, reference, tolerance) in cases.items():
+        expected, reference_s = timed(reference)
+        got, seconds = timed(compute)
+        mismatch = int((np.isnan(expected) != np.isnan(got)).sum())
+        both = np.isfinite(expected) & np.isfinite(got)
+        max_diff = 0.0
+        if both.any():
+            scale = max(float(np.abs(expected[both]).max()), 1e-12)
+            max_diff = float(np.abs(expected[both] - got[both]).max()) / scale
+        rows.append({'kernel': name, 'seconds': seconds, 'reference_seconds': reference_s,
+                     'speedup': reference_s / max(seconds, 1e-9), 'max_rel_diff': max_diff,
+                     'nan_mismatch': mismatch, 'ok': mismatch == 0 and max_diff <= tolerance})
+    report = pd.DataFrame(rows)
+    print(f"⏱️ Kernels de ventana: {report['seconds'].sum():.3f}s | pandas: "
+          f"{report['reference_seconds'].sum():.3f}s | paridad: {int(report['ok'].sum())}/{len(report)} | "
+          f"máx. diferencia relativa: {report['max_rel_diff'].max():.2e}")
+    return report
+
+
+if config.RUN_BENCHMARKS:
+    _rng = np.random.default_rng(0)
+    _close = (1.1 + np.cumsum(_rng.normal(0, 1e-3, 5_000))).astype(np.float32)
+    _close[1_000:1_300] = _close[1_000]   # tramo plano (mercado cerrado)
+    _close[3_000] = np.nan
+    verify_rolling_stats(pd.DataFrame({'close': _close}))
+
+
+WEEKLY_TIMEFRAME = '1W'
+
+
+def context_duration_ns(timeframe: str) -> int:
+    """Duración de una barra de contexto en nanosegundos ('1W' son 7 días)"""
+    return 7 * 86400 * 10**9 if timeframe == WEEKLY_TIMEFRAME else timeframe_to_ns(timeframe)
+
+
+def bar_duration_ns(index: pd.Index, timeframe: Optional[str] = None) -> int:
+    """Duración de las barras de index: la de timeframe o, si no se conoce, el menor salto"""
+    if timeframe:
+        return timeframe_to_ns(timeframe)
+    steps = np.diff(index.values.astype('datetime64[ns]').view('i8'))
+    steps = steps[steps > 0]
+    return int(steps.min()) if len(steps) else 0
+
+
+def weekly_bars(daily: pd.DataFrame) -> pd.DataFrame:
+    """Barras semanales de domingo a domingo desde barras diarias (etiqueta: inicio de la semana)"""
+    agg = {'open': 'first', 'high': 'max', 'low': 'min', 'close': 'last',
+           'tick_volume': 'sum', 'spread': 'mean', 'real_volume': 'sum'}
+    agg = {name: how for name, how in agg.items() if name in daily.columns}
+    return daily.resample('W-SUN', closed='left', label='left').agg(agg).dropna(subset=['close'])
+
+
+def asof_context(index: pd.Index, bar_ns: int, context: pd.DataFrame, context_ns: int,
+                 columns: List[str]) -> Dict[str, np.ndarray]:
+    """Valores de la última barra de context ya cerrada al cierre de cada barra de index
+
+    Las barras se etiquetan con su apertura: una barra de index cierra en t + bar_ns
+    y una de contexto en T + context_ns. Cada fila toma la última barra de contexto
+    con T + context_ns <= t + bar_ns (searchsorted sobre los cierres, que ya están
+    ordenados), así que nunca ve una barra que aún no ha cerrado, incluida la barra
+    abierta del final. NaN antes del primer cierre.
+    """
+    closes_at = index.values.astype('datetime64[ns]').view('i8') + bar_ns
+    context_closes = context.index.values.astype('datetime64[ns]').view('i8') + context_ns
+    position = np.searchsorted(context_closes, closes_at, side='right') - 1
+    missing = position < 0
+    position[missing] = 0
+    result = {}
+    for name in columns:
+        values = context[name].to_numpy(dtype=np.float64)
+        values = values[position] if len(values) else np.full(len(index), np.nan)
+        values[missing] = np.nan
+        result[name] = values
+    return result
+
+
+def verify_context_asof(m1: pd.DataFrame, timeframe: str = '15min', n_cuts: int = 4) -> pd.DataFrame:
+    """Comprueba que el contexto multi-timeframe no mira al futuro
+
+    Corta el M1 en n_cuts minutos al azar (a mitad de barra, de día y de semana),
+    calcula el contexto de config.CONTEXT_FEATURES como _feature_context sobre el
+    histórico truncado y lo compara con el del histórico completo en las barras de
+    timeframe ya cerradas en el corte: si algún valor depende de velas posteriores
+    al cierre de su barra, difieren.
+    """
+    levels = list(dict.fromkeys([timeframe, '4H', '1D']))
+    bar_ns = timeframe_to_ns(timeframe)
+
+    def context(pyramid):
+        bars = pyramid[timeframe]
+        values = {}
+        for tf, columns in config.CONTEXT_FEATURES.items():
+            source = weekly_bars(pyramid['1D']) if tf == WEEKLY_TIMEFRAME else pyramid[tf]
+            found = asof_context(bars.index, bar_ns, source, context_duration_ns(tf), columns)
+            values.update({(tf, name): column for name, column in found.items()})
+        return bars.index, values
+
+    full_index, full = context(TimeframePyramid(m1, levels))
+    times = m1['time'].values.astype('datetime64[ns]').view('i8')
+    rng = np.random.default_rng(0)
+    rows = []
+    for cut in np.sort(rng.integers(len(m1) // 2, len(m1), n_cuts)):
+        index, truncated = context(TimeframePyramid(m1.iloc[:cut], levels))
+        # Barras cerradas en el corte: la última vela M1 cierra un minuto después de su apertura
+        closed = index.values.astype('datetime64[ns]').view('i8') + bar_ns <= times[cut - 1] + 60 * 10**9
+        shared = full_index.get_indexer(index[closed])
+        for (tf, name), values in truncated.items():
+            a, b = values[closed], full[(tf, name)][shared]
+            rows.append({'cut': m1['time'].iloc[cut - 1], 'context': f'{tf.lower()}_{name}',
+                         'rows': int(closed.sum()),
+                         'mismatch': int((~((a == b) | (np.isnan(a) & np.isnan(b)))).sum())})
+    report = pd.DataFrame(rows)
+    print(f"🔍 Contexto sin look-ahead ({timeframe}, {n_cuts} cortes): "
+          f"{int((report['mismatch'] == 0).sum())}/{len(report)} columnas iguales al histórico completo")
+    return report
+
+
+if config.RUN_BENCHMARKS:
+    _rng = np.random.default_rng(0)
+    _time = np.datetime64('2015-01-04T22:00:00', 'ns') + np.arange(200_000) * np.timedelta64(60, 's')
+    _time = _time[pd.DatetimeIndex(_time).dayofweek != 5]   # sin sábados, como MT5
+    _close = (1.1 + np.cumsum(_rng.normal(0, 1e-4, len(_time)))).astype(np.float32)
+    verify_context_asof(pd.DataFrame({
+        'time': _time, 'open': _close, 'high': _close + np.float32(2e-4), 'low': _close - np.float32(2e-4),
+        'close': _close, 'tick_volume': _rng.integers(1, 500, len(_close)).astype(np.int32),
+        'spread': _rng.integers(0, 30, len(_close)).astype(np.int16),
+        'real_volume': np.zeros(len(_close), dtype=np.int32)}))
+
+
+# Backends de indicadores técnicos (config.INDICATOR_BACKEND): talib, ta o NumPy.
+# Las features de tendencia, momentum, volatilidad y volumen llaman a INDICATORS.<indicador>.
+def _shift(x: np.ndarray) -> np.ndarray:
+    """x desplazado una fila (series.shift(1)): NaN en la primera"""
+    out = np.empty(len(x), dtype=np.result_type(x, np.float32))
+    out[:1] = np.nan
+    out[1:] = x[:-1]
+    return out
+
+
+def _rolling_mean(x: np.ndarray, window: int) -> np.ndarray:
+    """rolling(window).mean() de una serie float64 (NaN en ventanas incompletas o con NaN)"""
+    out = np.full(len(x), np.nan)
+    if len(x) >= window:
+        out[window - 1:] = _sliding_sums(x, window) / window
+    return out
+
+
+def _ewm_mean(values, com: float, min_periods: int) -> np.ndarray:
+    """series.ewm(com=com, adjust=False, min_periods=min_periods).mean() con un filtro IIR
+
+    y[t] = (1 - alpha) * y[t-1] + alpha * x[t] es un filtro de primer orden: lfilter lo
+    evalúa en C en una pasada. Los NaN iniciales se saltan como en pandas; con NaN
+    intercalados (no aparecen en precios) se delega en pandas.
+    """
+    x = np.asarray(values, dtype=np.float64)
+    out = np.full(len(x), np.nan)
+    valid = ~np.isnan(x)
+    if not valid.any():
+        return out
+    first = int(valid.argmax())
+    if not valid[first:].all():
+        return pd.Series(x).ewm(com=com, adjust=False, min_periods=min_periods).mean().to_numpy()
+    alpha = 1.0 / (1.0 + com)
+    y = x[first:]
+    out[first:] = lfilter([alpha], [1.0, alpha - 1.0], y, zi=[(1.0 - alpha) * y[0]])[0]
+    out[first:first + max(min_periods, 1) - 1] = np.nan
+    return out
+
+
+def _wilder(seed: float, x: np.ndarray, gain: float, decay: float) -> np.ndarray:
+    """Continuación de s[t] = decay * s[t-1] + gain * x[t] a partir de s = seed"""
+    if len(x) == 0:
+        return np.empty(0)
+    return lfilter([gain], [1.0, -decay], np.asarray(x, dtype=np.float64), zi=[decay * seed])[0]
+
+
+# Kernels de los indicadores recursivos: compilados con numba si está instalado,
+# si no se ejecutan tal cual en Python (mismo código, mismo resultado)
+def _jit(func):
+    """numba.njit(cache=True) si numba está disponible; si no, la función en Python puro"""
+    if not NUMBA_AVAILABLE:
+        return func
+    return numba.njit(cache=True, nogil=True)(func)
+
+
+@_jit
+def _ewm_kernel(x, com, min_periods):
+    """ewm(com=com, adjust=False, min_periods=min_periods).mean(): el bucle de pandas, NaN incluidos"""
+    n = len(x)
+    out = np.empty(n)
+    if n == 0:
+        return out
+    alpha = 1.0 / (1.0 + com)
+    old_wt_factor = 1.0 - alpha
+    minp = max(min_periods, 1)
+    weighted = x[0]
+    nobs = 1 if weighted == weighted else 0
+    out[0] = weighted if nobs >= minp else np.nan
+    old_wt = 1.0
+    for i in range(1, n):
+        cur = x[i]
+        is_observation = cur == cur
+        if is_observation:
+            nobs += 1
+        if weighted == weighted:
+            old_wt *= old_wt_factor
+            if is_observation:
+                if weighted != cur:
+                    weighted = (old_wt * weighted + alpha * cur) / (old_wt + alpha)
+                old_wt = 1.0
+        elif is_observation:
+            weighted = cur
+        out[i] = weighted if nobs >= minp else np.nan
+    return out
+
+
+@_jit
+def _wilder_mean_kernel(seed, x, window):
+    """Continuación de s[t] = (s[t-1] * (window - 1) + x[t]) / window desde s = seed"""
+    out = np.empty(len(x))
+    s = seed
+    for i in range(len(x)):
+        s = (s * (window - 1) + x[i]) / float(window)
+        out[i] = s
+    return out
+
+
+@_jit
+def _adx_kernel(movement, pos, neg, seeds, window):
+    """ADX de ta en una pasada: sumas de Wilder, DX y media de Wilder del DX
+
+    seeds son las sumas de rango, +DM y -DM de las window primeras velas; las
+    sumas suavizadas de la posición i usan la vela window + i, y el ADX de la vela
+    i + window - 1 el DX de la posición i - 1 (mismo desfase que ta).
+    """
+    n = len(movement)
+    w = window
+    out = np.zeros(n)
+    if n < 2 * w:
+        return out
+    trs, dip, din = seeds[0], seeds[1], seeds[2]
+    dx_sum = 0.0
+    adx = 0.0
+    for i in range(n - w):
+        if i > 0:
+            trs = trs - (trs / float(w)) + movement[w + i]
+            dip = dip - (dip / float(w)) + pos[w + i]
+            din = din - (din / float(w)) + neg[w + i]
+        di_pos = 100 * (dip / trs) if trs != 0 else 0.0
+        di_neg = 100 * (din / trs) if trs != 0 else 0.0
+        total = di_pos + di_neg
+        dx = 100 * abs((di_pos - di_neg) / total) if total != 0 else 0.0
+        if i < w:
+            dx_sum += dx
+            if i == w - 1:
+                adx = dx_sum / w
+                out[2 * w - 1] = adx
+        else:
+            adx = ((adx * (w - 1)) + dx) / float(w)
+            out[i + w] = adx
+    return out
+
+
+@_jit
+def _money_flow_kernel(typical, volume, window):
+    """MFI de ta: flujo de dinero positivo y negativo de las últimas window velas"""
+    n = len(typical)
+    out = np.full(n, np.nan)
+    flow = np.zeros(n)
+    for i in range(1, n):
+        if typical[i] > typical[i - 1]:
+            flow[i] = typical[i] * volume[i]
+        elif typical[i] < typical[i - 1]:
+            flow[i] = -(typical[i] * volume[i])
+    for i in range(window - 1, n):
+        positive = 0.0
+        negative = 0.0
+        for j in range(i - window + 1, i + 1):
+            if flow[j] >= 0.0:
+                positive += flow[j]
+            else:
+                negative += flow[j]
+        negative = abs(negative)
+        if negative != 0:
+            out[i] = 100 - (100 / (1 + positive / negative))
+        elif positive != 0:
+            out[i] = 100.0
+    return out
+
+
+@_jit
+def _sar_kernel(highs, lows, acceleration, maximum):
+    """Parabolic SAR de Wilder con el arranque de TA-Lib (sentido inicial por -DM de la vela 1)"""
+    n = len(highs)
+    out = np.full(n, np.nan)
+    if n < 2:
+        return out
+    minus_dm = lows[0] - lows[1]
+    is_long = not (minus_dm > 0 and highs[1] - highs[0] < minus_dm)
+    af = acceleration
+    if is_long:
+        ep, sar = highs[1], lows[0]
+    else:
+        ep, sar = lows[1], highs[0]
+    new_high, new_low = highs[0], lows[0]
+    for i in range(1, n):
+        prev_high, prev_low = new_high, new_low
+        new_high, new_low = highs[i], lows[i]
+        if is_long:
+            if new_low <= sar:
+                # Giro a corto: el SAR salta al extremo anterior
+                is_long = False
+                sar = max(ep, prev_high, new_high)
+                out[i] = sar
+                af, ep = acceleration, new_low
+                sar = max(sar + af * (ep - sar), prev_high, new_high)
+            else:
+                out[i] = sar
+                if new_high > ep:
+                    ep, af = new_high, min(af + acceleration, maximum)
+                sar = min(sar + af * (ep - sar), prev_low, new_low)
+        else:
+            if new_high >= sar:
+                is_long = True
+                sar = min(ep, prev_low, new_low)
+                out[i] = sar
+                af, ep = acceleration, new_high
+                sar = min(sar + af * (ep - sar), prev_low, new_low)
+            else:
+                out[i] = sar
+                if new_low < ep:
+                    ep, af = new_low, min(af + acceleration, maximum)
+                sar = max(sar + af * (ep - sar), prev_high, new_high)
+    return out
+
+
+class TalibIndicators:
+    """Indicadores de TA-Lib (C); las entradas se pasan como float64, que es lo que admite"""
+
+    name = 'talib'
+
+    @staticmethod
+    def _f64(*columns):
+        return [np.asarray(c, dtype=np.float64) for c in columns]
+
+    def sma(self, close, window: int):
+        return talib.SMA(*self._f64(close), timeperiod=window)
+
+    def ema(self, close, window: int):
+        return talib.EMA(*self._f64(close), timeperiod=window)
+
+    def macd(self, close):
+        return talib.MACD(*self._f64(close), fastperiod=12, slowperiod=26, signalperiod=9)
+
+    def adx(self, high, low, close, window: int = 14):
+        return talib.ADX(*self._f64(high, low, close), timeperiod=window)
+
+    def sar(self, high, low):
+        return talib.SAR(*self._f64(high, low), acceleration=0.02, maximum=0.2)
+
+    def rsi(self, close, window: int = 14):
+        return talib.RSI(*self._f64(close), timeperiod=window)
+
+    def stoch(self, high, low, close):
+        return talib.STOCH(*self._f64(high, low, close), fastk_period=14, slowk_period=3, slowd_period=3)
+
+    def cci(self, high, low, close):
+        return talib.CCI(*self._f64(high, low, close), timeperiod=20)
+
+    def williams_r(self, high, low, close):
+        return talib.WILLR(*self._f64(high, low, close), timeperiod=14)
+
+    def bbands(self, close):
+        return talib.BBANDS(*self._f64(close), timeperiod=20, nbdevup=2, nbdevdn=2, matype=0)
+
+    def atr(self, high, low, close):
+        return talib.ATR(*self._f64(high, low, close), timeperiod=14)
+
+    def obv(self, close, volume):
+        return talib.OBV(*self._f64(close, volume))
+
+    def mfi(self, high, low, close, volume):
+        return talib.MFI(*self._f64(high, low, close, volume), timeperiod=14)
+
+
+class TaIndicators:
+    """Indicadores de la biblioteca ta (un objeto pandas por indicador; sin SAR)"""
+
+    name = 'ta'
+
+    def sma(self, close, window: int):
+        return ta.trend.sma_indicator(close, window=window)
+
+    def ema(self, close, window: int):
+        return ta.trend.ema_indicator(close, window=window)
+
+    def macd(self, close):
+        macd = ta.trend.MACD(close)
+        return macd.macd(), macd.macd_signal(), macd.macd_diff()
+
+    def adx(self, high, low, close, window: int = 14):
+        return ta.trend.adx(high, low, close, window=window)
+
+    def sar(self, high, low):
+        return None
+
+    def rsi(self, close, window: int = 14):
+        return ta.momentum.rsi(close, window=window)
+
+    def stoch(self, high, low, close):
+        stoch = ta.momentum.StochasticOscillator(high, low, close)
+        return stoch.stoch(), stoch.stoch_signal()
+
+    def cci(self, high, low, close):
+        return ta.trend.cci(high, low, close)
+
+    def williams_r(self, high, low, close):
+        return ta.momentum.williams_r(high, low, close)
+
+    def bbands(self, close):
+        bb = ta.volatility.BollingerBands(close)
+        return bb.bollinger_hband(), bb.bollinger_mavg(), bb.bollinger_lband()
+
+    def atr(self, high, low, close):
+        return ta.volatility.average_true_range(high, low, close)
+
+    def obv(self, close, volume):
+        return ta.volume.on_balance_volume(close, volume)
+
+    def mfi(self, high, low, close, volume):
+        return ta.volume.money_flow_index(high, low, close, volume)
+
+
+class NumpyIndicators:
+    """Indicadores vectorizados en NumPy con las convenciones de la biblioteca ta
+
+    Mismas fórmulas, arranques y valores de calentamiento que ta (ewm con
+    adjust=False, ceros del ATR y del ADX...), así que cambiar de backend no
+    cambia las features; pero sin objetos pandas por indicador ni bucles de
+    Python: las medias exponenciales y de Wilder son filtros IIR (lfilter), las
+    ventanas sumas deslizantes y los máximos/mínimos una tabla de potencias de
+    dos. Solo el SAR, sin forma cerrada, es un bucle (_sar_kernel, compilado si
+    hay numba).
+
+    Como en pandas, las operaciones elemento a elemento se hacen en el dtype de
+    las columnas (float32 en los frames MT5) y las ventanas en float64.
+    """
+
+    name = 'numpy'
+
+    def sma(self, close, window: int):
+        return _rolling_mean(np.asarray(close, dtype=np.float64), window)
+
+    # Recursiones (las sustituye NumbaIndicators)
+    def _ewm(self, values, com: float, min_periods: int) -> np.ndarray:
+        return _ewm_mean(values, com, min_periods)
+
+    def _wilder_mean(self, seed: float, x: np.ndarray, window: int) -> np.ndarray:
+        return _wilder(seed, x, 1.0 / window, (window - 1) / float(window))
+
+    def _adx(self, movement, pos, neg, seeds, window: int) -> np.ndarray:
+        n, w = len(movement), window
+        out = np.zeros(n)
+        # Sumas de Wilder: la primera con las w primeras velas; ta deja a 0 la última
+        length = n - (w - 1)
+        smoothed = []
+        for x, seed in zip((movement, pos, neg), seeds):
+            s = np.zeros(length)
+            s[0] = seed
+            s[1:length - 1] = _wilder(seed, x[w + 1:], 1.0, 1.0 - 1.0 / w)
+            smoothed.append(s)
+        trs, dip, din = smoothed
+        with np.errstate(divide='ignore', invalid='ignore'):
+            di_pos = np.where(trs != 0, 100 * (dip / trs), 0.0)
+            di_neg = np.where(trs != 0, 100 * (din / trs), 0.0)
+            total = di_pos + di_neg
+            dx = np.where(total != 0, 100 * np.abs((di_pos - di_neg) / total), 0.0)
+
+        adx = out[w - 1:]
+        adx[w] = dx[:w].mean()
+        adx[w + 1:] = self._wilder_mean(adx[w], dx[w:length - 1], w)
+        return out
+
+    def _money_flow(self, typical, volume, window: int) -> np.ndarray:
+        previous = _shift(typical)
+        direction = np.where(typical > previous, 1, np.where(typical < previous, -1, 0))
+        flow = typical * volume * direction
+        out = np.full(len(flow), np.nan)
+        if len(flow) >= window:
+            positive = _sliding_sums(np.where(flow >= 0.0, flow, 0.0), window)
+            negative = np.abs(_sliding_sums(np.where(flow < 0.0, flow, 0.0), window))
+            with np.errstate(divide='ignore', invalid='ignore'):
+                out[window - 1:] = 100 - (100 / (1 + positive / negative))
+        return out
+
+    def ema(self, close, window: int):
+        return self._ewm(close, (window - 1) / 2.0, window)
+
+    def macd(self, close, fast: int = 12, slow: int = 26, signal: int = 9):
+        macd = self.ema(close, fast) - self.ema(close, slow)
+        macd_signal = self._ewm(macd, (signal - 1) / 2.0, signal)
+        return macd, macd_signal, macd - macd_signal
+
+    def adx(self, high, low, close, window: int = 14):
+        high, low, close = np.asarray(high), np.asarray(low), np.asarray(close)
+        n, w = len(close), window
+        if n < 2 * w:
+            return np.zeros(n)
+        prev_close = _shift(close)
+        movement = np.maximum(high, prev_close) - np.minimum(low, prev_close)
+        diff_up = high - _shift(high)
+        diff_down = _shift(low) - low
+        pos = np.abs(((diff_up > diff_down) & (diff_up > 0)) * diff_up)
+        neg = np.abs(((diff_down > diff_up) & (diff_down > 0)) * diff_down)
+        # Semillas como ta: suma (pandas) de los w primeros valores no NaN
+        seeds = np.array([pd.Series(x[~np.isnan(x)][:w]).sum() for x in (movement, pos, neg)])
+        return self._adx(movement, pos, neg, seeds, w)
+
+    def sar(self, high, low, acceleration: float = 0.02, maximum: float = 0.2):
+        highs = np.asarray(high, dtype=np.float64)
+        lows = np.asarray(low, dtype=np.float64)
+        if not NUMBA_AVAILABLE:
+            # En Python puro el bucle va más rápido sobre listas que sobre arrays
+            highs, lows = highs.tolist(), lows.tolist()
+        return _sar_kernel(highs, lows, acceleration, maximum)
+
+    def rsi(self, close, window: int = 14):
+        diff = np.diff(np.asarray(close), prepend=np.nan)
+        alpha = 1.0 / window
+        com = (1 - alpha) / alpha  # misma conversión que pandas para ewm(alpha=...)
+        up = self._ewm(np.where(diff > 0, diff, 0.0), com, window)
+        down = self._ewm(-np.where(diff < 0, diff, 0.0), com, window)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(down == 0, 100.0, 100 - (100 / (1 + up / down)))
+
+    def _channel(self, high, low, window: int):
+        highest = RollingWindowStats(high, max_window=window).max(window)
+        lowest = RollingWindowStats(low, max_window=window).min(window)
+        return highest, lowest
+
+    def stoch(self, high, low, close, window: int = 14, smooth_window: int = 3):
+        highest, lowest = self._channel(high, low, window)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            k = 100 * (np.asarray(close) - lowest) / (highest - lowest)
+        return k, _rolling_mean(k, smooth_window)
+
+    def williams_r(self, high, low, close, window: int = 14):
+        highest, lowest = self._channel(high, low, window)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return -100 * (highest - np.asarray(close)) / (highest - lowest)
+
+    def cci(self, high, low, close, window: int = 20, constant: float = 0.015):
+        typical = (np.asarray(high) + np.asarray(low) + np.asarray(close)) / 3.0
+        x = typical.astype(np.float64)
+        out = np.full(len(x), np.nan)
+        if len(x) < window:
+            return out
+        mean = _sliding_sums(x, window) / window
+        windows = np.lib.stride_tricks.sliding_window_view(x, window)
+        mad = np.empty(len(windows))
+        step = 1 << 16  # bloques de filas: la matriz de desviaciones no crece con la serie
+        for start in range(0, len(windows), step):
+            block = windows[start:start + step]
+            mad[start:start + step] = np.abs(block - block.mean(axis=1, keepdims=True)).mean(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            out[window - 1:] = (typical[window - 1:] - mean) / (constant * mad)
+        return out
+
+    def bbands(self, close, window: int = 20, window_dev: float = 2):
+        x = np.asarray(close, dtype=np.float64)
+        mavg = _rolling_mean(x, window)
+        mstd = RollingWindowStats(x, max_window=window).std(window, ddof=0)
+        return mavg + window_dev * mstd, mavg, mavg - window_dev * mstd
+
+    def atr(self, high, low, close, window: int = 14):
+        high, low = np.asarray(high), np.asarray(low)
+        prev_close = _shift(np.asarray(close))
+        true_range = np.fmax(np.fmax(high - low, np.abs(high - prev_close)), np.abs(low - prev_close))
+        out = np.zeros(len(true_range))
+        if len(true_range) >= window:
+            out[window - 1] = pd.Series(true_range[:window]).mean()
+            out[window:] = self._wilder_mean(out[window - 1], true_range[window:], window)
+        return out
+
+    def obv(self, close, volume):
+        close, volume = np.asarray(close), np.asarray(volume)
+        down = np.zeros(len(close), dtype=bool)
+        down[1:] = close[1:] < close[:-1]
+        return np.cumsum(np.where(down, -volume, volume))
+
+    def mfi(self, high, low, close, volume, window: int = 14):
+        typical = (np.asarray(high) + np.asarray(low) + np.asarray(close)) / 3.0
+        return self._money_flow(typical, np.asarray(volume), window)
+
+
+class NumbaIndicators(NumpyIndicators):
+    """NumpyIndicators con las recursiones (EMA/RSI, Wilder del ATR y ADX, MFI, SAR) en kernels numba
+
+    Los kernels repiten el bucle de pandas/ta paso a paso, así que coinciden con
+    ta al bit o casi (las sumas de ventana del MFI se hacen en otro orden).
+    La primera llamada compila (cache=True guarda el resultado en disco).
+    """
+
+    name = 'numba'
+
+    def _ewm(self, values, com: float, min_periods: int) -> np.ndarray:
+        return _ewm_kernel(np.asarray(values, dtype=np.float64), com, min_periods)
+
+    def _wilder_mean(self, seed: float, x: np.ndarray, window: int) -> np.ndarray:
+        return _wilder_mean_kernel(seed, np.asarray(x, dtype=np.float64), window)
+
+    def _adx(self, movement, pos, neg, seeds, window: int) -> np.ndarray:
+        return _adx_kernel(movement, pos, neg, seeds, window)
+
+    def _money_flow(self, typical, volume, window: int) -> np.ndarray:
+        return _money_flow_kernel(typical, volume, window)
+
+    def warm_up(self, n_rows: int = 300):
+        """Compila (o carga de la caché de numba) los kernels antes de la primera llamada real
+
+        numba compila una versión por dtype de entrada: se llaman con las barras MT5
+        (float32, volúmenes int32) y con float64/int64.
+        """
+        rng = np.random.default_rng(0)
+        for price, volume in [(np.float32, np.int32), (np.float64, np.int64)]:
+            close = pd.Series((1.1 + np.cumsum(rng.normal(0, 1e-3, n_rows))).astype(price))
+            high, low = close + price(5e-4), close - price(5e-4)
+            ticks = pd.Series(rng.integers(1, 500, n_rows).astype(volume))
+            self.ema(close, 5)
+            self.macd(close)
+            self.rsi(close)
+            self.adx(high, low, close)
+            self.atr(high, low, close)
+            self.sar(high, low)
+            self.mfi(high, low, close, ticks)
+
+
+INDICATOR_BACKENDS = {'talib': TalibIndicators, 'ta': TaIndicators, 'numpy': NumpyIndicators,
+                      'numba': NumbaIndicators}
+
+
+def select_indicator_backend(name: Optional[str] = None):
+    """Backend de indicadores: config.INDICATOR_BACKEND o 'auto' (el más rápido disponible)
+
+    Orden automático: TA-Lib (C), numba y NumPy; ta, el más lento, solo si se pide.
+    """
+    name = name or config.INDICATOR_BACKEND
+    available = {'talib': TALIB_AVAILABLE, 'ta': TA_AVAILABLE, 'numpy': True, 'numba': NUMBA_AVAILABLE}
+    if name != 'auto' and not available.get(name, False):
+        print(f"⚠️ Backend de indicadores '{name}' no disponible, se elige automáticamente")
+        name = 'auto'
+    if name == 'auto':
+        name = 'talib' if TALIB_AVAILABLE else ('numba' if NUMBA_AVAILABLE else 'numpy')
+    backend = INDICATOR_BACKENDS[name]()
+    if name == 'numba':
+        # Compilar aquí: si no, la primera llamada de add_features (y last_timings) la incluye
+        start = time.perf_counter()
+        backend.warm_up()
+        print(f"⚙️ Kernels numba compilados/cargados en {time.perf_counter() - start:.2f}s")
+    return backend
+
+
+INDICATORS = select_indicator_backend()
+print(f"✅ Backend de indicadores: {INDICATORS.name}")
+
+
+def verify_indicator_backends(bars: pd.DataFrame) -> pd.DataFrame:
+    """Paridad y tiempos por indicador del backend NumPy frente a numba, ta y TA-Lib
+
+    Se comparan los backends instalados. Con numba y ta, todas las filas (mismas
+    convenciones). TA-Lib arranca distinto las medias recursivas, así que se compara
+    a partir de la fila 1000, cuando el arranque ya no pesa; su STOCH es el
+    estocástico lento y no se compara. La compilación de numba se hace antes de
+    medir (NumbaIndicators.warm_up).
+    """
+    cases = {
+        'sma_200': lambda b, d: b.sma(d['close'], 200), 'ema_200': lambda b, d: b.ema(d['close'], 200),
+        'macd': lambda b, d: b.macd(d['close']), 'adx': lambda b, d: b.adx(d['high'], d['low'], d['close']),
+        'sar': lambda b, d: b.sar(d['high'], d['low']), 'rsi': lambda b, d: b.rsi(d['close']),
+        'stoch': lambda b, d: b.stoch(d['high'], d['low'], d['close']),
+        'cci': lambda b, d: b.cci(d['high'], d['low'], d['close']),
+        'williams_r': lambda b, d: b.williams_r(d['high'], d['low'], d['close']),
+        'bbands': lambda b, d: b.bbands(d['close']),
+        'atr': lambda b, d: b.atr(d['high'], d['low'], d['close']),
+        'obv': lambda b, d: b.obv(d['close'], d['tick_volume']),
+        'mfi': lambda b, d: b.mfi(d['high'], d['low'], d['close'], d['tick_volume']),
+    }
+    others = [(NumbaIndicators(), 0, 1e-9)] if NUMBA_AVAILABLE else []
+    if TA_AVAILABLE:
+        others.append((TaIndicators(), 0, 1e-9))
+    if TALIB_AVAILABLE:
+        others.append((TalibIndicators(), 1000, 1e-6))
+    reference = NumpyIndicators()
+    if NUMBA_AVAILABLE:
+        others[0][0].warm_up()
+
+    def timed(backend, compute):
+        start = time.perf_counter()
+        values = compute(backend, bars)
+        return values, time.perf_counter() - start
+
+    rows = []
+    for name, compute in cases.items():
+        expected, numpy_s = timed(reference, compute)
+        expected = expected if isinstance(expected, tuple) else (expected,)
+        for backend, skip, tolerance in others:
+            if backend.name == 'talib' and name == 'stoch':
+                continue
+            got, seconds = timed(backend, compute)
+            if got is None:
+                continue
+            got = got if isinstance(got, tuple) else (got,)
+            max_diff, mismatch = 0.0, 0
+            for a, b in zip(expected, got):
+                a = np.asarray(a, dtype=np.float64)[skip:]
+                b = np.asarray(b, dtype=np.float64)[skip:]
+                mismatch += int((np.isnan(a) != np.isnan(b)).sum())
+                both = np.isfinite(a) & np.isfinite(b)
+                if both.any():
+                    scale = max(float(np.abs(b[both]).max()), 1e-12)
+                    max_diff = max(max_diff, float(np.abs(a[both] - b[both]).max()) / scale)
+            rows.append({'backend': backend.name, 'indicator': name, 'seconds': seconds,
+                         'numpy_seconds': numpy_s, 'speedup': seconds / max(numpy_s, 1e-9),
+                         'max_rel_diff': max_diff, 'nan_mismatch': mismatch,
+                         'ok': mismatch == 0 and max_diff <= tolerance})
+    report = pd.DataFrame(rows)
+    if report.empty:
+        print("⚠️ Ni ta ni TA-Lib están instalados: no hay backend con el que comparar")
+        return report
+    for backend, group in report.groupby('backend', sort=False):
+        print(f"⏱️ Indicadores {backend}: {group['seconds'].sum():.3f}s | NumPy: "
+              f"{group['numpy_seconds'].sum():.3f}s | paridad: {int(group['ok'].sum())}/{len(group)} | "
+              f"máx. diferencia relativa: {group['max_rel_diff'].max():.2e}")
+    return report
+
+
+if config.RUN_BENCHMARKS:
+    _rng = np.random.default_rng(0)
+    _close = (1.1 + np.cumsum(_rng.normal(0, 1e-3, 20_000))).astype(np.float32)
+    verify_indicator_backends(pd.DataFrame({
+        'open': _close, 'high': _close + np.float32(5e-4), 'low': _close - np.float32(5e-4),
+        'close': _close, 'tick_volume': _rng.integers(1, 500, len(_close)).astype(np.int32),
+    }))
+
+
+# 1. Precios y ratios básicos
+_register('price_position', ['close', 'high', 'low'])(
+    lambda df, ctx: (df['close'] - df['low']) / (df['high'] - df['low'] + 1e-10))
+_register('hl_ratio', ['close', 'high', 'low'])(
+    lambda df, ctx: (df['high'] - df['low']) / df['close'])
+_register('oc_ratio', ['close', 'open'])(
+    lambda df, ctx: (df['close'] - df['open']) / df['open'])
+_register('hl_pct', ['high', 'low'])(
+    lambda df, ctx: (df['high'] - df['low']) / df['low'])
+
+# 2. Retornos y volatilidad
+_register('returns', ['close'], warmup=1)(lambda df, ctx: df['close'].pct_change())
+_register('log_returns', ['close'], warmup=1)(lambda df, ctx: np.log(df['close'] / df['close'].shift(1)))
+for _w in [5, 10, 20, 50]:
+    _register(f'volatility_{_w}', ['returns'], warmup=_w - 1)(
+        lambda df, ctx, w=_w: _window_stats(df, 'returns').std(w))
+    _register(f'realized_vol_{_w}', ['log_returns'], warmup=_w - 1)(
+        lambda df, ctx, w=_w: _window_stats(df, 'log_returns').std(w))
+
+# 3. Indicadores de tendencia (backend INDICATORS: talib, ta o NumPy)
+for _p in [5, 10, 20, 50, 100, 200]:
+    _register(f'sma_{_p}', ['close'], warmup=_p - 1)(
+        lambda df, ctx, p=_p: INDICATORS.sma(df['close'], p))
+    _register(f'ema_{_p}', ['close'], warmup=_p - 1, recursive=True)(
+        lambda df, ctx, p=_p: INDICATORS.ema(df['close'], p))
+    _register(f'price_to_sma_{_p}', ['close', f'sma_{_p}'])(
+        lambda df, ctx, p=_p: df['close'] / df[f'sma_{p}'] if INDICATORS.name == 'talib'
+        else df['close'] / (df[f'sma_{p}'] + 1e-10))
+    _register(f'price_to_ema_{_p}', ['close', f'ema_{_p}'])(
+        lambda df, ctx, p=_p: df['close'] / df[f'ema_{p}'] if INDICATORS.name == 'talib'
+        else df['close'] / (df[f'ema_{p}'] + 1e-10))
+
+_register(['macd', 'macd_signal', 'macd_hist'], ['close'], warmup=33, recursive=True)(
+    lambda df, ctx: INDICATORS.macd(df['close']))
+_register('adx', ['high', 'low', 'close'], warmup=27, recursive=True)(
+    lambda df, ctx: INDICATORS.adx(df['high'], df['low'], df['close']))
+# El backend ta no implementa el SAR (devuelve None y la columna no se crea)
+_register('sar', ['high', 'low'], warmup=1, recursive=True)(
+    lambda df, ctx: INDICATORS.sar(df['high'], df['low']))
+
+_register('rsi', ['close'], warmup=14, recursive=True)(lambda df, ctx: INDICATORS.rsi(df['close']))
+_register('rsi_norm', ['rsi'])(lambda df, ctx: df['rsi'] / 100)
+_register(['stoch_k', 'stoch_d'], ['high', 'low', 'close'], warmup=17)(
+    lambda df, ctx: INDICATORS.stoch(df['high'], df['low'], df['close']))
+_register('stoch_norm', ['stoch_k'])(lambda df, ctx: df['stoch_k'] / 100)
+_register('cci', ['high', 'low', 'close'], warmup=19)(
+    lambda df, ctx: INDICATORS.cci(df['high'], df['low'], df['close']))
+_register('williams_r', ['high', 'low', 'close'], warmup=13)(
+    lambda df, ctx: INDICATORS.williams_r(df['high'], df['low'], df['close']))
+_register(['bb_upper', 'bb_middle', 'bb_lower'], ['close'], warmup=19)(
+    lambda df, ctx: INDICATORS.bbands(df['close']))
+_register('atr', ['high', 'low', 'close'], warmup=14, recursive=True)(
+    lambda df, ctx: INDICATORS.atr(df['high'], df['low'], df['close']))
+_register('obv', ['close', 'tick_volume'], recursive=True)(
+    lambda df, ctx: INDICATORS.obv(df['close'], df['tick_volume']))
+_register('mfi', ['high', 'low', 'close', 'tick_volume'], warmup=14)(
+    lambda df, ctx: INDICATORS.mfi(df['high'], df['low'], df['close'], df['tick_volume']))
+
+# Características comunes
+_register('bb_position', ['close', 'bb_upper', 'bb_lower'])(
+    lambda df, ctx: (df['close'] - df['bb_lower']) / (df['bb_upper'] - df['bb_lower'] + 1e-10))
+_register('bb_width', ['bb_upper', 'bb_lower', 'bb_middle'])(
+    lambda df, ctx: (df['bb_upper'] - df['bb_lower']) / (df['bb_middle'] + 1e-10))
+_register('atr_pct', ['atr', 'close'])(lambda df, ctx: df['atr'] / df['close'])
+
+# 6. Indicadores de volumen
+_register('volume_sma', ['tick_volume'], warmup=19)(lambda df, ctx: df['tick_volume'].rolling(20).mean())
+_register('volume_ratio', ['tick_volume', 'volume_sma'])(
+    lambda df, ctx: df['tick_volume'] / (df['volume_sma'] + 1e-10))
+_register('volume_delta', ['tick_volume'], warmup=1)(lambda df, ctx: df['tick_volume'].diff())
+_register('volume_acceleration', ['volume_delta'], warmup=1)(lambda df, ctx: df['volume_delta'].diff())
+
+# 7. Patrones de velas
+_register('body_size', ['close', 'open'])(lambda df, ctx: abs(df['close'] - df['open']))
+_register('upper_shadow', ['high', 'open', 'close'])(
+    lambda df, ctx: df['high'] - df[['open', 'close']].max(axis=1))
+_register('lower_shadow', ['low', 'open', 'close'])(
+    lambda df, ctx: df[['open', 'close']].min(axis=1) - df['low'])
+_register('body_ratio', ['body_size', 'high', 'low'])(
+    lambda df, ctx: df['body_size'] / (df['high'] - df['low'] + 1e-10))
+_register('is_bullish', ['close', 'open'])(lambda df, ctx: (df['close'] > df['open']).astype(int))
+_register('is_doji', ['body_size', 'atr'])(lambda df, ctx: (df['body_size'] < df['atr'] * 0.1).astype(int))
+_register('is_hammer', ['lower_shadow', 'upper_shadow', 'body_size'])(
+    lambda df, ctx: ((df['lower_shadow'] > df['body_size'] * 2) &
+                     (df['upper_shadow'] < df['body_size'] * 0.5)).astype(int))
+
+# 8. Características de ciclos y estacionalidad
+for _attr, _name in [('hour', 'hour'), ('dayofweek', 'day_of_week'), ('day', 'day_of_month'),
+                     ('month', 'month'), ('quarter', 'quarter')]:
+    _register(_name, [])(
+        lambda df, ctx, attr=_attr: getattr(df.index, attr) if hasattr(df.index, attr) else 0)
+
+# 9. Características estadísticas
+for _w in [20, 50, 100]:
+    _register(f'skewness_{_w}', ['close'], warmup=_w - 1)(
+        lambda df, ctx, w=_w: _window_stats(df, 'close').skew(w))
+    _register(f'kurtosis_{_w}', ['close'], warmup=_w - 1)(
+        lambda df, ctx, w=_w: _window_stats(df, 'close').kurt(w))
+
+
+# 10. Multi-timeframe: última barra cerrada de cada timeframe de config.CONTEXT_FEATURES
+# (ctx['processor'] aporta las barras compartidas)
+def _feature_context(df, ctx, timeframe: str, columns: Tuple[str, ...]):
+    try:
+        processor = ctx['processor']
+        # resample_timeframe (dentro de _context_bars) cambia current_timeframe
+        current = processor.current_timeframe
+        bar_ns = bar_duration_ns(df.index, current)
+        context = processor._context_bars(df, timeframe)
+        processor.current_timeframe = current
+        prefix = timeframe.lower()
+        if context is None:
+            values = {name: np.full(len(df), np.nan) for name in columns + ('close',)}
+        else:
+            values = asof_context(df.index, bar_ns, context, context_duration_ns(timeframe),
+                                  list(dict.fromkeys(columns + ('close',))))
+        result = {f'{prefix}_{name}': values[name] for name in columns}
+        result[f'{prefix}_price_ratio'] = df['close'] / (values['close'] + 1e-10)
+        return result
+    except Exception as e:
+        print(f"No se pudo añadir características multi-timeframe: {e}")
+        return None
+
+
+# recursive: la primera barra de contexto depende del arranque de los datos (queda parcial
+# si la ventana cargada empieza a mitad de semana), así que _append_features la recalcula entera
+for _tf, _columns in config.CONTEXT_FEATURES.items():
+    _register([f'{_tf.lower()}_{_c}' for _c in _columns] + [f'{_tf.lower()}_price_ratio'], ['close'],
+              recursive=True)(
+        lambda df, ctx, tf=_tf, columns=tuple(_columns): _feature_context(df, ctx, tf, columns))
+
+
+# 11. Lag features
+for _lag in [1, 2, 3, 5, 10]:
+    _register(f'close_lag_{_lag}', ['close'], warmup=_lag)(lambda df, ctx, lag=_lag: df['close'].shift(lag))
+    _register(f'volume_lag_{_lag}', ['tick_volume'], warmup=_lag)(
+        lambda df, ctx, lag=_lag: df['tick_volume'].shift(lag))
+    _register(f'return_lag_{_lag}', ['returns'], warmup=_lag)(lambda df, ctx, lag=_lag: df['returns'].shift(lag))
+
+# 12. Rolling statistics adicionales
+for _w in [10, 20, 50]:
+    _register(f'rolling_max_{_w}', ['close'], warmup=_w - 1)(lambda df, ctx, w=_w: _window_stats(df, 'close').max(w))
+    _register(f'rolling_min_{_w}', ['close'], warmup=_w - 1)(lambda df, ctx, w=_w: _window_stats(df, 'close').min(w))
+    _register(f'rolling_range_{_w}', [f'rolling_max_{_w}', f'rolling_min_{_w}'])(
+        lambda df, ctx, w=_w: df[f'rolling_max_{w}'] - df[f'rolling_min_{w}'])
+    _register(f'price_position_rolling_{_w}', ['close', f'rolling_min_{_w}', f'rolling_range_{_w}'])(
+        lambda df, ctx, w=_w: (df['close'] - df[f'rolling_min_{w}']) / (df[f'rolling_range_{w}'] + 1e-10))
+
+
+# --- Grupo 'advanced' (advanced_feature_engineering) ---
+
+# 2. Diferenciación si los retornos no son estacionarios (ctx['stationarity'])
+@_register(['returns_diff', 'returns_diff2'], ['returns'], warmup=2, group='advanced')
+def _feature_returns_diff(df, ctx):
+    if ctx.get('stationarity', {}).get('returns', {}).get('is_stationary') == False:
+        returns_diff = df['returns'].diff()
+        print("📈 Añadidas características diferenciadas para estacionaridad")
+        return {'returns_diff': returns_diff, 'returns_diff2': returns_diff.diff()}
+    return None
+
+
+# 3. Outliers con z-score robusto (MAD)
+@_register(['return_zscore_robust', 'is_outlier', 'return_percentile_20'], ['returns'],
+           warmup=49, group='advanced')
+def _feature_robust_outliers(df, ctx):
+    returns = df['returns'].fillna(0)
+    zscore = (returns - returns.median()) / (median_abs_deviation(returns) + 1e-8)
+    return {
+        'return_zscore_robust': zscore,
+        'is_outlier': (np.abs(zscore) > 3.5).astype(int),
+        'return_percentile_20': returns.rolling(50).rank(pct=True),
+    }
+
+
+# 4. Microestructura del mercado
+_register('vwap_5', ['close', 'tick_volume'], warmup=4, group='advanced')(
+    lambda df, ctx: (df['close'] * df['tick_volume']).rolling(5).sum() / df['tick_volume'].rolling(5).sum())
+_register('price_vs_vwap', ['close', 'vwap_5'], group='advanced')(
+    lambda df, ctx: df['close'] / (df['vwap_5'] + 1e-8) - 1)
+_register('volume_price_trend', ['close', 'tick_volume'], group='advanced')(
+    lambda df, ctx: df['tick_volume'] * np.sign(df['close'].diff().fillna(0)))
+_register('vpt_ma', ['volume_price_trend'], warmup=9, group='advanced')(
+    lambda df, ctx: df['volume_price_trend'].rolling(10).mean())
+
+# 5. Momentum adaptativo
+for _w in [5, 10, 20]:
+    _register(f'vol_adjusted_momentum_{_w}', ['close'], warmup=_w, group='advanced')(
+        lambda df, ctx, w=_w: df['close'].pct_change(w).fillna(0) /
+        (df['close'].pct_change().rolling(w).std() + 1e-8))
+    _register(f'adaptive_rsi_{_w}', ['close'], warmup=_w, group='advanced', recursive=True)(
+        lambda df, ctx, w=_w: INDICATORS.rsi(df['close'], window=w))
+
+
+# 6. Autocorrelación de retornos
+for _lag in [1, 5, 10]:
+    _register(f'autocorr_lag_{_lag}', ['returns'], warmup=49, group='advanced')(
+        lambda df, ctx, lag=_lag: rolling_autocorr(df['returns'].fillna(0), 50, lag) if len(df) > 100 else None)
+
+
+# 7. Persistencia y reversión a la media
+HURST_WINDOWS = [50, 100, 200]
+
+
+def _hurst_by_window(df) -> Dict[int, np.ndarray]:
+    """rolling_hurst de close para HURST_WINDOWS, compartido por las features de un mismo compute"""
+    cache = df.cache if isinstance(df, _FeatureFrame) else {}
+    if 'hurst' not in cache:
+        cache['hurst'] = rolling_hurst(df['close'], HURST_WINDOWS)
+    return cache['hurst']
+
+
+for _w in HURST_WINDOWS:
+    _register(f'hurst_{_w}', ['close'], warmup=_w - 1, group='advanced')(
+        lambda df, ctx, w=_w: _hurst_by_window(df)[w])
+
+
+# 8. Estacionariedad local: estadístico ADF de ventana (más negativo = más reversión a la media)
+ADF_WINDOWS = [50, 200]
+ADF_LAGS = 1
+
+for _w in ADF_WINDOWS:
+    _register(f'adf_stat_{_w}', ['close'], warmup=_w - 1, group='advanced')(
+        lambda df, ctx, w=_w: rolling_adf_statistic(df['close'], w, ADF_LAGS))
+
+
+for _ma in [20, 50]:
+    _register(f'mean_reversion_hl_{_ma}', ['close', f'sma_{_ma}'], warmup=49, group='advanced')(
+        lambda df, ctx, ma=_ma: mean_reversion_half_life(
+            rolling_autocorr(df['close'] / df[f'sma_{ma}'] - 1, 50, 1)))
+
+print(f'✅ FeatureRegistry cargado ({len(FEATURE_REGISTRY.feature_names)} features registradas)')
+
+# @title
+# [3H] ALMACÉN PERSISTENTE DE FEATURES (huella de datos + timeframe + versión + parámetros)
+class FeatureStore:
+    """Matrices de features en disco, comprimidas y columnares
+
+    Cada entrada se identifica por (etapa, timeframe, FEATURE_VERSION, parámetros)
+    y guarda la huella por filas (hash de cada fila) de los datos de entrada:
+      - si los datos coinciden, se leen las features en lugar de recalcularlas
+      - si los datos guardados son un prefijo de los nuevos (solo se añadió la
+        cola, salvo barras parciales en el borde), append(stored, data, n_stored)
+        calcula únicamente las filas nuevas
+      - si además se quitaron filas del principio (ventana de las últimas N filas,
+        load_data(nrows, from_end=True)), append(stored, data, n_stored, lead)
+        descarta las que salieron y calcula la cola (ver match_stored)
+      - en cualquier otro caso se recalcula todo y se sobrescribe la entrada
+    """
+
+    STORE_VERSION = 1
+    EDGE_ROWS = 3  # Filas de los extremos que pueden no coincidir (barras parciales)
+
+    def __init__(self, store_dir: Optional[str] = None):
+        self.store_dir = store_dir or config.FEATURE_STORE_DIR
+        os.makedirs(self.store_dir, exist_ok=True)
+
+    @staticmethod
+    def row_hashes(df: pd.DataFrame) -> np.ndarray:
+        return pd.util.hash_pandas_object(df, index=True).values
+
+    @staticmethod
+    def fingerprint(row_hashes: np.ndarray) -> str:
+        return hashlib.blake2b(np.ascontiguousarray(row_hashes).tobytes(), digest_size=16).hexdigest()
+
+    @classmethod
+    def match_stored(cls, stored_hashes: np.ndarray, hashes: np.ndarray) -> Optional[Tuple[int, Optional[int]]]:
+        """Posición de data donde empiezan las filas nuevas y filas iniciales sin guardar
+
+        Las filas guardadas se localizan por su hash (incluye el timestamp). En los
+        extremos se admiten hasta EDGE_ROWS filas distintas: la última barra guardada
+        de un timeframe superior pudo cerrarse a medias y, al deslizar la ventana, la
+        primera de data puede quedar parcial. Esas filas se tratan como nuevas.
+        - Solo se añadió la cola: (inicio de las filas nuevas, None).
+        - Ventana deslizante (se quitaron filas del principio, p.ej.
+          load_data(nrows, from_end=True)): (inicio de las filas nuevas, filas
+          iniciales de data sin pareja).
+        - None si las filas guardadas que siguen en data no forman un bloque idéntico.
+        """
+        n_stored = len(stored_hashes)
+        for lead in range(min(cls.EDGE_ROWS, len(hashes))):
+            found = np.flatnonzero(stored_hashes == hashes[lead])
+            if not len(found):
+                continue
+            start = int(found[0])
+            n = min(n_stored - start, len(hashes) - lead)
+            equal = stored_hashes[start:start + n] == hashes[lead:lead + n]
+            matched = n if equal.all() else int(np.argmin(equal))
+            if matched == 0 or n_stored - start - matched > cls.EDGE_ROWS:
+                return None
+            return lead + matched, (lead if start or lead else None)
+        return None
+
+    def entry_dir(self, stage: str, timeframe: str, params: dict) -> str:
+        payload = json.dumps({'stage': stage, 'timeframe': timeframe, 'params': params,
+                              'feature_version': FEATURE_VERSION, 'store_version': self.STORE_VERSION},
+                             sort_keys=True, default=str)
+        key = hashlib.blake2b(payload.encode(), digest_size=8).hexdigest()
+        return os.path.join(self.store_dir, f'{stage}_{timeframe}_{key}')
+
+    def _read_meta(self, entry: str) -> Optional[dict]:
+        try:
+            with open(os.path.join(entry, 'meta.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _load_frame(self, entry: str, meta: dict) -> pd.DataFrame:
+        if meta['format'] == 'feather':
+            frame = feather.read_feather(os.path.join(entry, 'features.feather'))
+        else:
+            with np.load(os.path.join(entry, 'features.npz')) as data:
+                frame = pd.DataFrame({name: data[f'c{i}'] for i, name in enumerate(meta['columns'])})
+        frame = frame.set_index(meta['index_column'])
+        frame.index.name = meta['index_name']
+        return frame
+
+    def _save(self, entry: str, frame: pd.DataFrame, input_hashes: np.ndarray):
+        """Escribe la entrada: cada archivo vía tmp + os.replace y meta.json el último
+
+        meta.json se retira antes de tocar los datos: si el proceso muere a mitad,
+        la entrada queda sin meta (se recalcula) en lugar de datos nuevos con meta viejo.
+        """
+        os.makedirs(entry, exist_ok=True)
+        meta_path = os.path.join(entry, 'meta.json')
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+        index_column = '__index__'
+        flat = frame.rename_axis(index_column).reset_index()
+        if PYARROW_AVAILABLE:
+            fmt = 'feather'
+            feather.write_feather(flat, os.path.join(entry, 'features.feather.tmp'), compression='zstd')
+            os.replace(os.path.join(entry, 'features.feather.tmp'), os.path.join(entry, 'features.feather'))
+        else:
+            fmt = 'npz'
+            with open(os.path.join(entry, 'features.npz.tmp'), 'wb') as f:
+                np.savez_compressed(f, **{f'c{i}': flat[c].values for i, c in enumerate(flat.columns)})
+            os.replace(os.path.join(entry, 'features.npz.tmp'), os.path.join(entry, 'features.npz'))
+        with open(os.path.join(entry, 'input_hashes.npy.tmp'), 'wb') as f:
+            np.save(f, input_hashes)
+        os.replace(os.path.join(entry, 'input_hashes.npy.tmp'), os.path.join(entry, 'input_hashes.npy'))
+        meta = {
+            'format': fmt,
+            'columns': list(flat.columns),
+            'index_column': index_column,
+            'index_name': frame.index.name,
+            'rows': len(frame),
+            'input_rows': len(input_hashes),
+            'input_fingerprint': self.fingerprint(input_hashes),
+        }
+        with open(meta_path + '.tmp', 'w') as f:
+            json.dump(meta, f, indent=2)
+        os.replace(meta_path + '.tmp', meta_path)
+
+    def get_or_compute(self, stage: str, timeframe: str, data: pd.DataFrame, params: dict,
+                       compute, append=None) -> pd.DataFrame:
+        """Features de data: leídas del almacén, ampliadas con la cola nueva o recalculadas"""
+        entry = self.entry_dir(stage, timeframe, params)
+        hashes = self.row_hashes(data)
+        meta = self._read_meta(entry)
+
+        if meta is not None:
+            try:
+                n_stored = meta['input_rows']
+                if n_stored == len(hashes) and meta['input_fingerprint'] == self.fingerprint(hashes):
+                    print(f"📦 Features {stage}/{timeframe} leídas del almacén ({meta['rows']:,} filas)")
+                    return self._load_frame(entry, meta)
+
+                if append is not None and n_stored > 0:
+                    stored_hashes = np.load(os.path.join(entry, 'input_hashes.npy'))
+                    match = self.match_stored(stored_hashes, hashes)
+                    if match is not None:
+                        start, lead = match
+                        stored = self._load_frame(entry, meta)
+                        frame = append(stored, data, start) if lead is None else append(stored, data, start, lead)
+                        if frame is not None:
+                            self._save(entry, frame, hashes)
+                            new_rows = len(hashes) - start
+                            dropped = '' if lead is None else \
+                                f", {int((stored.index < frame.index[0]).sum()):,} filas iniciales descartadas"
+                            print(f"📦 Features {stage}/{timeframe}: {new_rows:,} filas nuevas "
+                                  f"añadidas al almacén{dropped}")
+                            return frame
+            except Exception as e:
+                print(f"⚠️ Entrada del almacén de features ilegible ({e}), se recalcula")
+
+        frame = compute(data)
+        try:
+            self._save(entry, frame, hashes)
+        except Exception as e:
+            print(f"⚠️ No se pudieron guardar las features en el almacén: {e}")
+        return frame
+
+print('✅ FeatureStore cargado')
+
+# @title
+# [3I] INDICADORES ONLINE (estado O(1) por vela para señales en vivo)
+import math
+from collections import deque
+
+
+def _div(num: float, den: float) -> float:
+    """num / den con la semántica de numpy: x/0 -> ±inf y 0/0 -> nan"""
+    if den != 0:
+        return num / den
+    if num != num or num == 0:
+        return math.nan
+    return math.copysign(math.inf, num) * math.copysign(1.0, den)
+
+
+def _float_cast(dtype):
+    """Redondeo a la precisión de las columnas de precios (float32 en los frames MT5)
+
+    En batch, las operaciones elemento a elemento entre columnas float32 (high - low,
+    close - close.shift(1)...) dan float32; las ventanas y ewm de pandas trabajan en
+    float64. Redondear cada resultado intermedio reproduce exactamente el batch.
+    """
+    if np.dtype(dtype) == np.float64:
+        return float
+    scalar = np.dtype(dtype).type
+    return lambda x: float(scalar(x))
+
+
+def _pairwise_sum(values: List[float]) -> float:
+    """np.sum de una ventana corta en Python puro (mismo orden de sumas que numpy)
+
+    Convertir la ventana en array cuesta más que sumarla; numpy acumula en 8
+    parciales y los combina por pares, así que el resultado es idéntico al bit.
+    """
+    n = len(values)
+    if n < 8:
+        total = 0.0
+        for x in values:
+            total += x
+        return total
+    if n > 128:
+        return float(np.sum(values))
+    r = values[:8]
+    stop = n - n % 8
+    for i in range(8, stop, 8):
+        r = [a + b for a, b in zip(r, values[i:i + 8])]
+    total = ((r[0] + r[1]) + (r[2] + r[3])) + ((r[4] + r[5]) + (r[6] + r[7]))
+    for x in values[stop:]:
+        total += x
+    return total
+
+
+class _RollingMean:
+    """rolling(window).mean() de pandas vela a vela (misma suma de Kahan y mismo orden)"""
+
+    def __init__(self, window: int):
+        self.window = window
+        self.buffer = deque()
+        self.nobs = 0
+        self.sum = 0.0
+        self.comp_add = 0.0
+        self.comp_remove = 0.0
+        self.same = 0             # valores iguales consecutivos (pandas devuelve el valor exacto)
+        self.prev = math.nan
+
+    def update(self, x: float) -> float:
+        if len(self.buffer) == self.window:
+            old = self.buffer.popleft()
+            if old == old:
+                self.nobs -= 1
+                y = -old - self.comp_remove
+                t = self.sum + y
+                self.comp_remove = t - self.sum - y
+                self.sum = t
+        self.buffer.append(x)
+        if x == x:
+            self.nobs += 1
+            y = x - self.comp_add
+            t = self.sum + y
+            self.comp_add = t - self.sum - y
+            self.sum = t
+            self.same = self.same + 1 if x == self.prev else 1
+            self.prev = x
+        if self.nobs < self.window:
+            return math.nan
+        return self.prev if self.same >= self.nobs else self.sum / self.nobs
+
+
+class _RollingSum:
+    """Suma de las últimas window entradas vela a vela (Kahan al añadir y al quitar)
+
+    O(1) por vela en lugar de volver a sumar la ventana. Vale exactamente 0 cuando
+    todas las entradas de la ventana son 0, sin restos de redondeo de las que salieron.
+    """
+
+    def __init__(self, window: int):
+        self.window = window
+        self.buffer = deque()
+        self.nonzero = 0
+        self.sum = 0.0
+        self.comp_add = 0.0
+        self.comp_remove = 0.0
+
+    def update(self, x: float) -> float:
+        if len(self.buffer) == self.window:
+            old = self.buffer.popleft()
+            if old != 0.0:
+                self.nonzero -= 1
+                y = -old - self.comp_remove
+                t = self.sum + y
+                self.comp_remove = t - self.sum - y
+                self.sum = t
+        self.buffer.append(x)
+        if x != 0.0:
+            self.nonzero += 1
+            y = x - self.comp_add
+            t = self.sum + y
+            self.comp_add = t - self.sum - y
+            self.sum = t
+        if not self.nonzero:
+            self.sum = self.comp_add = self.comp_remove = 0.0
+        return self.sum
+
+
+class _RollingVar:
+    """rolling(window).var(ddof) de pandas vela a vela (Welford con compensación)"""
+
+    def __init__(self, window: int, ddof: int = 1):
+        self.window = window
+        self.ddof = ddof
+        self.buffer = deque()
+        self.nobs = 0
+        self.mean = 0.0
+        self.ssqdm = 0.0
+        self.comp_add = 0.0
+        self.comp_remove = 0.0
+        self.same = 0
+        self.prev = math.nan
+
+    def update(self, x: float) -> float:
+        if len(self.buffer) == self.window:
+            old = self.buffer.popleft()
+            if old == old:
+                self.nobs -= 1
+                if self.nobs:
+                    prev_mean = self.mean - self.comp_remove
+                    y = old - self.comp_remove
+                    t = y - self.mean
+                    self.comp_remove = t + self.mean - y
+                    self.mean = self.mean - t / self.nobs
+                    self.ssqdm = self.ssqdm - (old - prev_mean) * (old - self.mean)
+                else:
+                    self.mean = self.ssqdm = 0.0
+        self.buffer.append(x)
+        if x == x:
+            self.nobs += 1
+            self.same = self.same + 1 if x == self.prev else 1
+            self.prev = x
+            prev_mean = self.mean - self.comp_add
+            y = x - self.comp_add
+            t = y - self.mean
+            self.comp_add = t + self.mean - y
+            self.mean = self.mean + t / self.nobs
+            self.ssqdm = self.ssqdm + (x - prev_mean) * (x - self.mean)
+        if self.nobs < self.window or self.nobs <= self.ddof:
+            return math.nan
+        if self.nobs == 1 or self.same >= self.nobs:
+            return 0.0
+        return self.ssqdm / (self.nobs - self.ddof)
+
+
+class _RollingExtreme:
+    """Máximo/mínimo de ventana con una cola monótona (O(1) amortizado, como pandas)"""
+
+    def __init__(self, window: int, mode: str = 'max'):
+        self.window = window
+        self.is_max = mode == 'max'
+        self.candidates = deque()   # (posición, valor) con valores monótonos
+        self.count = 0
+
+    def update(self, x: float) -> float:
+        candidates = self.candidates
+        if self.is_max:
+            while candidates and candidates[-1][1] <= x:
+                candidates.pop()
+        else:
+            while candidates and candidates[-1][1] >= x:
+                candidates.pop()
+        candidates.append((self.count, x))
+        self.count += 1
+        if candidates[0][0] <= self.count - 1 - self.window:
+            candidates.popleft()
+        return candidates[0][1] if self.count >= self.window else math.nan
+
+
+class _EWMean:
+    """ewm(com, adjust=False).mean() de pandas vela a vela (ignore_na=False)"""
+
+    def __init__(self, com: float, min_periods: int = 0):
+        alpha = 1.0 / (1.0 + com)
+        self.old_factor = 1.0 - alpha
+        self.new_wt = alpha
+        self.min_periods = max(min_periods, 1)
+        self.weighted = math.nan
+        self.old_wt = 1.0
+        self.nobs = 0
+
+    def update(self, x: float) -> float:
+        is_obs = x == x
+        self.nobs += is_obs
+        if self.weighted == self.weighted:
+            self.old_wt *= self.old_factor
+            if is_obs:
+                if self.weighted != x:
+                    self.weighted = self.old_wt * self.weighted + self.new_wt * x
+                    self.weighted /= (self.old_wt + self.new_wt)
+                self.old_wt = 1.0
+        elif is_obs:
+            self.weighted = x
+        return self.weighted if self.nobs >= self.min_periods else math.nan
+
+
+class OnlineSMA:
+    """Media móvil simple: igual que sma_indicator / rolling(window).mean()"""
+
+    def __init__(self, window: int):
+        self.window = window
+        self._mean = _RollingMean(window)
+        self.value = math.nan
+
+    def update(self, close: float) -> float:
+        self.value = self._mean.update(close)
+        return self.value
+
+
+class OnlineEMA:
+    """Media exponencial: igual que ema_indicator / ewm(span=window, adjust=False)"""
+
+    def __init__(self, window: int):
+        self.window = window
+        self._ewm = _EWMean((window - 1) / 2.0, min_periods=window)
+        self.value = math.nan
+
+    def update(self, close: float) -> float:
+        self.value = self._ewm.update(close)
+        return self.value
+
+
+class OnlineMACD:
+    """MACD, señal e histograma (la señal es una EMA de la línea MACD)"""
+
+    def __init__(self, fast: int = 12, slow: int = 26, signal: int = 9):
+        self._fast = OnlineEMA(fast)
+        self._slow = OnlineEMA(slow)
+        self._signal = OnlineEMA(signal)
+        self.value = (math.nan, math.nan, math.nan)
+
+    def update(self, close: float) -> Tuple[float, float, float]:
+        macd = self._fast.update(close) - self._slow.update(close)
+        signal = self._signal.update(macd)
+        self.value = (macd, signal, macd - signal)
+        return self.value
+
+
+class OnlineRSI:
+    """RSI de Wilder (suavizado ewm con alpha=1/window, como ta.momentum.rsi)"""
+
+    def __init__(self, window: int = 14, dtype=np.float64):
+        self._up = _EWMean(window - 1.0, min_periods=window)
+        self._down = _EWMean(window - 1.0, min_periods=window)
+        self._cast = _float_cast(dtype)
+        self._prev_close = None
+        self.value = math.nan
+
+    def update(self, close: float) -> float:
+        diff = 0.0 if self._prev_close is None else self._cast(close - self._prev_close)
+        self._prev_close = close
+        up = self._up.update(diff if diff > 0 else 0.0)
+        down = self._down.update(-diff if diff < 0 else 0.0)
+        self.value = 100.0 if down == 0 else 100 - (100 / (1 + up / down))
+        return self.value
+
+
+class OnlineATR:
+    """ATR de Wilder; la primera media es la del true range de las window primeras velas"""
+
+    def __init__(self, window: int = 14, dtype=np.float64):
+        self.window = window
+        self.dtype = dtype
+        self._cast = _float_cast(dtype)
+        self._prev_close = None
+        self._seed = []   # true range de calentamiento (como mucho window valores)
+        self.value = math.nan
+
+    def true_range(self, high: float, low: float, close: float) -> float:
+        cast = self._cast
+        tr = cast(high - low)
+        if self._prev_close is not None:
+            tr = max(tr, abs(cast(high - self._prev_close)), abs(cast(low - self._prev_close)))
+        self._prev_close = close
+        return tr
+
+    def update(self, high: float, low: float, close: float) -> float:
+        tr = self.true_range(high, low, close)
+        if self._seed is not None:
+            self._seed.append(tr)
+            if len(self._seed) < self.window:
+                self.value = 0.0
+                return self.value
+            self.value = float(pd.Series(self._seed, dtype=self.dtype).mean())
+            self._seed = None
+            return self.value
+        self.value = (self.value * (self.window - 1) + tr) / float(self.window)
+        return self.value
+
+
+class OnlineBollinger:
+    """Bandas de Bollinger: media ± window_dev * desviación típica poblacional"""
+
+    def __init__(self, window: int = 20, window_dev: float = 2):
+        self.window_dev = window_dev
+        self._mean = _RollingMean(window)
+        self._var = _RollingVar(window, ddof=0)
+        self.value = (math.nan, math.nan, math.nan)
+
+    def update(self, close: float) -> Tuple[float, float, float]:
+        mavg = self._mean.update(close)
+        var = self._var.update(close)
+        mstd = math.sqrt(var) if var > 0 else (0.0 if var == var else math.nan)
+        self.value = (mavg + self.window_dev * mstd, mavg, mavg - self.window_dev * mstd)
+        return self.value
+
+
+class OnlineStochastic:
+    """Estocástico %K (máximo/mínimo de window velas) y %D (media de smooth_window)"""
+
+    def __init__(self, window: int = 14, smooth_window: int = 3):
+        self._high = _RollingExtreme(window, 'max')
+        self._low = _RollingExtreme(window, 'min')
+        self._signal = _RollingMean(smooth_window)
+        self.value = (math.nan, math.nan)
+
+    def update(self, high: float, low: float, close: float) -> Tuple[float, float]:
+        highest, lowest = self._high.update(high), self._low.update(low)
+        k = _div(100 * (close - lowest), highest - lowest)
+        self.value = (k, self._signal.update(k))
+        return self.value
+
+
+class OnlineWilliamsR:
+    """Williams %R sobre window velas"""
+
+    def __init__(self, window: int = 14):
+        self._high = _RollingExtreme(window, 'max')
+        self._low = _RollingExtreme(window, 'min')
+        self.value = math.nan
+
+    def update(self, high: float, low: float, close: float) -> float:
+        highest, lowest = self._high.update(high), self._low.update(low)
+        self.value = _div(-100 * (highest - close), highest - lowest)
+        return self.value
+
+
+class OnlineCCI:
+    """Commodity Channel Index: desviación del precio típico respecto a su media
+
+    La desviación media absoluta necesita la ventana entera: O(window) por vela,
+    con un buffer fijo de window valores.
+    """
+
+    def __init__(self, window: int = 20, constant: float = 0.015, dtype=np.float64):
+        self.window = window
+        self.constant = constant
+        self._mean = _RollingMean(window)
+        self._buffer = deque(maxlen=window)
+        self._cast = _float_cast(dtype)
+        self.value = math.nan
+
+    def update(self, high: float, low: float, close: float) -> float:
+        cast = self._cast
+        tp = cast(cast(cast(high + low) + close) / 3.0)
+        mean = self._mean.update(tp)
+        self._buffer.append(tp)
+        if len(self._buffer) < self.window:
+            self.value = math.nan
+            return self.value
+        window = list(self._buffer)
+        center = _pairwise_sum(window) / self.window
+        mad = _pairwise_sum([abs(x - center) for x in window]) / self.window
+        self.value = _div(tp - mean, self.constant * mad)
+        return self.value
+
+
+class OnlineOBV:
+    """On-Balance Volume: volumen acumulado con el signo de la variación del cierre"""
+
+    def __init__(self):
+        self._prev_close = None
+        self.value = 0.0
+
+    def update(self, close: float, volume: float) -> float:
+        down = self._prev_close is not None and close < self._prev_close
+        self._prev_close = close
+        self.value += -volume if down else volume
+        return self.value
+
+
+class OnlineMFI:
+    """Money Flow Index: flujo de dinero positivo/negativo de las últimas window velas
+
+    Las dos sumas de la ventana se mantienen al añadir y al quitar cada flujo
+    (_RollingSum): O(1) por vela. El batch suma la ventana entera, así que el
+    resultado puede diferir en el último bit.
+    """
+
+    def __init__(self, window: int = 14, dtype=np.float64):
+        self.window = window
+        self._positive = _RollingSum(window)   # flujos de las últimas window velas, por signo
+        self._negative = _RollingSum(window)
+        self._seen = 0
+        self._cast = _float_cast(dtype)
+        self._prev_tp = None
+        self.value = math.nan
+
+    def update(self, high: float, low: float, close: float, volume: float) -> float:
+        cast = self._cast
+        tp = cast(cast(cast(high + low) + close) / 3.0)
+        if self._prev_tp is None:
+            direction = 0
+        else:
+            direction = 1 if tp > self._prev_tp else (-1 if tp < self._prev_tp else 0)
+        self._prev_tp = tp
+        flow = tp * volume * direction
+        positive = self._positive.update(flow if flow >= 0.0 else 0.0)
+        negative = abs(self._negative.update(flow if flow < 0.0 else 0.0))
+        if self._seen < self.window:
+            self._seen += 1
+        if self._seen < self.window:
+            self.value = math.nan
+            return self.value
+        self.value = 100 - _div(100, 1 + _div(positive, negative))
+        return self.value
+
+
+class OnlineADX:
+    """ADX de Wilder con el mismo arranque que ta.trend.adx
+
+    Las primeras window velas suman el rango y los movimientos direccionales;
+    después se suavizan con Wilder. El ADX vale 0 hasta la vela 2*window-1,
+    donde arranca con la media de los primeros window DX.
+
+    ta deja a 0 el rango suavizado de la última fila del histórico, así que su
+    ADX en batch subestima siempre la última vela; aquí esa vela es correcta.
+    """
+
+    def __init__(self, window: int = 14, dtype=np.float64):
+        self.window = window
+        self.dtype = dtype
+        self._cast = _float_cast(dtype)
+        self._prev = None                 # (high, low, close) de la vela anterior
+        self._seed = ([], [], [])         # rango, +DM y -DM de calentamiento
+        self._dx_seed = []
+        self._trs = self._dip = self._din = 0.0
+        self.value = 0.0
+
+    def update(self, high: float, low: float, close: float) -> float:
+        cast, w = self._cast, self.window
+        prev, self._prev = self._prev, (high, low, close)
+        if prev is None:
+            return self.value
+        prev_high, prev_low, prev_close = prev
+        rng = cast(max(high, prev_close) - min(low, prev_close))
+        diff_up, diff_down = cast(high - prev_high), cast(prev_low - low)
+        pos = abs(diff_up) if (diff_up > diff_down and diff_up > 0) else 0.0
+        neg = abs(diff_down) if (diff_down > diff_up and diff_down > 0) else 0.0
+
+        if self._seed is not None:
+            for values, x in zip(self._seed, (rng, pos, neg)):
+                values.append(x)
+            if len(self._seed[0]) < w:
+                return self.value
+            self._trs, self._dip, self._din = (float(pd.Series(values, dtype=self.dtype).sum())
+                                               for values in self._seed)
+            self._seed = None
+        else:
+            self._trs = self._trs - (self._trs / float(w)) + rng
+            self._dip = self._dip - (self._dip / float(w)) + pos
+            self._din = self._din - (self._din / float(w)) + neg
+
+        di_pos = 100 * (self._dip / self._trs) if self._trs != 0 else 0.0
+        di_neg = 100 * (self._din / self._trs) if self._trs != 0 else 0.0
+        dx = 100 * abs((di_pos - di_neg) / (di_pos + di_neg)) if di_pos + di_neg != 0 else 0.0
+
+        if self._dx_seed is not None:
+            self._dx_seed.append(dx)
+            if len(self._dx_seed) == w:
+                self.value = float(np.array(self._dx_seed).mean())
+                self._dx_seed = None
+        else:
+            self.value = ((self.value * (w - 1)) + dx) / float(w)
+        return self.value
+
+
+class OnlineIndicatorEngine:
+    """Indicadores técnicos de add_features actualizados vela a vela
+
+    Cada indicador guarda solo su estado y buffers de tamaño fijo (la ventana más
+    larga es la SMA de 200), así que update() cuesta lo mismo en la vela 100 que
+    en la 10 millones: microsegundos por vela para generar señales en vivo.
+
+    Las fórmulas replican los backends ta y numpy (ewm/rolling de pandas, mismo
+    arranque), por lo que tras el calentamiento coinciden con las columnas de add_features.
+    Con talib las medias recursivas arrancan distinto y convergen al cabo de unas
+    pocas veces su ventana.
+    """
+
+    PERIODS = [5, 10, 20, 50, 100, 200]
+    FEATURES = ([f'sma_{p}' for p in PERIODS] + [f'ema_{p}' for p in PERIODS] +
+                ['macd', 'macd_signal', 'macd_hist', 'adx', 'rsi', 'stoch_k', 'stoch_d', 'cci',
+                 'williams_r', 'bb_upper', 'bb_middle', 'bb_lower', 'atr', 'obv', 'mfi'])
+
+    def __init__(self, dtype=np.float64):
+        self.dtype = dtype
+        self.sma = {p: OnlineSMA(p) for p in self.PERIODS}
+        self.ema = {p: OnlineEMA(p) for p in self.PERIODS}
+        self.macd = OnlineMACD()
+        self.adx = OnlineADX(dtype=dtype)
+        self.rsi = OnlineRSI(dtype=dtype)
+        self.stoch = OnlineStochastic()
+        self.cci = OnlineCCI(dtype=dtype)
+        self.williams_r = OnlineWilliamsR()
+        self.bollinger = OnlineBollinger()
+        self.atr = OnlineATR(dtype=dtype)
+        self.obv = OnlineOBV()
+        self.mfi = OnlineMFI(dtype=dtype)
+        self.bars_seen = 0
+
+    @classmethod
+    def from_history(cls, bars: pd.DataFrame) -> 'OnlineIndicatorEngine':
+        """Motor con el dtype de los precios de bars y el estado tras su última vela"""
+        engine = cls(dtype=bars['close'].dtype)
+        engine.warm_up(bars)
+        return engine
+
+    def update(self, high: float, low: float, close: float, volume: float) -> Dict[str, float]:
+        """Incorpora una vela cerrada y devuelve los indicadores en esa vela"""
+        self.bars_seen += 1
+        features = {}
+        for p in self.PERIODS:
+            features[f'sma_{p}'] = self.sma[p].update(close)
+        for p in self.PERIODS:
+            features[f'ema_{p}'] = self.ema[p].update(close)
+        features['macd'], features['macd_signal'], features['macd_hist'] = self.macd.update(close)
+        features['adx'] = self.adx.update(high, low, close)
+        features['rsi'] = self.rsi.update(close)
+        features['stoch_k'], features['stoch_d'] = self.stoch.update(high, low, close)
+        features['cci'] = self.cci.update(high, low, close)
+        features['williams_r'] = self.williams_r.update(high, low, close)
+        features['bb_upper'], features['bb_middle'], features['bb_lower'] = self.bollinger.update(close)
+        features['atr'] = self.atr.update(high, low, close)
+        features['obv'] = self.obv.update(close, volume)
+        features['mfi'] = self.mfi.update(high, low, close, volume)
+        return features
+
+    def warm_up(self, bars: pd.DataFrame, collect: bool = False):
+        """Pasa el histórico vela a vela; con collect=True devuelve un DataFrame con todas"""
+        rows = []
+        features = {}
+        for high, low, close, volume in zip(bars['high'].tolist(), bars['low'].tolist(),
+                                            bars['close'].tolist(), bars['tick_volume'].tolist()):
+            features = self.update(high, low, close, volume)
+            if collect:
+                rows.append(features)
+        if collect:
+            return pd.DataFrame(rows, index=bars.index, columns=self.FEATURES)
+        return features
+
+
+def verify_online_indicators(bars: pd.DataFrame) -> pd.DataFrame:
+    """Compara el motor online con las columnas batch del registro y mide el coste por vela
+
+    Se ignoran las filas de calentamiento de cada feature y, con el backend ta,
+    la última fila del ADX (ver OnlineADX).
+    """
+    batch = FEATURE_REGISTRY.compute(bars[['open', 'high', 'low', 'close', 'tick_volume']],
+                                     OnlineIndicatorEngine.FEATURES, group='base')
+    engine = OnlineIndicatorEngine(dtype=bars['close'].dtype)
+    start = time.perf_counter()
+    online = engine.warm_up(bars, collect=True)
+    per_bar_us = (time.perf_counter() - start) / max(len(bars), 1) * 1e6
+
+    rows = []
+    for name in OnlineIndicatorEngine.FEATURES:
+        if name not in batch.columns:
+            continue
+        stop = len(bars) - 1 if (name == 'adx' and INDICATORS.name == 'ta') else len(bars)
+        first = FEATURE_REGISTRY.warmup([name])
+        expected = batch[name].to_numpy(dtype=np.float64)[first:stop]
+        got = online[name].to_numpy(dtype=np.float64)[first:stop]
+        diff = np.abs(expected - got)
+        rows.append({'feature': name,
+                     'max_abs_diff': float(np.nanmax(diff)) if np.isfinite(diff).any() else 0.0,
+                     'nan_mismatch': int((np.isnan(expected) != np.isnan(got)).sum()),
+                     'identical': bool(np.array_equal(expected, got, equal_nan=True))})
+    report = pd.DataFrame(rows)
+    print(f"⏱️ Indicadores online: {per_bar_us:.1f} µs por vela ({len(OnlineIndicatorEngine.FEATURES)} columnas) | "
+          f"idénticos al batch: {int(report['identical'].sum())}/{len(report)} | "
+          f"máx. diferencia: {report['max_abs_diff'].max():.2e}")
+    return report
+
+
+if config.RUN_BENCHMARKS:
+    _rng = np.random.default_rng(0)
+    _close = (1.1 + np.cumsum(_rng.normal(0, 1e-3, 20_000))).astype(np.float32)
+    verify_online_indicators(pd.DataFrame({
+        'open': _close, 'high': _close + np.float32(5e-4), 'low': _close - np.float32(5e-4),
+        'close': _close, 'tick_volume': _rng.integers(1, 500, len(_close)).astype(np.int32),
+    }))
+
+print('✅ Indicadores online cargados')
+
+# @title
+# [3J] FEATURES POR TIMEFRAME EN PARALELO (barras en memoria compartida)
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+
+class SharedBars:
+    """Barras de varios timeframes copiadas a un único bloque de memoria compartida
+
+    Los workers reciben solo el descriptor (nombre del bloque y, por timeframe,
+    filas, dtype y offset de cada columna) y leen las columnas del bloque en lugar
+    de recibir los DataFrames serializados por la tubería del pool.
+    """
+
+    INDEX_COLUMN = '__index__'
+
+    def __init__(self, frames: Dict[str, pd.DataFrame]):
+        layout, arrays, offset = {}, [], 0
+        for tf, frame in frames.items():
+            columns = [(self.INDEX_COLUMN, frame.index.values)]
+            columns += [(name, frame[name].to_numpy()) for name in frame.columns]
+            entries = []
+            for name, values in columns:
+                if values.dtype.kind not in 'iufbM':
+                    raise TypeError(f"{tf}.{name}: dtype {values.dtype} no se puede compartir")
+                entries.append((name, values.dtype.str, offset))
+                arrays.append((values, offset))
+                offset += -(-values.nbytes // 8) * 8  # columnas alineadas a 8 bytes
+            layout[tf] = {'rows': len(frame), 'index_name': frame.index.name, 'columns': entries}
+        self._shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+        for values, start in arrays:
+            np.ndarray(values.shape, dtype=values.dtype, buffer=self._shm.buf, offset=start)[:] = values
+        self.descriptor = {'name': self._shm.name, 'layout': layout}
+
+    @classmethod
+    def read(cls, descriptor: dict, timeframes: Optional[List[str]] = None) -> Dict[str, pd.DataFrame]:
+        """DataFrames de los timeframes pedidos (None = todos) a partir del descriptor
+
+        Se puede llamar desde cualquier proceso. Solo se copian fuera del bloque los
+        niveles pedidos: un worker no paga la copia de los timeframes de los demás.
+        """
+        shm = shared_memory.SharedMemory(name=descriptor['name'])
+        try:
+            frames = {}
+            for tf, spec in descriptor['layout'].items():
+                if timeframes is not None and tf not in timeframes:
+                    continue
+                arrays = {name: np.ndarray(spec['rows'], dtype=dtype, buffer=shm.buf, offset=start).copy()
+                          for name, dtype, start in spec['columns']}
+                index = pd.Index(arrays.pop(cls.INDEX_COLUMN), name=spec['index_name'])
+                frames[tf] = pd.DataFrame(arrays, index=index)
+        finally:
+            shm.close()
+        return frames
+
+    def close(self):
+        self._shm.close()
+        self._shm.unlink()
+
+
+def feature_levels(timeframe: str) -> List[str]:
+    """Niveles de barras que usan las features de timeframe: el propio y los de contexto
+
+    Los de config.CONTEXT_FEATURES, con '1W' a través de las diarias (_context_bars).
+    """
+    levels = [timeframe] + ['1D' if tf == WEEKLY_TIMEFRAME else tf for tf in config.CONTEXT_FEATURES]
+    return list(dict.fromkeys(levels))
+
+
+def _timeframe_features_worker(filepath: str, timeframe: str, descriptor: dict,
+                               features: Optional[List[str]], store_dir: Optional[str]):
+    """stored_features de un timeframe en un proceso del pool; devuelve (features, salida impresa)"""
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        processor = AdvancedDataProcessor(filepath)
+        processor.feature_store = FeatureStore(store_dir) if store_dir else None
+        processor.timeframe_bars = SharedBars.read(descriptor, feature_levels(timeframe))
+        processor.current_timeframe = timeframe
+        data = processor.stored_features(processor.timeframe_bars[timeframe], features=features)
+    return data, log.getvalue()
+
+
+def parallel_timeframe_features(processor, timeframes: List[str],
+                                features: Optional[Dict[str, List[str]]] = None,
+                                workers: Optional[int] = None) -> Optional[Dict[str, pd.DataFrame]]:
+    """stored_features de cada timeframe en procesos separados
+
+    Las barras de los timeframes y de los niveles de contexto que usan
+    (feature_levels, p. ej. 4H) se comparten en un bloque SharedBars; cada worker
+    copia solo los suyos.
+    Cada timeframe se calcula igual que en serie y los resultados y la salida de
+    cada worker se recogen en el orden de timeframes, así que el resultado es
+    idéntico al de la ejecución en serie. Devuelve None si no se puede paralelizar
+    (sin fork, memoria compartida no disponible o un worker falla): el llamador
+    sigue en serie.
+    """
+    workers = min(workers or config.FEATURE_WORKERS, len(timeframes))
+    if workers <= 1 or 'fork' not in multiprocessing.get_all_start_methods():
+        return None
+    bars = processor.timeframe_bars
+    # Niveles de contexto que no están en la pirámide: el worker los resamplea, como en serie
+    levels = list(dict.fromkeys(level for tf in timeframes for level in feature_levels(tf)
+                                if level == tf or level in bars))
+    try:
+        shared = SharedBars({tf: bars[tf] for tf in levels})
+    except (TypeError, OSError) as e:
+        print(f"⚠️ Memoria compartida no disponible ({e}); features en serie")
+        return None
+
+    store_dir = processor.feature_store.store_dir if processor.feature_store is not None else None
+    results = {}
+    try:
+        # fork: los workers heredan el módulo ya cargado (el script no se vuelve a ejecutar)
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork')) as pool:
+            futures = {tf: pool.submit(_timeframe_features_worker, processor.filepath, tf, shared.descriptor,
+                                       (features or {}).get(tf), store_dir)
+                       for tf in timeframes}
+            for tf in timeframes:
+                data, log = futures[tf].result()
+                print(f"Procesando timeframe: {tf}")
+                print(log, end='')
+                results[tf] = data
+    except Exception as e:
+        print(f"⚠️ Falló el cálculo en paralelo ({e}); features en serie")
+        return None
+    finally:
+        shared.close()
+    return results
+
+print('✅ Ejecución paralela por timeframe cargada')
+
+# @title
+# [3K] SERVICIO DE ESTACIONARIEDAD (ADF/KPSS con caché por huella y muestra acotada)
+def stationarity_tests(values: np.ndarray) -> dict:
+    """ADF (retardos por AIC) y KPSS de values; sin statsmodels, la heurística de mitades
+
+    Función de módulo sin estado: se ejecuta igual en el proceso principal que en
+    un worker del pool. Los errores de los tests se devuelven en 'error'.
+    """
+    results = {}
+    if STATIONARITY_AVAILABLE:
+        try:
+            # Test de Augmented Dickey-Fuller
+            adf_result = adfuller(values, autolag='AIC')
+            results['adf_statistic'] = adf_result[0]
+            results['adf_pvalue'] = adf_result[1]
+            results['adf_is_stationary'] = adf_result[1] < 0.05
+
+            # Test KPSS (hipótesis nula es estacionaridad)
+            kpss_result = kpss(values, regression='c')
+            results['kpss_statistic'] = kpss_result[0]
+            results['kpss_pvalue'] = kpss_result[1]
+            results['kpss_is_stationary'] = kpss_result[1] > 0.05
+
+            # Consenso: ambos tests deben concordar
+            results['is_stationary'] = results['adf_is_stationary'] and results['kpss_is_stationary']
+        except Exception as e:
+            results = {'is_stationary': None, 'error': str(e)}
+    else:
+        # Test simplificado: dividir la serie en mitades y comparar medias y varianzas
+        mid = len(values) // 2
+        first_half, second_half = values[:mid], values[mid:]
+        t_stat, t_p = scipy_stats.ttest_ind(first_half, second_half)
+        # Si las mitades son significativamente diferentes, no es estacionaria
+        results['is_stationary'] = t_p > 0.05
+        results['t_test_pvalue'] = t_p
+        results['variance_ratio'] = np.var(first_half) / np.var(second_half)
+    return results
+
 
-    # ════════════════════════════════════════════════════════════════════════
-    # AGREGAR MODELOS SEGÚN TIMEFRAME
-    # ════════════════════════════════════════════════════════════════════════
+class StationarityService:
+    """Tests de estacionariedad con caché, muestra acotada y varias series a la vez
 
-    if timeframe in ['1min', '5min']:
-        # ────────────────────────────────────────────────────────────────────
-        # TIMEFRAMES CORTOS: Modelos base + ligeros
-        # Total: 5 regresión + 4 clasificación = 9 modelos
-        # ────────────────────────────────────────────────────────────────────
-        adjusted_models_reg = base_models_reg.copy()
-        adjusted_models_clf = base_models_clf.copy()
-        print(f"   📊 {timeframe}: Usando 9 modelos (5 reg + 4 clf)")
+    - Muestra: los tests cuestan O(n · retardos) (la búsqueda AIC del ADF ajusta
+      decenas de regresiones), así que se limitan a max_samples puntos: los más
+      recientes ('recent') o uno de cada k de todo el histórico ('decimate'; cambia
+      la frecuencia de la serie, los retardos del ADF pasan a ser de k velas).
+    - Caché: clave = huella del contenido muestreado + parámetros, no el nombre.
+      close de un timeframe en main() y en advanced_feature_engineering se prueba
+      una sola vez por ejecución.
+    - analyze_many lanza las series pendientes en un pool de procesos (fork); sin
+      fork, con un solo worker o una sola serie, se ejecutan en serie.
+    """
 
-    elif timeframe in ['15min', '30min', '1H']:
-        # ────────────────────────────────────────────────────────────────────
-        # TIMEFRAMES MEDIOS: Base + modelos adicionales + redes neuronales
-        # Total: 8 regresión + 7 clasificación = 15 modelos
-        # ────────────────────────────────────────────────────────────────────
-        adjusted_models_reg = base_models_reg.copy()
-        adjusted_models_reg.update({
-            'lasso_reg': Lasso(alpha=0.1, random_state=config.RANDOM_STATE, max_iter=2000),
-            'svr': SVR(kernel='rbf', C=1.0, gamma='scale'),
-            'gbr': GradientBoostingRegressor(
-                n_estimators=min(100, model_config['n_estimators']),
-                max_depth=min(5, model_config['max_depth']),
-                random_state=config.RANDOM_STATE
-            ),
-        })
+    MIN_SAMPLES = 50
+
+    def __init__(self, max_samples: Optional[int] = None, sample_mode: Optional[str] = None,
+                 workers: Optional[int] = None):
+        self.max_samples = max_samples if max_samples is not None else config.STATIONARITY_MAX_SAMPLES
+        self.sample_mode = sample_mode or config.STATIONARITY_SAMPLE_MODE
+        self.workers = workers or config.STATIONARITY_WORKERS
+        if self.sample_mode not in ('recent', 'decimate'):
+            raise ValueError(f"sample_mode desconocido: {self.sample_mode}")
+        self.cache: Dict[str, dict] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def sample(self, values: np.ndarray) -> np.ndarray:
+        """Como mucho max_samples puntos de values, acabando siempre en el último"""
+        n, limit = len(values), self.max_samples
+        if not limit or n <= limit:
+            return values
+        if self.sample_mode == 'recent':
+            return values[-limit:]
+        step = -(-n // limit)
+        return np.ascontiguousarray(values[::-1][::step][::-1])
+
+    def key(self, values: np.ndarray) -> str:
+        digest = hashlib.blake2b(np.ascontiguousarray(values).tobytes(), digest_size=16)
+        digest.update(f'{self.sample_mode}|{self.max_samples}|{STATIONARITY_AVAILABLE}'.encode())
+        return digest.hexdigest()
+
+    def _run(self, pending: Dict[str, np.ndarray]) -> Dict[str, dict]:
+        workers = min(self.workers, len(pending))
+        if workers > 1 and 'fork' in multiprocessing.get_all_start_methods():
+            try:
+                with ProcessPoolExecutor(max_workers=workers,
+                                         mp_context=multiprocessing.get_context('fork')) as pool:
+                    futures = {key: pool.submit(stationarity_tests, values) for key, values in pending.items()}
+                    return {key: future.result() for key, future in futures.items()}
+            except Exception as e:
+                print(f"⚠️ Falló el pool de estacionariedad ({e}); tests en serie")
+        return {key: stationarity_tests(values) for key, values in pending.items()}
+
+    def analyze_many(self, series: Dict[str, pd.Series]) -> Dict[str, dict]:
+        """Resultados de analyze_stationarity para cada serie {nombre: serie}, en ese orden"""
+        prepared = {}
+        for name, s in series.items():
+            values = np.asarray(pd.Series(s).dropna(), dtype=np.float64)
+            if len(values) < self.MIN_SAMPLES:
+                print(f"⚠️ Serie {name} muy corta para análisis de estacionaridad")
+                continue
+            sampled = self.sample(values)
+            prepared[name] = (self.key(sampled), sampled, len(values))
+
+        pending = {key: sampled for key, sampled, _ in prepared.values() if key not in self.cache}
+        self.hits += sum(key in self.cache for key, _, _ in prepared.values())
+        self.misses += len(pending)
+        if pending:
+            start = time.perf_counter()
+            computed = self._run(pending)
+            for key, result in computed.items():
+                if 'error' not in result:
+                    self.cache[key] = result
+            print(f"⏱️ Estacionariedad: {len(pending)} series en {time.perf_counter() - start:.2f}s "
+                  f"(máx. {self.max_samples or 'todas'} muestras, {self.sample_mode})")
+        else:
+            computed = {}
 
-        adjusted_models_clf = base_models_clf.copy()
-        adjusted_models_clf.update({
-            'svm_clf': SVC(
-                kernel='rbf',
-                C=1.0,
-                gamma='scale',
-                probability=True,
-                random_state=config.RANDOM_STATE
-            ),
-            'gbc': GradientBoostingClassifier(
-                n_estimators=min(100, model_config['n_estimators']),
-                max_depth=min(5, model_config['max_depth']),
-                random_state=config.RANDOM_STATE
-            ),
-            'mlp_clf': MLPClassifier(
-                hidden_layer_sizes=(128, 64),
-                max_iter=500,
-                random_state=config.RANDOM_STATE,
-                early_stopping=True
-            ),
-        })
-        print(f"   📊 {timeframe}: Usando 14 modelos (8 reg + 6 clf)")
+        output = {}
+        for name in series:
+            if name not in prepared:
+                output[name] = {'series_name': name}
+                continue
+            key, sampled, n_observations = prepared[name]
+            result = {'series_name': name, **(self.cache.get(key) or computed[key]),
+                      'n_observations': n_observations, 'n_tested': len(sampled)}
+            cached = '' if key in pending else ' (caché)'
+            if 'error' in result:
+                print(f"⚠️ Error en tests de estacionaridad para {name}: {result.pop('error')}")
+            elif STATIONARITY_AVAILABLE:
+                print(f"📊 {name} - ADF p-value: {result['adf_pvalue']:.4f}, "
+                      f"KPSS p-value: {result['kpss_pvalue']:.4f}{cached}")
+                print(f"   Estacionaria: {result['is_stationary']}")
+            else:
+                print(f"📊 {name} - Test simplificado p-value: {result['t_test_pvalue']:.4f}{cached}")
+                print(f"   Estacionaria (heurística): {result['is_stationary']}")
+            output[name] = result
+        return output
 
-    else:  # '4H', '1D', '3D', '7D'
-        # ────────────────────────────────────────────────────────────────────
-        # TIMEFRAMES LARGOS: Todos los modelos
-        # Total: 10 regresión + 9 clasificación = 19 modelos
-        # ────────────────────────────────────────────────────────────────────
-        adjusted_models_reg = base_models_reg.copy()
-        adjusted_models_reg.update({
-            'lasso_reg': Lasso(alpha=0.1, random_state=config.RANDOM_STATE, max_iter=2000),
-            'elasticnet_reg': ElasticNet(
-                alpha=0.1,
-                l1_ratio=0.5,
-                random_state=config.RANDOM_STATE,
-                max_iter=2000
-            ),
-            'svr': SVR(kernel='rbf', C=1.0, gamma='scale'),
-            'gbr': GradientBoostingRegressor(
-                n_estimators=min(150, model_config['n_estimators']),
-                max_depth=min(6, model_config['max_depth']),
-                random_state=config.RANDOM_STATE
-            ),
-            'ada_reg': AdaBoostRegressor(
-                n_estimators=50,
-                random_state=config.RANDOM_STATE
-            ),
-            'mlp_reg': MLPRegressor(
-                hidden_layer_sizes=(256, 128, 64),
-                max_iter=500,
-                random_state=config.RANDOM_STATE,
-                early_stopping=True,
-                validation_fraction=0.1
-            ),
-        })
+    def analyze(self, series: pd.Series, name: str = "Series") -> dict:
+        return self.analyze_many({name: series})[name]
 
-        adjusted_models_clf = base_models_clf.copy()
-        adjusted_models_clf.update({
-            'svm_clf': SVC(
-                kernel='rbf',
-                C=1.0,
-                gamma='scale',
-                probability=True,
-                random_state=config.RANDOM_STATE
-            ),
-            'gbc': GradientBoostingClassifier(
-                n_estimators=min(150, model_config['n_estimators']),
-                max_depth=min(6, model_config['max_depth']),
-                random_state=config.RANDOM_STATE
-            ),
-            'ada_clf': AdaBoostClassifier(
-                n_estimators=50,
-                random_state=config.RANDOM_STATE
-            ),
-            'mlp_clf': MLPClassifier(
-                hidden_layer_sizes=(256, 128, 64),
-                max_iter=500,
-                random_state=config.RANDOM_STATE,
-                early_stopping=True,
-                validation_fraction=0.1
-            ),
-        })
-        print(f"   📊 {timeframe}: Usando 19 modelos (10 reg + 9 clf)")
+print('✅ Servicio de estacionariedad cargado')
 
-    return adjusted_models_reg, adjusted_models_clf
+# @title
+# [3L] DETECTOR DE REGÍMENES (GMM sobre submuestra estratificada, modelo persistido, tracker online)
+from scipy.optimize import linear_sum_assignment
+from scipy.special import logsumexp
+
+REGIME_FEATURES = ['returns', 'volatility', 'trend', 'price_momentum', 'volume_momentum']
+
+
+def regime_features(df: pd.DataFrame, price_col: str = 'close', lookback: int = 20) -> pd.DataFrame:
+    """Entradas del GMM de regímenes: retorno, volatilidad, pendiente y momentum de precio y volumen"""
+    returns = df[price_col].pct_change().fillna(0)
+    volume = df.get('tick_volume', df.get('volume', pd.Series(1, index=df.index)))
+    return pd.DataFrame({
+        'returns': returns,
+        'volatility': returns.rolling(lookback).std(),
+        'trend': rolling_trend_slope(df[price_col], lookback),
+        'price_momentum': df[price_col].pct_change(lookback).fillna(0),
+        'volume_momentum': volume.pct_change(lookback).fillna(0)
+    }, index=df.index).fillna(0)
+
+
+class RegimeModel:
+    """GMM de covarianza completa para regímenes de mercado, con coste de ajuste acotado
+
+    - fit: ajusta sobre unas max_samples filas muestreadas por estratos (bloques de
+      tiempo x quintiles de volatilidad, asignación proporcional): todas las épocas y
+      niveles de volatilidad quedan representados y el coste no crece con la serie.
+    - Arranque en caliente: con el modelo de la ejecución anterior (load), EM parte
+      de sus pesos, medias y covarianzas llevados a la escala nueva.
+    - Etiquetas estables: en frío los regímenes se ordenan por volatilidad media
+      (0 = la más baja); en caliente cada componente hereda la etiqueta del componente
+      previo más cercano (asignación húngara entre medias).
+    - predict_proba: densidades calculadas aquí con la Cholesky de cada covarianza,
+      por bloques de batch_rows filas (memoria acotada, sin depender del GMM ajustado).
+    """
 
+    VERSION = 1
+    TIME_BLOCKS = 10
+    VOLATILITY_BINS = 5
+
+    def __init__(self, n_regimes: int = 3, lookback: int = 20, max_samples: Optional[int] = None,
+                 batch_rows: Optional[int] = None):
+        self.n_regimes = n_regimes
+        self.lookback = lookback
+        self.max_samples = max_samples or config.REGIME_MAX_SAMPLES
+        self.batch_rows = batch_rows or config.REGIME_BATCH_ROWS
+        self.center = self.scale = None                 # Estandarización (media, desviación)
+        self.weights = self.means = self.covariances = None
+        self.warm_started = False
+        self.n_iter = 0
+
+    @property
+    def fitted(self) -> bool:
+        return self.means is not None
+
+    @staticmethod
+    def model_path(filepath: str, timeframe: str, n_regimes: int, lookback: int) -> str:
+        """Modelo persistido por archivo de datos (instrumento) y timeframe"""
+        stem = os.path.splitext(os.path.basename(filepath))[0]
+        return os.path.join(config.REGIME_MODEL_DIR, stem, f'{timeframe}_{n_regimes}_{lookback}.npz')
+
+    def stratified_sample(self, features: np.ndarray) -> np.ndarray:
+        """Índices (ordenados) de ~max_samples filas con la misma proporción de cada estrato"""
+        n = len(features)
+        if n <= self.max_samples:
+            return np.arange(n)
+        volatility = features[:, REGIME_FEATURES.index('volatility')]
+        edges = np.quantile(volatility, np.linspace(0, 1, self.VOLATILITY_BINS + 1)[1:-1])
+        strata = (np.arange(n) * self.TIME_BLOCKS // n) * self.VOLATILITY_BINS + \
+            np.searchsorted(edges, volatility, side='right')
+        counts = np.bincount(strata)
+        quota = np.ceil(counts * self.max_samples / n).astype(np.int64)
+        # Orden aleatorio dentro de cada estrato y las primeras quota[estrato] filas
+        order = np.random.default_rng(config.RANDOM_STATE).permutation(n)
+        order = order[np.argsort(strata[order], kind='stable')]
+        first = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        rank = np.arange(n) - first[strata[order]]
+        return np.sort(order[rank < quota[strata[order]]])
+
+    def _scaled(self, features: np.ndarray) -> np.ndarray:
+        return (features - self.center) / self.scale
+
+    def fit(self, features, previous: Optional['RegimeModel'] = None) -> 'RegimeModel':
+        """Ajusta el GMM en float64 sobre la submuestra (arranque en caliente desde previous)"""
+        x = np.asarray(features, dtype=np.float64)
+        sample = x[self.stratified_sample(x)]
+        self.center = sample.mean(axis=0)
+        self.scale = sample.std(axis=0)
+        self.scale[self.scale == 0] = 1.0
+        scaled = self._scaled(sample)
+
+        init = {}
+        self.warm_started = previous is not None and previous.fitted
+        if self.warm_started:
+            # Parámetros previos -> escala original -> escala de esta submuestra
+            ratio = previous.scale / self.scale
+            means = (previous.means * previous.scale + previous.center - self.center) / self.scale
+            covariances = previous.covariances * np.outer(ratio, ratio)
+            init = {'weights_init': previous.weights, 'means_init': means,
+                    'precisions_init': np.linalg.inv(covariances)}
+        gmm = GaussianMixture(n_components=self.n_regimes, random_state=config.RANDOM_STATE,
+                              covariance_type='full', max_iter=100, **init)
+        gmm.fit(scaled)
+        self.n_iter = gmm.n_iter_
+
+        # Etiquetas: por volatilidad en frío, por cercanía al modelo previo en caliente
+        if self.warm_started:
+            raw = gmm.means_ * self.scale + self.center
+            previous_raw = previous.means * previous.scale + previous.center
+            cost = (((raw[:, None, :] - previous_raw[None, :, :]) / self.scale) ** 2).sum(axis=2)
+            components, labels = linear_sum_assignment(cost)
+            order = components[np.argsort(labels)]
+        else:
+            order = np.argsort(gmm.means_[:, REGIME_FEATURES.index('volatility')])
+        self.weights = gmm.weights_[order]
+        self.means = gmm.means_[order]
+        self.covariances = gmm.covariances_[order]
+        self._prepare()
+        return self
+
+    def _prepare(self):
+        """Cholesky inversa y normalización de cada componente (para predict_proba)"""
+        dim = self.means.shape[1]
+        cholesky = np.linalg.cholesky(self.covariances)
+        self._whiten = np.linalg.inv(cholesky)
+        self._log_norm = (np.log(self.weights) - 0.5 * dim * np.log(2 * np.pi)
+                          - np.log(np.einsum('kii->ki', cholesky)).sum(axis=1))
+
+    def log_joint(self, scaled: np.ndarray) -> np.ndarray:
+        """log(peso_k * N(x | media_k, cov_k)) de filas ya estandarizadas, (n, n_regimes)"""
+        log_prob = np.empty((len(scaled), self.n_regimes))
+        for k in range(self.n_regimes):
+            whitened = (scaled - self.means[k]) @ self._whiten[k].T
+            log_prob[:, k] = self._log_norm[k] - 0.5 * np.einsum('ij,ij->i', whitened, whitened)
+        return log_prob
+
+    def log_posterior(self, scaled: np.ndarray) -> np.ndarray:
+        """log p(régimen | x) de filas ya estandarizadas, (n, n_regimes)"""
+        log_prob = self.log_joint(scaled)
+        return log_prob - logsumexp(log_prob, axis=1, keepdims=True)
+
+    def predict_proba(self, features) -> np.ndarray:
+        """Probabilidad de cada régimen por fila, calculada por bloques de batch_rows filas"""
+        x = np.asarray(features, dtype=np.float64)
+        probs = np.empty((len(x), self.n_regimes))
+        for start in range(0, len(x), self.batch_rows):
+            block = slice(start, start + self.batch_rows)
+            probs[block] = np.exp(self.log_posterior(self._scaled(x[block])))
+        return probs
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + '.tmp.npz'
+        np.savez(tmp_path, version=self.VERSION, n_regimes=self.n_regimes, lookback=self.lookback,
+                 center=self.center, scale=self.scale, weights=self.weights,
+                 means=self.means, covariances=self.covariances)
+        os.replace(tmp_path, path)
 
+    @classmethod
+    def load(cls, path: str, n_regimes: int, lookback: int) -> Optional['RegimeModel']:
+        """Modelo persistido en path, o None si no existe o es de otra configuración"""
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                if (int(data['version']), int(data['n_regimes']), int(data['lookback'])) != \
+                        (cls.VERSION, n_regimes, lookback):
+                    return None
+                model = cls(n_regimes, lookback)
+                for name in ('center', 'scale', 'weights', 'means', 'covariances'):
+                    setattr(model, name, data[name])
+            model._prepare()
+            return model
+        except Exception as e:
+            print(f"⚠️ Modelo de regímenes ilegible ({e}); se ajusta desde cero")
+            return None
 
 
+class OnlineRegimeTracker:
+    """Posterior de régimen vela a vela con un RegimeModel fijo (coste O(1) por vela)
 
+    Mantiene las cinco entradas de regime_features con estado acotado (cierres y
+    volúmenes de las últimas lookback + 1 velas, la varianza móvil de los retornos y
+    las sumas Σx y Σt·x de la ventana de la pendiente) y evalúa el GMM en una sola fila: update() da market_regime, regime_probability y
+    regime_{k}_prob como detect_market_regimes, sin reconstruir el frame ni llamar a
+    predict_proba sobre todo el histórico.
 
-# Utilidades
-def clear_memory():
-    """Limpiar memoria"""
-    gc.collect()
-    if TF_AVAILABLE and hasattr(tf, 'keras'):
-        tf.keras.backend.clear_session()
+    stickiness (opcional) convierte el GMM en un HMM de emisiones gaussianas: el prior
+    de cada vela es la posterior anterior pasada por una matriz de transición con
+    stickiness en la diagonal (filtro forward), lo que evita saltos de una vela.
+    Sin stickiness la posterior coincide con la del batch.
+    """
 
-def get_memory_usage():
-    """Obtener uso de memoria"""
-    try:
-        process = psutil.Process(os.getpid())
-        return f"RAM: {process.memory_info().rss / 1024 / 1024:.0f} MB"
-    except:
-        return "RAM: N/A"
+    WARMUP_BARS = 500
+
+    def __init__(self, model: RegimeModel, stickiness: Optional[float] = None, dtype=np.float64):
+        if not model.fitted:
+            raise ValueError("OnlineRegimeTracker necesita un RegimeModel ajustado")
+        self.model = model
+        self.lookback = model.lookback
+        self.cast = _float_cast(dtype)
+        self.closes = deque(maxlen=self.lookback + 1)
+        self.volumes = deque(maxlen=self.lookback + 1)
+        self.volatility = _RollingVar(self.lookback)
+        self.kernel = np.arange(self.lookback) - (self.lookback - 1) / 2
+        self.kernel_norm = float((self.kernel * self.kernel).sum())
+        # Pendiente: Σx y Σt·x de los últimos lookback cierres, centrados en origin (la
+        # pendiente no cambia y las sumas no arrastran el nivel del precio). Se recalculan
+        # exactas cada lookback velas para que el redondeo no se acumule.
+        self.origin = None
+        self.window_sum = 0.0
+        self.window_moment = 0.0
+        self.slope_age = 0
+        k = model.n_regimes
+        if stickiness is not None:
+            off = (1.0 - stickiness) / (k - 1) if k > 1 else 0.0
+            self.transition = np.full((k, k), off) + np.eye(k) * (stickiness - off)
+        else:
+            self.transition = None
+        self.log_weights = np.log(model.weights)
+        self.posterior = model.weights.copy()
+        self.bars_seen = 0
 
-def timer_decorator(func):
-    """Decorador para medir tiempo de ejecución"""
-    def wrapper(*args, **kwargs):
-        start_time = time.time()
-        result = func(*args, **kwargs)
-        end_time = time.time()
-        print(f"{func.__name__} ejecutado en {end_time - start_time:.2f} segundos")
+    @classmethod
+    def from_history(cls, bars: pd.DataFrame, model: RegimeModel, **kwargs) -> 'OnlineRegimeTracker':
+        """Tracker con el estado tras la última vela de bars (recorre solo las WARMUP_BARS finales)"""
+        tracker = cls(model, dtype=bars['close'].dtype, **kwargs)
+        tracker.warm_up(bars.iloc[-max(cls.WARMUP_BARS, model.lookback + 1):])
+        return tracker
+
+    def inputs(self, close: float, volume: float) -> np.ndarray:
+        """Incorpora la vela y devuelve las entradas del GMM (orden de REGIME_FEATURES)"""
+        cast, closes, volumes = self.cast, self.closes, self.volumes
+        # pct_change(): close / close.shift(1) - 1 en el dtype de los precios
+        returns = cast(cast(_div(close, closes[-1])) - 1.0) if closes else math.nan
+        returns = returns if returns == returns else 0.0
+        closes.append(close)
+        volumes.append(volume)
+        full = len(closes) > self.lookback
+        variance = self.volatility.update(returns)
+        volatility = math.sqrt(max(variance, 0.0)) if variance == variance else math.nan
+
+        trend = math.nan
+        lookback = self.lookback
+        if len(closes) >= lookback:
+            if self.slope_age == 0:
+                self.origin = close
+                window = [x - close for x in list(closes)[-lookback:]]
+                self.window_sum = math.fsum(window)
+                self.window_moment = math.fsum(t * x for t, x in enumerate(window))
+            else:
+                # La ventana avanza una vela: sale closes[0] (t = 0), las demás bajan un t
+                old, new = closes[0] - self.origin, close - self.origin
+                self.window_moment += (lookback - 1) * new - (self.window_sum - old)
+                self.window_sum += new - old
+            self.slope_age = (self.slope_age + 1) % lookback
+            trend = (self.window_moment - (lookback - 1) / 2 * self.window_sum) / self.kernel_norm
+        price_momentum = cast(cast(_div(close, closes[0])) - 1.0) if full else math.nan
+        volume_momentum = _div(volume, volumes[0]) - 1.0 if full else math.nan
+        values = [returns, volatility, trend, price_momentum, volume_momentum]
+        return np.array([0.0 if v != v else v for v in values])
+
+    def update(self, close: float, volume: float) -> Dict[str, float]:
+        """Incorpora una vela cerrada y devuelve el régimen y sus probabilidades en esa vela"""
+        self.bars_seen += 1
+        model = self.model
+        # RegimeModel.log_joint para una sola fila, con todos los componentes en una operación
+        whitened = np.einsum('kij,kj->ki', model._whiten, model._scaled(self.inputs(close, volume)) - model.means)
+        log_joint = model._log_norm - 0.5 * np.einsum('ki,ki->k', whitened, whitened)
+        if self.transition is not None:
+            # Filtro forward: el peso de la mezcla se sustituye por el prior predicho
+            prior = self.posterior @ self.transition
+            log_joint = log_joint - self.log_weights + np.log(np.maximum(prior, 1e-300))
+        posterior = np.exp(log_joint - log_joint.max())
+        self.posterior = posterior / posterior.sum()
+        regime = int(np.argmax(self.posterior))
+        result = {'market_regime': regime, 'regime_probability': float(self.posterior[regime])}
+        for k, p in enumerate(self.posterior.tolist()):
+            result[f'regime_{k}_prob'] = p
         return result
-    return wrapper
 
+    def warm_up(self, bars: pd.DataFrame, collect: bool = False):
+        """Pasa las velas de bars; con collect=True devuelve un DataFrame con todas"""
+        volume = bars['tick_volume'] if 'tick_volume' in bars.columns else pd.Series(1, index=bars.index)
+        rows = []
+        result = {}
+        for close, vol in zip(bars['close'].tolist(), volume.tolist()):
+            result = self.update(close, vol)
+            if collect:
+                rows.append(result)
+        if collect:
+            return pd.DataFrame(rows, index=bars.index)
+        return result
 
-# ============================================================================
-print("class AdaptiveDataManager")
+
+def verify_online_regimes(bars: pd.DataFrame, n_regimes: int = 3) -> dict:
+    """Compara el tracker online (sin stickiness) con predict_proba del batch y mide el coste por vela"""
+    features = regime_features(bars)
+    model = RegimeModel(n_regimes).fit(features)
+    batch = model.predict_proba(features)
+    tracker = OnlineRegimeTracker(model, dtype=bars['close'].dtype)
+    start = time.perf_counter()
+    online = tracker.warm_up(bars, collect=True)
+    per_bar_us = (time.perf_counter() - start) / max(len(bars), 1) * 1e6
+    probs = online[[f'regime_{k}_prob' for k in range(n_regimes)]].to_numpy()
+    report = {'max_abs_diff': float(np.abs(probs - batch).max()),
+              'label_agreement': float((online['market_regime'].to_numpy() == batch.argmax(axis=1)).mean()),
+              'us_per_bar': per_bar_us}
+    print(f"⏱️ Regímenes online: {per_bar_us:.1f} µs por vela | máx. diferencia con el batch: "
+          f"{report['max_abs_diff']:.2e} | etiquetas iguales: {report['label_agreement']:.2%}")
+    return report
+
+
+if config.RUN_BENCHMARKS:
+    _rng = np.random.default_rng(0)
+    _close = (1.1 + np.cumsum(_rng.normal(0, 1e-3, 20_000))).astype(np.float32)
+    verify_online_regimes(pd.DataFrame({
+        'close': _close, 'tick_volume': _rng.integers(1, 500, len(_close)).astype(np.int32)}))
+
+print('✅ Detector y tracker online de regímenes cargados')
 
 # @title
 # [4] PROCESAMIENTO DE DATOS MEJORADO - VERSIÓN CORREGIDA
 class AdvancedDataProcessor:
+    # Columnas que add_features exige sin NaN (se calculan aunque no se pidan)
+    CRITICAL_FEATURES = ['close', 'returns', 'rsi', 'macd']
+
     def __init__(self, filepath: str):
         self.filepath = filepath
         self.scalers = {}
         self.feature_importance = {}
         self.current_timeframe = None  # ✅ NUEVO: trackear timeframe actual
+        self.column_store = None
+        self.timeframe_bars = None  # Barras por timeframe compartidas en la ejecución
+        self.resampler = None  # Estado incremental (barras abiertas) de stream_timeframes
+        self.feature_store = FeatureStore() if config.USE_FEATURE_STORE else None
+        self.stationarity = StationarityService()  # Tests ADF/KPSS cacheados por contenido
+        self.regime_model = None  # Último RegimeModel ajustado (detect_market_regimes)
 
     @timer_decorator
-    def load_data(self, filepath: str, nrows: Optional[int] = None) -> pd.DataFrame:
-        """Carga y optimiza datos"""
-        print(f"Cargando datos: {filepath}")
+    def load_data(self, filepath: str, nrows: Optional[int] = None,
+                  use_cache: bool = True, from_end: bool = False,
+                  start=None, end=None) -> pd.DataFrame:
+        """Carga y optimiza datos (usando la caché binaria si está disponible)
 
-        # Mapeo de nombres de columnas
-        column_mapping = {
-            '<DATE>': 'date',
-            '<TIME>': 'time',
-            '<OPEN>': 'open',
-            '<HIGH>': 'high',
-            '<LOW>': 'low',
-            '<CLOSE>': 'close',
-            '<TICKVOL>': 'tick_volume',
-            '<VOL>': 'real_volume',
-            '<SPREAD>': 'spread'
-        }
+        from_end=True hace que nrows tome las filas más recientes del histórico.
+        start/end limitan la carga a la ventana [start, end) sin leer el resto del archivo.
+        """
+        print(f"Cargando datos: {filepath}")
 
-        dtype = {
-            '<OPEN>': 'float32',
-            '<HIGH>': 'float32',
-            '<LOW>': 'float32',
-            '<CLOSE>': 'float32',
-            '<TICKVOL>': 'int32',
-            '<SPREAD>': 'int16',
-            '<VOL>': 'int32'
-        }
+        if start is not None or end is not None:
+            df = self._load_range(filepath, start, end, use_cache=use_cache)
+            if nrows is not None:
+                df = (df.iloc[-nrows:] if from_end else df.iloc[:nrows]).reset_index(drop=True)
+            print(f"Cargado: {len(df):,} filas [{start} → {end}) | {get_memory_usage()}")
+            return df
 
-        # Leer CSV con separador de tabulaciones
-        df = pd.read_csv(filepath, sep='\t', dtype=dtype, nrows=nrows)
+        if not (use_cache and config.USE_DATA_CACHE):
+            if from_end and nrows is not None:
+                df = read_mt5_tail(filepath, nrows)
+            else:
+                df = self._parse_mt5_csv(filepath, nrows=nrows)
+            print(f"Cargado: {len(df):,} filas | {get_memory_usage()}")
+            return df
+
+        cache = MT5BinaryCache()
+        df = cache.load(filepath, nrows=nrows, from_end=from_end)
+        if df is not None:
+            print(f"⚡ Cargado desde caché binaria: {len(df):,} filas | {get_memory_usage()}")
+            return df
+
+        # Primera carga: parsear el archivo completo para que nrows recorte la caché
+        df = self._parse_mt5_csv(filepath)
+        try:
+            cache.save(filepath, df)
+        except Exception as e:
+            print(f"⚠️ No se pudo guardar la caché binaria: {e}")
+        if nrows is not None:
+            df = (df.iloc[-nrows:] if from_end else df.iloc[:nrows]).reset_index(drop=True)
 
-        # Renombrar columnas
-        df.rename(columns=column_mapping, inplace=True)
+        print(f"Cargado: {len(df):,} filas | {get_memory_usage()}")
+        return df
 
-        # Crear columna datetime combinando date y time
-        df['time'] = pd.to_datetime(df['date'] + ' ' + df['time'], format='%Y.%m.%d %H:%M:%S')
-        df.drop(['date'], axis=1, inplace=True)
+    def _load_range(self, filepath: str, start, end, use_cache: bool = True) -> pd.DataFrame:
+        """Ventana [start, end): búsqueda binaria en la caché o índice temporal disperso"""
+        if use_cache and config.USE_DATA_CACHE:
+            df = MT5BinaryCache().load_range(filepath, start, end)
+            if df is not None:
+                return df
+        return MT5TimeIndex.open_or_build(filepath).read_range(start, end)
+
+    def open_column_store(self, filepath: Optional[str] = None) -> 'MT5ColumnStore':
+        """Abre (o construye) el almacén de columnas M1 mapeado en memoria"""
+        self.column_store = MT5ColumnStore.open_or_build(filepath or self.filepath)
+        return self.column_store
+
+    def _parse_mt5_csv(self, filepath: str, nrows: Optional[int] = None) -> pd.DataFrame:
+        """Parsea el CSV de MT5 (separado por tabulaciones) a un frame tipado"""
+        # Columnas numéricas con pandas; <DATE>/<TIME> con el parser de bytes
+        df = pd.read_csv(filepath, sep='\t', dtype=MT5_CSV_DTYPES, nrows=nrows,
+                         usecols=lambda c: c not in ('<DATE>', '<TIME>'))
+        df.rename(columns=MT5_COLUMN_MAPPING, inplace=True)
+
+        time_values = read_mt5_datetime(filepath, nrows=nrows)
+        if time_values is None or len(time_values) != len(df):
+            # Formato inesperado: ruta clásica con strings
+            dates = pd.read_csv(filepath, sep='\t', usecols=['<DATE>', '<TIME>'],
+                                dtype=str, nrows=nrows)
+            time_values = pd.to_datetime(dates['<DATE>'] + ' ' + dates['<TIME>'],
+                                         format='%Y.%m.%d %H:%M:%S').values
+        df.insert(0, 'time', time_values)
 
         df = df.sort_values('time').reset_index(drop=True)
-
-        print(f"Cargado: {len(df):,} filas | {get_memory_usage()}")
         return df
 
-    def resample_timeframe(self, df: pd.DataFrame, timeframe: str) -> pd.DataFrame:
-        """Resamplea a diferentes timeframes"""
+    def resample_timeframe(self, df: pd.DataFrame, timeframe: str,
+                           backend: Optional[str] = None) -> pd.DataFrame:
+        """Resamplea a diferentes timeframes
+
+        backend: 'numpy' (kernel reduceat, por defecto según config.RESAMPLE_BACKEND)
+        o 'pandas'. Ambos devuelven exactamente las mismas barras.
+        """
         self.current_timeframe = timeframe  # ✅ GUARDAR timeframe actual
+        if (backend or config.RESAMPLE_BACKEND) == 'numpy':
+            bars = resample_ohlc_numpy(df, timeframe)
+            if bars is not None:
+                return bars
         return df.set_index('time').resample(timeframe).agg({
             'open': 'first', 'high': 'max', 'low': 'min',
             'close': 'last', 'tick_volume': 'sum',
@@ -1197,172 +5695,255 @@ class AdvancedDataProcessor:
         }
         return target_map.get(timeframe, 5)
 
+    def stream_timeframes(self, filepath: Optional[str] = None, timeframes: Optional[List[str]] = None,
+                          start=None, end=None, tail_rows: Optional[int] = None) -> Dict[str, pd.DataFrame]:
+        """Construye las barras de cada timeframe leyendo el M1 en bloques (memoria acotada)
+
+        Con config.USE_COLUMN_STORE el M1 se lee del almacén de columnas mapeado
+        (open_column_store, construido en la primera ejecución) en lugar del CSV.
+        """
+        filepath = filepath or self.filepath
+        resampler = IncrementalResampler(timeframes or config.TIMEFRAMES)
+        chunks = None
+        if config.USE_COLUMN_STORE:
+            try:
+                chunks = self.open_column_store(filepath).iter_chunks(start=start, end=end, tail_rows=tail_rows)
+            except Exception as e:
+                print(f"⚠️ Almacén de columnas no disponible ({e}); se lee el CSV")
+        if chunks is None:
+            chunks = iter_mt5_chunks(filepath, start=start, end=end, tail_rows=tail_rows)
+        n_chunks = 0
+        for chunk in chunks:
+            resampler.update(chunk)
+            n_chunks += 1
+        print(f"🌊 Streaming: {resampler.rows_seen:,} filas M1 en {n_chunks} bloques | {get_memory_usage()}")
+        self.resampler = resampler
+        self.timeframe_bars = resampler.result()
+        return self.timeframe_bars
+
+    def append_m1(self, new_rows: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+        """Añade filas M1 nuevas a las barras de stream_timeframes sin reconstruirlas
+
+        Solo cambian las barras finales de cada timeframe (la que estaba abierta y
+        las nuevas). Devuelve las barras que se cierran con estas filas.
+        """
+        if self.resampler is None:
+            raise ValueError("append_m1 requiere barras construidas con stream_timeframes()")
+        closed = self.resampler.update(new_rows)
+        if not closed:
+            return closed
+
+        open_bars = self.resampler.open_bars()
+        for tf in self.resampler.timeframes:
+            fresh = pd.concat([closed[tf], open_bars.get(tf, closed[tf].iloc[:0])])
+            bars = self.timeframe_bars[tf]
+            if len(fresh):
+                bars = bars[bars.index < fresh.index[0]]
+            self.timeframe_bars[tf] = pd.concat([bars, fresh])
+        return closed
+
+    def _context_bars(self, df: pd.DataFrame, timeframe: str) -> Optional[pd.DataFrame]:
+        """Barras de un timeframe superior para df
+
+        Si df son las barras compartidas del timeframe actual (o un tramo de ellas,
+        como la cola de _append_features), se reutiliza el nivel ya construido en la
+        ejecución en lugar de volver a resamplear. '1W' se agrega desde las diarias.
+        None si el contexto es más fino que df y no está construido: no se puede
+        obtener agregando las propias barras de df.
+        """
+        if timeframe == WEEKLY_TIMEFRAME:
+            daily = self._context_bars(df, '1D')
+            return weekly_bars(daily) if daily is not None else None
+        bars, tf = self.timeframe_bars, self.current_timeframe
+        if bars is not None and tf in bars and timeframe in bars:
+            shared = bars[tf].index
+            start = shared.searchsorted(df.index[0]) if len(df) else 0
+            if shared[start:start + len(df)].equals(df.index):
+                return bars[timeframe]
+        if tf is not None and timeframe_to_ns(timeframe) < timeframe_to_ns(tf):
+            return None
+        return self.resample_timeframe(df.reset_index(), timeframe)
+
     @timer_decorator
-    def create_multiple_timeframes(self, df: pd.DataFrame) -> Dict[str, pd.DataFrame]:
-        """Crear datos para múltiples timeframes"""
+    def create_multiple_timeframes(self, df: Optional[pd.DataFrame] = None,
+                                   start=None, end=None,
+                                   features: Optional[Dict[str, List[str]]] = None) -> Dict[str, pd.DataFrame]:
+        """Crear datos para múltiples timeframes
+
+        Si df es None, las barras se construyen en streaming desde self.filepath
+        (opcionalmente limitado a [start, end)), sin cargar el M1 completo.
+        features: features a calcular por timeframe (None = todas).
+        Con config.FEATURE_WORKERS > 1 los timeframes se calculan en procesos
+        separados (parallel_timeframe_features), con el mismo resultado.
+        """
         timeframes_data = {}
+        if df is None:
+            self.timeframe_bars = self.stream_timeframes(start=start, end=end)
+        else:
+            self.timeframe_bars = TimeframePyramid(df, config.TIMEFRAMES)
+            self.resampler = None
+
+        parallel = parallel_timeframe_features(self, config.TIMEFRAMES, features)
+        if parallel is not None:
+            self.current_timeframe = config.TIMEFRAMES[-1]
+            return parallel
 
         for tf in config.TIMEFRAMES:
             print(f"Procesando timeframe: {tf}")
-            tf_data = self.resample_timeframe(df, tf)
-            tf_data = self.add_features(tf_data)  # ✅ Ahora tiene self.current_timeframe
+            self.current_timeframe = tf
+            tf_data = self.timeframe_bars[tf]
+            tf_data = self.stored_features(tf_data, features=(features or {}).get(tf))  # ✅ Ahora tiene self.current_timeframe
             timeframes_data[tf] = tf_data
 
         return timeframes_data
 
+    def stored_features(self, bars: pd.DataFrame, features: Optional[List[str]] = None) -> pd.DataFrame:
+        """add_features a través del FeatureStore: lectura, solo la cola nueva o recálculo"""
+        if self.feature_store is None:
+            return self.add_features(bars, features=features)
+        params = {'features': features, 'indicators': INDICATORS.name, 'dtype': config.FEATURE_DTYPE,
+                  'registry': FEATURE_REGISTRY.feature_names}
+        return self.feature_store.get_or_compute(
+            'add_features', self.current_timeframe, bars, params,
+            compute=lambda data: self.add_features(data, features=features),
+            append=lambda stored, data, n_stored, lead=None: self._append_features(stored, data, n_stored,
+                                                                                    features, lead))
+
+    def stored_advanced_features(self, df: pd.DataFrame, timeframe: str, n_regimes: int = 3,
+                                 features: Optional[List[str]] = None) -> pd.DataFrame:
+        """detect_market_regimes + advanced_feature_engineering a través del FeatureStore"""
+        def compute(data):
+            data = self.detect_market_regimes(data, price_col='close', n_regimes=n_regimes, timeframe=timeframe)
+            return self.advanced_feature_engineering(data, features=features)
+
+        if self.feature_store is None:
+            return compute(df)
+        params = {'features': features, 'n_regimes': n_regimes, 'random_state': config.RANDOM_STATE,
+                  'regime_samples': config.REGIME_MAX_SAMPLES, 'regime_warm_start': config.REGIME_WARM_START,
+                  'stationarity_samples': config.STATIONARITY_MAX_SAMPLES,
+                  'stationarity_sample_mode': config.STATIONARITY_SAMPLE_MODE,
+                  'indicators': INDICATORS.name, 'dtype': config.FEATURE_DTYPE, 'registry': FEATURE_REGISTRY.feature_names}
+        return self.feature_store.get_or_compute('advanced', timeframe, df, params, compute)
+
+    def _append_features(self, stored: pd.DataFrame, bars: pd.DataFrame, n_stored: int,
+                         features: Optional[List[str]] = None,
+                         lead: Optional[int] = None) -> Optional[pd.DataFrame]:
+        """Amplía las features guardadas con las barras nuevas (bars[n_stored:])
+
+        Las features recursivas se recalculan sobre todo el histórico (son vectoriales
+        y baratas); las de ventana finita solo sobre la cola con el contexto justo.
+        Las filas ya guardadas que se vuelven a calcular deben coincidir con las
+        guardadas; si no, devuelve None y se recalcula todo.
+
+        lead (ventana deslizante, ver FeatureStore.match_stored): bars empieza después
+        que las barras guardadas y sus lead primeras filas no estaban guardadas. Se
+        conservan las filas guardadas desde la primera que daría add_features(bars),
+        con las recursivas sustituidas por las de bars (su arranque cambió); las de
+        ventana no dependen del arranque una vez pasado el recorte inicial.
+        """
+        critical_cols = self.CRITICAL_FEATURES
+        requested = None if features is None else list(features) + critical_cols
+        full_specs, window_specs, history = FEATURE_REGISTRY.split_for_append(requested, group='base')
+        timeframe = self.current_timeframe
+        ctx = {'processor': self}
+
+        full = FEATURE_REGISTRY.compute(bars, specs=full_specs, ctx=ctx)
+        context = max(2 * history, 500)
+        if lead is not None:
+            stored = self._slide_stored(stored, bars, full, window_specs, history, lead, requested)
+            if stored is None:
+                self.current_timeframe = timeframe
+                return None
+        tail = full.iloc[max(0, n_stored - context):]
+        tail = FEATURE_REGISTRY.compute(tail, specs=window_specs, ctx=ctx)
+        self.current_timeframe = timeframe
+
+        # Misma limpieza que add_features (sin el recorte inicial, que ya está en stored)
+        tail = fill_numeric_gaps(tail.dropna(subset=critical_cols))
+        if list(tail.columns) != list(stored.columns):
+            if set(tail.columns) != set(stored.columns):
+                return None
+            tail = tail[stored.columns]
+
+        # Filas guardadas desde la primera nueva (barra parcial del borde): se sustituyen
+        if n_stored < len(bars):
+            stored = stored[stored.index < bars.index[n_stored]]
+        overlap = stored.index.intersection(tail.index[history:])
+        if len(overlap) == 0:
+            return None
+        numeric_columns = stored.select_dtypes(include=[np.number]).columns
+        expected = stored.loc[overlap, numeric_columns].values.astype(np.float64)
+        # Tolerancia también relativa a la escala de cada columna: los momentos de
+        # RollingWindowStats (curtosis cerca de 0) dependen del desfase de sus bloques
+        # respecto al inicio del frame, que cambia al calcular solo la cola
+        finite = np.where(np.isfinite(expected), np.abs(expected), 0.0)
+        scale = finite.max(axis=0) if len(finite) else 0.0
+        if not np.allclose(tail.loc[overlap, numeric_columns].values.astype(np.float64), expected,
+                           rtol=1e-6, atol=1e-9 + 1e-6 * scale, equal_nan=True):
+            print("⚠️ Las features recalculadas no coinciden con las guardadas; recálculo completo")
+            return None
+
+        if n_stored >= len(bars):
+            return stored
+        new_rows = tail[tail.index >= bars.index[n_stored]].astype(stored.dtypes.to_dict())
+        return pd.concat([stored, new_rows])
+
+    def _slide_stored(self, stored: pd.DataFrame, bars: pd.DataFrame, full: pd.DataFrame,
+                      window_specs: List[FeatureSpec], history: int, lead: int,
+                      requested: Optional[List[str]]) -> Optional[pd.DataFrame]:
+        """Filas guardadas que siguen en una ventana deslizante, como las daría add_features(bars)"""
+        # Primera fila de add_features(bars): dropna de las críticas y recorte de calentamiento
+        head = FEATURE_REGISTRY.compute(full.iloc[:max(2 * history, 500)], specs=window_specs,
+                                        ctx={'processor': self})
+        valid = np.ones(len(bars), dtype=bool)
+        for col in self.CRITICAL_FEATURES:
+            if col in full.columns:
+                valid &= full[col].notna().to_numpy()
+            elif col in head.columns:
+                valid[:len(head)] &= head[col].notna().to_numpy()
+        positions = np.flatnonzero(valid)
+        skip = max(200, FEATURE_REGISTRY.warmup(requested))
+        # Las ventanas de las filas conservadas no pueden alcanzar las lead filas sin pareja
+        if len(positions) <= skip or positions[skip] < lead + history:
+            return None
+        first = bars.index[positions[skip]]
+        stored = stored[stored.index >= first].copy()
+        if stored.empty:
+            return None
+        recursive = [c for c in full.columns if c in stored.columns and c not in bars.columns]
+        refreshed = fill_numeric_gaps(full.loc[full.index >= first, recursive])
+        stored[recursive] = refreshed.loc[stored.index].astype(stored.dtypes[recursive].to_dict())
+        return stored
+
     @timer_decorator
-    def add_features(self, df: pd.DataFrame) -> pd.DataFrame:
-        """Añade características técnicas avanzadas - VERSIÓN CORREGIDA"""
-        df = df.copy()
+    def add_features(self, df: pd.DataFrame, features: Optional[List[str]] = None) -> pd.DataFrame:
+        """Añade características técnicas avanzadas - VERSIÓN CORREGIDA
 
+        features: si se indica (p.ej. la selección de un entrenamiento anterior),
+        solo se calculan esas features y sus dependencias del FEATURE_REGISTRY.
+        """
         # ✅ CORRECCIÓN: Usar el timeframe guardado
         tf = self.current_timeframe if self.current_timeframe else "unknown"
 
-        # 1. Precios y ratios básicos
-        df['price_position'] = (df['close'] - df['low']) / (df['high'] - df['low'] + 1e-10)
-        df['hl_ratio'] = (df['high'] - df['low']) / df['close']
-        df['oc_ratio'] = (df['close'] - df['open']) / df['open']
-        df['hl_pct'] = (df['high'] - df['low']) / df['low']
-
-        # 2. Retornos y volatilidad
-        df['returns'] = df['close'].pct_change()
-        df['log_returns'] = np.log(df['close'] / df['close'].shift(1))
-
-        for window in [5, 10, 20, 50]:
-            df[f'volatility_{window}'] = df['returns'].rolling(window).std()
-            df[f'realized_vol_{window}'] = df['log_returns'].rolling(window).std()
-
-        # 3. Indicadores de tendencia
-        if TALIB_AVAILABLE:
-            for period in [5, 10, 20, 50, 100, 200]:
-                df[f'sma_{period}'] = talib.SMA(df['close'], timeperiod=period)
-                df[f'ema_{period}'] = talib.EMA(df['close'], timeperiod=period)
-                df[f'price_to_sma_{period}'] = df['close'] / df[f'sma_{period}']
-                df[f'price_to_ema_{period}'] = df['close'] / df[f'ema_{period}']
-
-            df['macd'], df['macd_signal'], df['macd_hist'] = talib.MACD(
-                df['close'], fastperiod=12, slowperiod=26, signalperiod=9
-            )
-            df['adx'] = talib.ADX(df['high'], df['low'], df['close'], timeperiod=14)
-            df['sar'] = talib.SAR(df['high'], df['low'], acceleration=0.02, maximum=0.2)
-            df['rsi'] = talib.RSI(df['close'], timeperiod=14)
-            df['rsi_norm'] = df['rsi'] / 100
-            df['stoch_k'], df['stoch_d'] = talib.STOCH(
-                df['high'], df['low'], df['close'],
-                fastk_period=14, slowk_period=3, slowd_period=3
-            )
-            df['stoch_norm'] = df['stoch_k'] / 100
-            df['cci'] = talib.CCI(df['high'], df['low'], df['close'], timeperiod=20)
-            df['williams_r'] = talib.WILLR(df['high'], df['low'], df['close'], timeperiod=14)
-            df['bb_upper'], df['bb_middle'], df['bb_lower'] = talib.BBANDS(
-                df['close'], timeperiod=20, nbdevup=2, nbdevdn=2, matype=0
-            )
-            df['atr'] = talib.ATR(df['high'], df['low'], df['close'], timeperiod=14)
-            df['obv'] = talib.OBV(df['close'], df['tick_volume'].astype(float))
-            df['mfi'] = talib.MFI(df['high'], df['low'], df['close'],
-                                df['tick_volume'].astype(float), timeperiod=14)
-        else:
-            # Usar biblioteca ta como alternativa
-            for period in [5, 10, 20, 50, 100, 200]:
-                df[f'sma_{period}'] = ta.trend.sma_indicator(df['close'], window=period)
-                df[f'ema_{period}'] = ta.trend.ema_indicator(df['close'], window=period)
-                df[f'price_to_sma_{period}'] = df['close'] / (df[f'sma_{period}'] + 1e-10)
-                df[f'price_to_ema_{period}'] = df['close'] / (df[f'ema_{period}'] + 1e-10)
-
-            macd = ta.trend.MACD(df['close'])
-            df['macd'] = macd.macd()
-            df['macd_signal'] = macd.macd_signal()
-            df['macd_hist'] = macd.macd_diff()
-            df['adx'] = ta.trend.adx(df['high'], df['low'], df['close'])
-            df['rsi'] = ta.momentum.rsi(df['close'])
-            df['rsi_norm'] = df['rsi'] / 100
-            stoch = ta.momentum.StochasticOscillator(df['high'], df['low'], df['close'])
-            df['stoch_k'] = stoch.stoch()
-            df['stoch_d'] = stoch.stoch_signal()
-            df['stoch_norm'] = df['stoch_k'] / 100
-            df['cci'] = ta.trend.cci(df['high'], df['low'], df['close'])
-            df['williams_r'] = ta.momentum.williams_r(df['high'], df['low'], df['close'])
-            bb = ta.volatility.BollingerBands(df['close'])
-            df['bb_upper'] = bb.bollinger_hband()
-            df['bb_middle'] = bb.bollinger_mavg()
-            df['bb_lower'] = bb.bollinger_lband()
-            df['atr'] = ta.volatility.average_true_range(df['high'], df['low'], df['close'])
-            df['obv'] = ta.volume.on_balance_volume(df['close'], df['tick_volume'])
-            df['mfi'] = ta.volume.money_flow_index(df['high'], df['low'],
-                                                  df['close'], df['tick_volume'])
-
-        # Características comunes
-        df['bb_position'] = (df['close'] - df['bb_lower']) / (df['bb_upper'] - df['bb_lower'] + 1e-10)
-        df['bb_width'] = (df['bb_upper'] - df['bb_lower']) / (df['bb_middle'] + 1e-10)
-        df['atr_pct'] = df['atr'] / df['close']
-
-        # 6. Indicadores de volumen
-        df['volume_sma'] = df['tick_volume'].rolling(20).mean()
-        df['volume_ratio'] = df['tick_volume'] / (df['volume_sma'] + 1e-10)
-        df['volume_delta'] = df['tick_volume'].diff()
-        df['volume_acceleration'] = df['volume_delta'].diff()
-
-        # 7. Patrones de velas
-        df['body_size'] = abs(df['close'] - df['open'])
-        df['upper_shadow'] = df['high'] - df[['open', 'close']].max(axis=1)
-        df['lower_shadow'] = df[['open', 'close']].min(axis=1) - df['low']
-        df['body_ratio'] = df['body_size'] / (df['high'] - df['low'] + 1e-10)
-
-        df['is_bullish'] = (df['close'] > df['open']).astype(int)
-        df['is_doji'] = (df['body_size'] < df['atr'] * 0.1).astype(int)
-        df['is_hammer'] = ((df['lower_shadow'] > df['body_size'] * 2) &
-                          (df['upper_shadow'] < df['body_size'] * 0.5)).astype(int)
-
-        # 8. Características de ciclos y estacionalidad
-        df['hour'] = df.index.hour if hasattr(df.index, 'hour') else 0
-        df['day_of_week'] = df.index.dayofweek if hasattr(df.index, 'dayofweek') else 0
-        df['day_of_month'] = df.index.day if hasattr(df.index, 'day') else 0
-        df['month'] = df.index.month if hasattr(df.index, 'month') else 0
-        df['quarter'] = df.index.quarter if hasattr(df.index, 'quarter') else 0
-
-        # 9. Características estadísticas
-        for window in [20, 50, 100]:
-            df[f'skewness_{window}'] = df['close'].rolling(window).skew()
-            df[f'kurtosis_{window}'] = df['close'].rolling(window).kurt()
-
-        # 10. Fractales y multi-timeframe
-        try:
-            df_4h = self.resample_timeframe(df.reset_index(), '4H')
-            df_4h_features = df_4h[['close', 'tick_volume']].add_prefix('4h_')
-            df_4h_features.index = df_4h.index
-
-            df = df.join(df_4h_features, how='left')
-            df['4h_price_ratio'] = df['close'] / (df['4h_close'] + 1e-10)
-        except Exception as e:
-            print(f"No se pudo añadir características multi-timeframe: {e}")
-
-        # 11. Lag features
-        for lag in [1, 2, 3, 5, 10]:
-            df[f'close_lag_{lag}'] = df['close'].shift(lag)
-            df[f'volume_lag_{lag}'] = df['tick_volume'].shift(lag)
-            df[f'return_lag_{lag}'] = df['returns'].shift(lag)
-
-        # 12. Rolling statistics adicionales
-        for window in [10, 20, 50]:
-            df[f'rolling_max_{window}'] = df['close'].rolling(window).max()
-            df[f'rolling_min_{window}'] = df['close'].rolling(window).min()
-            df[f'rolling_range_{window}'] = df[f'rolling_max_{window}'] - df[f'rolling_min_{window}']
-            df[f'price_position_rolling_{window}'] = (df['close'] - df[f'rolling_min_{window}']) / \
-                                                    (df[f'rolling_range_{window}'] + 1e-10)
+        # Columnas críticas para la limpieza de NaN: siempre se calculan
+        critical_cols = self.CRITICAL_FEATURES
+        requested = None if features is None else list(features) + critical_cols
+        df = FEATURE_REGISTRY.compute(df, requested, group='base', ctx={'processor': self},
+                                      dtype_policy=True)
+        timings = FEATURE_REGISTRY.last_timings
+        slowest = sorted(timings, key=timings.get, reverse=True)[:5]
 
         # ✅ Eliminar filas con NaN
-        critical_cols = ['close', 'returns', 'rsi', 'macd']
         df = df.dropna(subset=critical_cols)
 
         # ✅ Eliminar filas con NaN de forma más inteligente
         # En lugar de eliminar TODAS las filas con algún NaN,
         # eliminar solo las primeras que tienen NaN por los indicadores
-        initial_rows_to_drop = 200  # Ajustar según el indicador con más período
-        df = df.iloc[initial_rows_to_drop:].copy()
+        initial_rows_to_drop = max(200, FEATURE_REGISTRY.warmup(requested))  # Calentamiento declarado en el registro
+        df = df.iloc[initial_rows_to_drop:]
 
         # Rellenar NaN restantes con métodos apropiados
-        numeric_columns = df.select_dtypes(include=[np.number]).columns
-        df[numeric_columns] = df[numeric_columns].fillna(method='ffill').fillna(0)
+        df = apply_dtype_policy(fill_numeric_gaps(df))
 
         # ✅ DIAGNÓSTICO CORREGIDO con timeframe correcto
         print(f"\n🔍 DIAGNÓSTICO para {tf}:")
@@ -1370,110 +5951,56 @@ class AdvancedDataProcessor:
         print(f"  Filas totales después de limpieza: {len(df)}")
         print(f"  Columnas con NaN: {df.isna().any().sum()}")
         print(f"  Filas con algún NaN: {df.isna().any(axis=1).sum()}")
+        print(f"  Features más lentas (backend {INDICATORS.name}): " +
+              ", ".join(f"{name} {timings[name] * 1000:.0f}ms" for name in slowest))
 
         print(f"Características añadidas. Shape final: {df.shape}")
         return df
 
     def calculate_hurst_exponent(self, series, max_lag=100):
         """Calcula el exponente de Hurst para una serie temporal"""
-        try:
-            lags = range(2, min(max_lag, len(series)//2))
-            tau = [np.sqrt(np.std(np.subtract(series[lag:], series[:-lag]))) for lag in lags]
-            if len(tau) > 0 and len(lags) > 0:
-                poly = np.polyfit(np.log(lags), np.log(tau), 1)
-                return poly[0] * 2.0
-        except:
-            pass
-        return 0.5  # Valor neutral si no se puede calcular
+        return hurst_exponent(series, max_lag)
 
 
     # AÑADIR ESTOS MÉTODOS A LA CLASE AdvancedDataProcessor
     # (insertar después del método calculate_hurst_exponent)
 
     def analyze_stationarity(self, series, name="Series"):
-        """Analiza la estacionaridad de una serie temporal usando múltiples tests"""
-        results = {"series_name": name}
-
-        # Preparar serie
-        series_clean = series.dropna()
-        if len(series_clean) < 50:
-            print(f"⚠️ Serie {name} muy corta para análisis de estacionaridad")
-            return results
-
-        if STATIONARITY_AVAILABLE:
-            try:
-                # Test de Augmented Dickey-Fuller
-                adf_result = adfuller(series_clean, autolag='AIC')
-                results['adf_statistic'] = adf_result[0]
-                results['adf_pvalue'] = adf_result[1]
-                results['adf_is_stationary'] = adf_result[1] < 0.05
+        """Analiza la estacionaridad de una serie temporal usando múltiples tests
 
-                # Test KPSS (hipótesis nula es estacionaridad)
-                kpss_result = kpss(series_clean, regression='c')
-                results['kpss_statistic'] = kpss_result[0]
-                results['kpss_pvalue'] = kpss_result[1]
-                results['kpss_is_stationary'] = kpss_result[1] > 0.05
-
-                # Consenso: ambos tests deben concordar
-                results['is_stationary'] = results['adf_is_stationary'] and results['kpss_is_stationary']
-
-                print(f"📊 {name} - ADF p-value: {adf_result[1]:.4f}, KPSS p-value: {kpss_result[1]:.4f}")
-                print(f"   Estacionaria: {results['is_stationary']}")
-
-            except Exception as e:
-                print(f"⚠️ Error en tests de estacionaridad para {name}: {e}")
-                results['is_stationary'] = None
-        else:
-            # Test simplificado usando estadísticas básicas
-            # Dividir serie en mitades y comparar medias y varianzas
-            mid = len(series_clean) // 2
-            first_half = series_clean[:mid]
-            second_half = series_clean[mid:]
-
-            # Test t para diferencia de medias
-            t_stat, t_p = scipy_stats.ttest_ind(first_half, second_half)
-
-            # Test F para diferencia de varianzas
-            f_stat = np.var(first_half) / np.var(second_half)
-
-            # Heurística simple: si las mitades son significativamente diferentes, no es estacionaria
-            results['is_stationary'] = t_p > 0.05  # No hay diferencia significativa en medias
-            results['t_test_pvalue'] = t_p
-            results['variance_ratio'] = f_stat
-
-            print(f"📊 {name} - Test simplificado p-value: {t_p:.4f}")
-            print(f"   Estacionaria (heurística): {results['is_stationary']}")
+        Delegado en StationarityService: muestra acotada y caché por contenido.
+        """
+        return self.stationarity.analyze(series, name)
 
-        return results
+    def detect_market_regimes(self, df, price_col='close', n_regimes=3, lookback=20,
+                              timeframe: Optional[str] = None):
+        """Detecta regímenes de mercado usando Gaussian Mixture Models
 
-    def detect_market_regimes(self, df, price_col='close', n_regimes=3, lookback=20):
-        """Detecta regímenes de mercado usando Gaussian Mixture Models"""
+        Ver RegimeModel: ajuste sobre una submuestra estratificada y predicción por
+        bloques. Con timeframe (y config.REGIME_WARM_START) el modelo se guarda en
+        REGIME_MODEL_DIR/<archivo de datos>/ y la siguiente ejecución sobre el mismo
+        archivo arranca de él, con las mismas etiquetas.
+        """
         print(f"🔍 Detectando {n_regimes} regímenes de mercado...")
 
         # Calcular características para detección de regímenes
-        returns = df[price_col].pct_change().fillna(0)
-        volatility = returns.rolling(lookback).std()
-        trend = df[price_col].rolling(lookback).apply(lambda x: np.polyfit(range(len(x)), x, 1)[0] if len(x) > 1 else 0)
-
-        # Preparar matriz de características para GMM
-        features = pd.DataFrame({
-            'returns': returns,
-            'volatility': volatility,
-            'trend': trend,
-            'price_momentum': df[price_col].pct_change(lookback).fillna(0),
-            'volume_momentum': df.get('tick_volume', df.get('volume', pd.Series(1, index=df.index))).pct_change(lookback).fillna(0)
-        }).fillna(0)
-
-        # Normalizar características
-        scaler = StandardScaler()
-        features_scaled = scaler.fit_transform(features)
+        features = regime_features(df, price_col, lookback)
+        returns, volatility, trend = features['returns'], features['volatility'], features['trend']
 
         # Aplicar Gaussian Mixture Model
         try:
-            gmm = GaussianMixture(n_components=n_regimes, random_state=config.RANDOM_STATE,
-                                covariance_type='full', max_iter=100)
-            regimes = gmm.fit_predict(features_scaled)
-            regime_probs = gmm.predict_proba(features_scaled)
+            path = RegimeModel.model_path(self.filepath, timeframe, n_regimes, lookback) if timeframe else None
+            previous = RegimeModel.load(path, n_regimes, lookback) \
+                if path and config.REGIME_WARM_START else None
+            start = time.perf_counter()
+            model = RegimeModel(n_regimes, lookback).fit(features, previous=previous)
+            print(f"  GMM ajustado en {time.perf_counter() - start:.2f}s "
+                  f"({'en caliente' if model.warm_started else 'en frío'}, {model.n_iter} iteraciones)")
+            regime_probs = model.predict_proba(features)
+            regimes = np.argmax(regime_probs, axis=1)
+            if path and config.REGIME_WARM_START:
+                model.save(path)
+            self.regime_model = model
 
             # Analizar características de cada régimen
             regime_analysis = {}
@@ -1519,91 +6046,31 @@ class AdvancedDataProcessor:
 
         return df
 
-    def advanced_feature_engineering(self, df):
-        """Ingeniería de características avanzada basada en análisis de mercado"""
+    def advanced_feature_engineering(self, df, features: Optional[List[str]] = None):
+        """Ingeniería de características avanzada basada en análisis de mercado
+
+        features: si se indica, solo se calculan esas features avanzadas (y sus
+        dependencias) y al final se descartan las columnas del registro no pedidas.
+        """
         print("🔧 Aplicando ingeniería de características avanzada...")
+        needed = {spec.outputs[0] for spec in FEATURE_REGISTRY.resolve(features, group='advanced')}
 
-        # 1. Análisis de estacionaridad para características clave
+        # 1. Análisis de estacionaridad para características clave (solo lo usa returns_diff)
         stationarity_results = {}
-        key_series = ['close', 'returns', 'tick_volume'] if 'returns' in df.columns else ['close']
-
-        for col in key_series:
-            if col in df.columns:
-                stationarity_results[col] = self.analyze_stationarity(df[col], col)
-
-        # 2. Características basadas en estacionaridad
-        if 'returns' in df.columns:
-            # Si los returns no son estacionarios, usar diferenciación
-            if (stationarity_results.get('returns', {}).get('is_stationary') == False):
-                df['returns_diff'] = df['returns'].diff()
-                df['returns_diff2'] = df['returns_diff'].diff()
-                print("📈 Añadidas características diferenciadas para estacionaridad")
-
-        # 3. Detección de outliers usando métodos robustos
-        if 'returns' in df.columns:
-            returns = df['returns'].fillna(0)
-
-            # Z-score modificado (usando MAD en lugar de std)
-            median_return = returns.median()
-            mad = median_abs_deviation(returns)
-            df['return_zscore_robust'] = (returns - median_return) / (mad + 1e-8)
-
-            # Detectar outliers (threshold = 3.5 para MAD)
-            df['is_outlier'] = (np.abs(df['return_zscore_robust']) > 3.5).astype(int)
-
-            # Percentil rolling para detección de valores extremos
-            df['return_percentile_20'] = returns.rolling(50).rank(pct=True)
-
-        # 4. Características de microestructura del mercado
-        if 'tick_volume' in df.columns:
-            # VWAP (Volume Weighted Average Price) aproximado
-            df['vwap_5'] = (df['close'] * df['tick_volume']).rolling(5).sum() / df['tick_volume'].rolling(5).sum()
-            df['price_vs_vwap'] = df['close'] / (df['vwap_5'] + 1e-8) - 1
-
-            # Order flow imbalance (proxy usando volumen y precio)
-            df['volume_price_trend'] = df['tick_volume'] * np.sign(df['close'].diff().fillna(0))
-            df['vpt_ma'] = df['volume_price_trend'].rolling(10).mean()
-
-        # 5. Características de momentum adaptativo
-        for window in [5, 10, 20]:
-            if 'close' in df.columns:
-                # Momentum con ajuste por volatilidad
-                volatility = df['close'].pct_change().rolling(window).std()
-                raw_momentum = df['close'].pct_change(window).fillna(0)
-                df[f'vol_adjusted_momentum_{window}'] = raw_momentum / (volatility + 1e-8)
-
-                # RSI dinámico (período adaptativo basado en volatilidad)
-                # high_vol_periods = (volatility > volatility.rolling(50).quantile(0.7))
-                # rsi_period = np.where(high_vol_periods, window//2, window)
-                # Nota: Implementación simplificada, en producción usar períodos variables reales
-                df[f'adaptive_rsi_{window}'] = ta.momentum.rsi(df['close'], window=window)
-
-        # 6. Características de correlación temporal (autocorrelación)
-        if 'returns' in df.columns and len(df) > 100:
-            returns = df['returns'].fillna(0)
-
-            # Autocorrelación a diferentes lags
-            for lag in [1, 5, 10]:
-                df[f'autocorr_lag_{lag}'] = returns.rolling(50).apply(
-                    lambda x: x.autocorr(lag=lag) if len(x) > lag else 0
-                )
+        if 'returns_diff' in needed:
+            key_series = ['close', 'returns', 'tick_volume'] if 'returns' in df.columns else ['close']
 
-        # 7. Características de persistencia y reversión
-        if 'close' in df.columns:
-            # Hurst exponent rolling
-            df['hurst_50'] = df['close'].rolling(50).apply(
-                lambda x: self.calculate_hurst_exponent(x) if len(x) >= 50 else 0.5
-            )
+            stationarity_results = self.stationarity.analyze_many(
+                {col: df[col] for col in key_series if col in df.columns})
 
-            # Half-life de reversión a la media
-            for ma_period in [20, 50]:
-                ma_col = f'sma_{ma_period}'
-                if ma_col in df.columns:
-                    deviation = df['close'] / df[ma_col] - 1
-                    # Aproximación del half-life usando autocorrelación
-                    df[f'mean_reversion_hl_{ma_period}'] = deviation.rolling(50).apply(
-                        lambda x: -np.log(2) / np.log(abs(x.autocorr(lag=1)) + 1e-8) if abs(x.autocorr(lag=1)) > 1e-8 else np.inf if abs(x.autocorr(lag=1)) < 1e-8 else -np.inf # Handle edge cases
-                    ).replace([np.inf, -np.inf], np.nan).fillna(0) # Replace inf with 0
+        # 2-8. Diferenciación, outliers, microestructura, momentum adaptativo,
+        # autocorrelación, Hurst, half-life y ADF de ventana (ver FEATURE_REGISTRY, grupo 'advanced')
+        df = FEATURE_REGISTRY.compute(df, features, group='advanced',
+                                      ctx={'processor': self, 'stationarity': stationarity_results},
+                                      dtype_policy=True)
+        if features is not None:
+            df = FEATURE_REGISTRY.prune(df, features)
+        df = apply_dtype_policy(df)
 
         print(f"✅ Características avanzadas añadidas. Shape final: {df.shape}")
         return df
@@ -1761,7 +6228,7 @@ class AdvancedDataProcessor:
         # 2. DESPUÉS excluir columnas para features
         exclude_cols = ['open', 'high', 'low', 'close', 'time']
         feature_cols = [col for col in df.columns if col not in exclude_cols]
-        X = df[feature_cols].copy()
+        X = apply_dtype_policy(df[feature_cols].copy())
 
         # 3. Verificar que tenemos datos
         print(f"  📈 Antes de limpiar: X shape={X.shape}, y shape={y.shape}")
@@ -1800,13 +6267,13 @@ class AdvancedDataProcessor:
             raise ValueError("Método debe ser 'minmax', 'robust' o 'standard'")
 
         X_train_scaled = pd.DataFrame(
-            scaler.fit_transform(X_train),
+            scaler.fit_transform(X_train).astype(config.FEATURE_DTYPE, copy=False),
             columns=X_train.columns,
             index=X_train.index
         )
 
         X_test_scaled = pd.DataFrame(
-            scaler.transform(X_test),
+            scaler.transform(X_test).astype(config.FEATURE_DTYPE, copy=False),
             columns=X_test.columns,
             index=X_test.index
         )
@@ -4738,6 +9205,76 @@ class AdvancedRiskManagementSystem:
 # @title
 # REEMPLAZAR LA FUNCIÓN main() CON ESTA VERSIÓN QUE INCLUYE GESTIÓN ADAPTATIVA DE DATOS
 
+class RunStageCache:
+    """Caché de etapas con alcance de una ejecución de main()
+
+    Las etapas comunes a todos los timeframes (carga del CSV, barras + features)
+    se calculan la primera vez que se piden y se reutilizan en las iteraciones
+    siguientes. Cada reutilización ahorra el tiempo que costó calcular la etapa.
+    """
+
+    def __init__(self):
+        self._values = {}
+        self._seconds = {}
+        self._hits = {}
+
+    def get(self, stage: str, compute):
+        """Valor de la etapa; compute() solo se llama si aún no está en caché"""
+        if stage in self._values:
+            self._hits[stage] += 1
+            print(f"♻️ Etapa '{stage}' reutilizada (ahorro ~{self._seconds[stage]:.1f}s)")
+            return self._values[stage]
+        start_time = time.time()
+        value = compute()
+        self._values[stage] = value
+        self._seconds[stage] = time.time() - start_time
+        self._hits[stage] = 0
+        return value
+
+    def time_saved(self) -> float:
+        return sum(self._seconds[stage] * self._hits[stage] for stage in self._values)
+
+    def report(self):
+        print("\n⏱️ Caché de etapas de la ejecución:")
+        for stage in self._values:
+            print(f"   {stage}: {self._seconds[stage]:.1f}s × {self._hits[stage]} reutilizaciones")
+        print(f"   Tiempo ahorrado: ~{self.time_saved():.1f}s")
+
+def _selected_features_path(timeframe: str, filepath: str = DATA_FILE) -> str:
+    """Ruta estable (por archivo de datos y timeframe) de las features seleccionadas"""
+    stem = os.path.splitext(os.path.basename(filepath))[0]
+    return os.path.join(config.SELECTED_FEATURES_DIR, stem, f'{timeframe}.json')
+
+
+def save_selected_features(output_path: str, timeframe: str, features: List[str]):
+    """Guarda las features seleccionadas para que el próximo reentrenamiento calcule solo esas
+
+    La copia de SELECTED_FEATURES_DIR es la que lee load_selected_features (escrita de
+    forma atómica); la de output_path/feature_analysis queda con los resultados de la ejecución.
+    """
+    selection = {'timeframe': timeframe, 'features': list(dict.fromkeys(features))}
+    path = _selected_features_path(timeframe)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(selection, f, indent=4)
+    os.replace(tmp_path, path)
+    with open(os.path.join(output_path, 'feature_analysis', 'selected_features.json'), 'w') as f:
+        json.dump(selection, f, indent=4)
+
+
+def load_selected_features(timeframes: List[str]) -> Dict[str, List[str]]:
+    """Features seleccionadas en la ejecución anterior, por timeframe"""
+    feature_sets = {}
+    for tf in timeframes:
+        path = _selected_features_path(tf)
+        if os.path.exists(path):
+            with open(path) as f:
+                feature_sets[tf] = json.load(f)['features']
+            print(f"♻️ {tf}: se calcularán solo {len(feature_sets[tf])} features seleccionadas previamente")
+    return feature_sets
+
+
 @timer_decorator
 def main():
     print("\n" + "="*80)
@@ -4746,6 +9283,8 @@ def main():
 
     data_manager = AdaptiveDataManager()
     all_results = {}
+    stage_cache = RunStageCache()  # Carga y features una sola vez por ejecución
+    feature_sets = load_selected_features(TIMEFRAMES) if config.REUSE_SELECTED_FEATURES else {}
 
     # ✅ BARRA DE PROGRESO PARA TIMEFRAMES
     for tf in tqdm(TIMEFRAMES, desc="🕐 Procesando timeframes", position=0):
@@ -4776,13 +9315,14 @@ def main():
             # [1] CARGAR DATOS
             print("\n[1] 📥 CARGANDO DATOS")
             with tqdm(total=1, desc="Cargando CSV", bar_format='{l_bar}{bar}| {elapsed}') as pbar:
-                processor = AdvancedDataProcessor(DATA_FILE)
-                df_raw = processor.load_data(DATA_FILE, nrows=MAX_ROWS)
+                df_raw = stage_cache.get('load_data', lambda: processor.load_data(
+                    DATA_FILE, nrows=MAX_ROWS, from_end=config.LOAD_MOST_RECENT))
                 pbar.update(1)
 
             # [2] PROCESAR TIMEFRAMES
             print("\n[2] ⚙️  PROCESANDO MÚLTIPLES TIMEFRAMES")
-            timeframe_data = processor.create_multiple_timeframes(df_raw)
+            timeframe_data = stage_cache.get('timeframes', lambda: processor.create_multiple_timeframes(
+                df_raw, features=feature_sets or None))
 
             # 3. APLICAR GESTIÓN ADAPTATIVA DE DATOS PARA ESTE TIMEFRAME
             print(f"\n[3] APLICANDO GESTIÓN ADAPTATIVA DE DATOS PARA {tf}")
@@ -4821,16 +9361,13 @@ def main():
             print(f"\n[4] ANÁLISIS AVANZADO DE DATOS OPTIMIZADOS PARA {tf}")
 
             # Análisis de estacionaridad para series clave
-            stationarity_results = {}
-            for col in ['close', 'tick_volume']:
-                if col in df.columns:
-                    stationarity_results[col] = processor.analyze_stationarity(df[col], f"{tf}_{col}")
+            columns = [col for col in ['close', 'tick_volume'] if col in df.columns]
+            tested = processor.stationarity.analyze_many({f"{tf}_{col}": df[col] for col in columns})
+            stationarity_results = {col: tested[f"{tf}_{col}"] for col in columns}
 
-            # Detectar regímenes de mercado en datos optimizados
-            df = processor.detect_market_regimes(df, price_col='close', n_regimes=3)
-
-            # Ingeniería de características avanzada
-            df = processor.advanced_feature_engineering(df)
+            # Detectar regímenes de mercado + ingeniería de características avanzada
+            # (leídas del FeatureStore si los datos optimizados no han cambiado)
+            df = processor.stored_advanced_features(df, tf, n_regimes=3, features=feature_sets.get(tf))
 
             # 5. PREPARACIÓN DE DATOS PARA ML
             print(f"\n[5] PREPARANDO DATOS PARA ML (TAMAÑO OPTIMIZADO)")
@@ -4867,6 +9404,7 @@ def main():
             X_clf_selected, selected_features_clf = processor.robust_feature_selection(
                 X_clf, y_clf, method=selection_method, k=max_features
             )
+            save_selected_features(OUTPUT_PATH_2, tf, selected_features_reg + selected_features_clf)
 
             # 6. CONFIGURACIÓN DE VALIDACIÓN TEMPORAL ADAPTATIVA
             print(f"\n[6] CONFIGURANDO VALIDACIÓN TEMPORAL ADAPTATIVA")
@@ -5445,6 +9983,8 @@ def main():
 
 
 
+    stage_cache.report()
+
     print("\n" + "="*80)
     print("✅ PIPELINE COMPLETADO")
     print("="*80)